@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+#
+# benchmarks: performance tests for rpmspectool
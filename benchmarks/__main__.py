@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+#
+# benchmarks: performance tests for rpmspectool
+#
+# Run benchmarks and store the results:
+#     python -m benchmarks run --output results.json
+# Compare results, e.g. of two releases:
+#     python -m benchmarks compare old.json new.json
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+from rpmspectool.download import download
+from rpmspectool.rpm import RPMSpecHandler, eval_specfiles
+from rpmspectool.version import version
+
+from .server import BenchmarkServer
+from .specgen import PRESETS, generate_spec
+
+RESULTS_FORMAT = 1
+
+EVAL_PHASES = ("write_rpm_macros", "write_preamble", "run_rpmbuild", "parse_output")
+
+MiB = 1 << 20
+
+# number of spec files evaluated per batch benchmark run
+EVAL_BATCH_SPECS = 20
+
+# name -> (number of files, size of each file)
+DOWNLOAD_SCENARIOS = {
+    "many-small": (200, 16 * 1024),
+    "few-huge": (2, 256 * MiB),
+}
+
+
+def cpu_time():
+    """CPU time used by this process and its waited-for children."""
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def summarize(samples, **extra):
+    """Condense samples of a measurement into comparable statistics."""
+    return {
+        "samples": samples,
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+    } | extra
+
+
+def bench_eval(preset, repeat, tmpdir):
+    """Time the phases of RPMSpecHandler.eval_specfile() on a synthetic spec file."""
+    spec_path = os.path.join(tmpdir, f"{preset}.spec")
+    with open(spec_path, "w") as fobj:
+        fobj.write(generate_spec(**PRESETS[preset]))
+
+    phase_samples = {phase: [] for phase in EVAL_PHASES + ("total",)}
+    cpu_samples = []
+
+    for i in range(repeat):
+        run_dir = tempfile.mkdtemp(dir=tmpdir)
+        handler = RPMSpecHandler(run_dir, spec_path, os.path.join(run_dir, "out.spec"))
+
+        cpu_start = cpu_time()
+        total_start = time.perf_counter()
+
+        start = time.perf_counter()
+        handler.write_rpm_macros()
+        phase_samples["write_rpm_macros"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        handler.write_preamble()
+        phase_samples["write_preamble"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        stdout = handler.run_rpmbuild()
+        phase_samples["run_rpmbuild"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        handler.parse_output(stdout)
+        phase_samples["parse_output"].append(time.perf_counter() - start)
+
+        phase_samples["total"].append(time.perf_counter() - total_start)
+        cpu_samples.append(cpu_time() - cpu_start)
+
+        shutil.rmtree(run_dir)
+
+    results = {
+        f"eval/{preset}/{phase}": summarize(samples, unit="s")
+        for phase, samples in phase_samples.items()
+    }
+    results[f"eval/{preset}/cpu"] = summarize(cpu_samples, unit="s")
+
+    return results
+
+
+def bench_eval_batch(preset, repeat, batch_size, tmpdir):
+    """Time evaluating several spec files with eval_specfiles() in batches."""
+    spec_path = os.path.join(tmpdir, f"{preset}.spec")
+    with open(spec_path, "w") as fobj:
+        fobj.write(generate_spec(**PRESETS[preset]))
+
+    samples = []
+    cpu_samples = []
+
+    for i in range(repeat):
+        run_dir = tempfile.mkdtemp(dir=tmpdir)
+        handlers = []
+        for n in range(EVAL_BATCH_SPECS):
+            spec_dir = os.path.join(run_dir, str(n))
+            os.mkdir(spec_dir)
+            handlers.append(RPMSpecHandler(spec_dir, spec_path, os.path.join(spec_dir, "out.spec")))
+
+        cpu_start = cpu_time()
+        start = time.perf_counter()
+        for n in range(0, EVAL_BATCH_SPECS, batch_size):
+            eval_specfiles(handlers[n : n + batch_size])
+        samples.append((time.perf_counter() - start) / EVAL_BATCH_SPECS)
+        cpu_samples.append((cpu_time() - cpu_start) / EVAL_BATCH_SPECS)
+
+        shutil.rmtree(run_dir)
+
+    return {
+        f"eval-batch/{preset}/batch={batch_size}/per-spec": summarize(samples, unit="s"),
+        f"eval-batch/{preset}/batch={batch_size}/cpu-per-spec": summarize(cpu_samples, unit="s"),
+    }
+
+
+def bench_download(scenario, repeat, jobs, tmpdir, server, scale=1.0):
+    """Time downloading files from a local server with download()."""
+    nfiles, size = DOWNLOAD_SCENARIOS[scenario]
+    size = max(1, int(size * scale))
+    urls = [server.file_url(f"file{i}.bin", size) for i in range(nfiles)]
+
+    wall_samples = []
+    cpu_samples = []
+
+    for i in range(repeat):
+        where = tempfile.mkdtemp(dir=tmpdir)
+
+        cpu_start = cpu_time()
+        start = time.perf_counter()
+        # keep progress messages out of the way
+        with (
+            open(os.devnull, "w") as devnull,
+            redirect_stdout(devnull),
+            ThreadPoolExecutor(max_workers=jobs) as executor,
+        ):
+            for future in [executor.submit(download, url, where=where) for url in urls]:
+                future.result()
+        wall_samples.append(time.perf_counter() - start)
+        cpu_samples.append(cpu_time() - cpu_start)
+
+        shutil.rmtree(where)
+
+    total_bytes = nfiles * size
+    name = f"download/{scenario}/jobs={jobs}"
+
+    return {
+        f"{name}/wall": summarize(wall_samples, unit="s", bytes=total_bytes),
+        f"{name}/cpu": summarize(cpu_samples, unit="s", bytes=total_bytes),
+        f"{name}/throughput": summarize(
+            [total_bytes / t for t in wall_samples], unit="B/s", higher_is_better=True
+        ),
+        f"{name}/cpu_per_gib": summarize(
+            [t * (1 << 30) / total_bytes for t in cpu_samples], unit="s/GiB"
+        ),
+    }
+
+
+def rpm_version():
+    try:
+        return subprocess.run(
+            ("rpm", "--version"), capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def cmd_run(args):
+    results = {}
+
+    with tempfile.TemporaryDirectory(prefix="rpmspectool_bench_") as tmpdir:
+        if "eval" in args.only:
+            if rpm_version():
+                for preset in args.presets:
+                    print(f"Benchmarking evaluation of {preset} spec file…", file=sys.stderr)
+                    results |= bench_eval(preset, args.repeat, tmpdir)
+                    for batch_size in args.batch_sizes:
+                        print(
+                            f"Benchmarking evaluation of {preset} spec files in batches of"
+                            + f" {batch_size}…",
+                            file=sys.stderr,
+                        )
+                        results |= bench_eval_batch(preset, args.repeat, batch_size, tmpdir)
+            else:
+                print("rpm not found, skipping evaluation benchmarks", file=sys.stderr)
+
+        if "download" in args.only:
+            with BenchmarkServer() as server:
+                for scenario in args.scenarios:
+                    for jobs in args.download_jobs:
+                        print(
+                            f"Benchmarking download of {scenario} files with {jobs} job(s)…",
+                            file=sys.stderr,
+                        )
+                        results |= bench_download(
+                            scenario, args.repeat, jobs, tmpdir, server, scale=args.scale
+                        )
+
+    report = {
+        "format": RESULTS_FORMAT,
+        "meta": {
+            "rpmspectool": version,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "rpm": rpm_version(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "repeat": args.repeat,
+            "scale": args.scale,
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as fobj:
+            json.dump(report, fobj, indent=2)
+            fobj.write("\n")
+
+    for name, result in results.items():
+        print(f"{name}: median {result['median']:.6g} {result['unit']}")
+
+    return 0
+
+
+def cmd_compare(args):
+    with open(args.old) as fobj:
+        old = json.load(fobj)
+    with open(args.new) as fobj:
+        new = json.load(fobj)
+
+    regressions = 0
+
+    for name in sorted(old["results"].keys() & new["results"].keys()):
+        old_result = old["results"][name]
+        new_result = new["results"][name]
+        ratio = new_result["median"] / old_result["median"] if old_result["median"] else 1.0
+        if old_result.get("higher_is_better"):
+            regressed = ratio < 1 - args.threshold
+        else:
+            regressed = ratio > 1 + args.threshold
+        marker = "REGRESSION" if regressed else "ok"
+        print(
+            f"{marker:10} {name}: {old_result['median']:.6g} -> {new_result['median']:.6g}"
+            + f" {new_result['unit']} ({ratio - 1:+.1%})"
+        )
+        regressions += regressed
+
+    return 1 if regressions else 0
+
+
+def get_arg_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description="Benchmarks for rpmspectool"
+    )
+    commands = parser.add_subparsers(dest="cmd", required=True)
+
+    run_cmd = commands.add_parser("run", help="Run benchmarks")
+    run_cmd.add_argument("--output", "-o", help="Store results in this JSON file")
+    run_cmd.add_argument("--repeat", "-r", type=int, default=5)
+    run_cmd.add_argument(
+        "--only", action="append", choices=("eval", "download"), help="Only run these benchmarks"
+    )
+    run_cmd.add_argument(
+        "--preset", dest="presets", action="append", choices=sorted(PRESETS), help="Spec sizes"
+    )
+    run_cmd.add_argument(
+        "--batch-size",
+        dest="batch_sizes",
+        type=int,
+        action="append",
+        help="Number of spec files evaluated per rpmbuild run",
+    )
+    run_cmd.add_argument(
+        "--scenario",
+        dest="scenarios",
+        action="append",
+        choices=sorted(DOWNLOAD_SCENARIOS),
+        help="Download scenarios",
+    )
+    run_cmd.add_argument(
+        "--download-jobs", type=int, action="append", help="Number of parallel downloads"
+    )
+    run_cmd.add_argument(
+        "--scale", type=float, default=1.0, help="Scale the size of downloaded files"
+    )
+
+    compare_cmd = commands.add_parser("compare", help="Compare stored results")
+    compare_cmd.add_argument("old")
+    compare_cmd.add_argument("new")
+    compare_cmd.add_argument(
+        "--threshold", type=float, default=0.1, help="Relative change to flag as regression"
+    )
+
+    return parser
+
+
+def main():
+    args = get_arg_parser().parse_args()
+
+    if args.cmd == "run":
+        args.only = args.only or ["eval", "download"]
+        args.presets = args.presets or sorted(PRESETS)
+        args.batch_sizes = args.batch_sizes or [1, EVAL_BATCH_SPECS]
+        args.scenarios = args.scenarios or sorted(DOWNLOAD_SCENARIOS)
+        args.download_jobs = args.download_jobs or [1, 4]
+        return cmd_run(args)
+    else:  # args.cmd == "compare"
+        return cmd_compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# benchmarks.server: local HTTP server serving synthetic files
+
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHUNK = bytes(range(256)) * 256
+
+
+class SyntheticFileHandler(BaseHTTPRequestHandler):
+    """Serve files of any size, /NAME?size=N serves N bytes."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _serve(self, with_body):
+        _, _, query = self.path.partition("?")
+        params = dict(p.split("=", 1) for p in query.split("&") if "=" in p)
+        size = int(params.get("size", 0))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size))
+        self.send_header("Last-Modified", formatdate(10**9, usegmt=True))
+        self.end_headers()
+
+        if with_body:
+            remaining = size
+            chunk_view = memoryview(CHUNK)
+            while remaining:
+                n = min(remaining, len(CHUNK))
+                self.wfile.write(chunk_view[:n])
+                remaining -= n
+
+    def do_HEAD(self):
+        self._serve(with_body=False)
+
+    def do_GET(self):
+        self._serve(with_body=True)
+
+
+class LocalHTTPServer(ThreadingHTTPServer):
+    """A threaded HTTP server on localhost, running in the background.
+
+    Used as a context manager, the server is started on entering and
+    stopped on leaving. It listens on a free port.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, handler_class):
+        super().__init__(("127.0.0.1", 0), handler_class)
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_port}{path}"
+
+
+class BenchmarkServer(LocalHTTPServer):
+    """A local HTTP server serving synthetic files."""
+
+    def __init__(self):
+        super().__init__(SyntheticFileHandler)
+
+    def file_url(self, name, size):
+        return self.url(f"/{name}?size={size}#/{name}")
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# benchmarks.specgen: generate synthetic spec files
+
+# name -> keyword arguments for generate_spec()
+PRESETS = {
+    "small": {"sources": 2, "patches": 5, "macro_depth": 1, "filler_lines": 20, "subpackages": 0},
+    "medium": {
+        "sources": 20,
+        "patches": 100,
+        "macro_depth": 3,
+        "filler_lines": 500,
+        "subpackages": 5,
+    },
+    "large": {
+        "sources": 100,
+        "patches": 1000,
+        "macro_depth": 8,
+        "filler_lines": 5000,
+        "subpackages": 50,
+    },
+}
+
+
+def generate_spec(sources=2, patches=5, macro_depth=1, filler_lines=20, subpackages=0):
+    """Generate the text of a synthetic spec file.
+
+    :param sources: the number of Source tags
+    :param patches: the number of Patch tags, every other one unnumbered
+    :param macro_depth: how deeply macros used in URLs are nested
+    :param filler_lines: the number of BuildRequires lines in the
+        preamble, and of %changelog lines
+    :param subpackages: the number of subpackages
+    """
+    lines = [
+        "%bcond_without feature",
+        "%global forgeurl https://example.com/upstream/bench",
+        "%global m0 %{version}",
+    ]
+    for depth in range(1, macro_depth + 1):
+        lines.append(f"%global m{depth} %{{?with_feature:%{{m{depth - 1}}}}}")
+
+    lines.extend(
+        [
+            "",
+            "Name: bench",
+            "Version: 1.2.3",
+            "Release: 1%{?dist}",
+            "Summary: Synthetic spec file for benchmarks",
+            "License: MIT",
+            "URL: %{forgeurl}",
+        ]
+    )
+
+    for i in range(sources):
+        lines.append(f"Source{i}: %{{url}}/archive/v%{{m{macro_depth}}}/source{i}.tar.gz")
+
+    for i in range(patches):
+        if i % 2:
+            lines.append(f"Patch: %{{url}}/commit/%{{m{macro_depth}}}-{i}.patch")
+        else:
+            lines.append(f"Patch{i}: bench-{i}.patch")
+
+    for i in range(filler_lines):
+        lines.extend(
+            [
+                "%if %{with feature}",
+                f"BuildRequires: pkgconfig(bench-dependency-{i}) >= %{{m{macro_depth}}}",
+                "%endif",
+            ]
+        )
+
+    lines.extend(["", "%description", "%{summary}."])
+
+    for i in range(subpackages):
+        lines.extend(
+            [
+                "",
+                f"%package sub{i}",
+                f"Summary: Subpackage {i}",
+                "",
+                f"%description sub{i}",
+                f"Subpackage {i}.",
+            ]
+        )
+
+    lines.extend(["", "%prep", "%autosetup -p1", "", "%files", "", "%changelog"])
+
+    for i in range(filler_lines):
+        lines.append(f"- Change number {i}")
+
+    return "\n".join(lines) + "\n"
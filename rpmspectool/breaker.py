@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#
+# rpmspectool.breaker: stop trying hosts which are down
+
+import argparse
+import contextlib
+import json
+import threading
+import time
+from logging import debug as log_debug
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from .cache import write_json_atomically
+from .download import DownloadError, HostDownError
+
+# defaults for when to stop trying a host, and when to try it again
+HOST_FAILURES = 3
+PROBE_INTERVAL = 30
+
+
+class CircuitOpenError(DownloadError):
+    pass
+
+
+def url_host(url):
+    """The host (and port) a URL refers to."""
+    return urlsplit(url).netloc.rpartition("@")[2].lower()
+
+
+def mirror_spec(value):
+    """Parse HOST=URL, a mirror to fetch files on HOST from."""
+    host, sep, base_url = value.partition("=")
+    if not sep or not host or not base_url:
+        raise argparse.ArgumentTypeError(f"{value!r} isn't a mirror like HOST=URL")
+    return host.lower(), base_url.rstrip("/")
+
+
+class HostCircuitBreaker(object):
+    """Fail fast on hosts which are down.
+
+    After a number of consecutive failures to reach a host, its circuit
+    opens: further URLs on the host fail immediately, or are fetched from
+    a mirror configured for it instead. Once per probe interval, a URL is
+    let through to the host to find out if it's back, if that works the
+    circuit closes again.
+
+    With a state file, open circuits are remembered across runs, until
+    they expire.
+    """
+
+    def __init__(
+        self,
+        failures=HOST_FAILURES,
+        probe_interval=PROBE_INTERVAL,
+        mirrors=None,
+        state_path=None,
+        expiry=None,
+    ):
+        self.failures = failures
+        self.probe_interval = probe_interval
+        self.mirrors = dict(mirrors or ())
+        self.state_path = state_path
+        self.expiry = expiry
+
+        self._lock = threading.Lock()
+        # maps hosts to their failures and when their circuit opened
+        self.hosts = {}
+
+        if state_path is not None:
+            self._load()
+
+    def _state(self, host):
+        return self.hosts.setdefault(host, SimpleNamespace(failures=0, opened=None, probing=False))
+
+    def _load(self):
+        try:
+            with open(self.state_path) as fobj:
+                data = json.load(fobj)
+            hosts = data["hosts"]
+            now = time.time()
+            for host, opened in hosts.items():
+                if now - opened < self.expiry:
+                    state = self._state(host)
+                    state.failures = self.failures
+                    state.opened = opened
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            pass
+
+    def save(self):
+        """Remember open circuits for later runs, if there's a state file."""
+        if self.state_path is None:
+            return
+        with self._lock:
+            hosts = {
+                host: state.opened for host, state in self.hosts.items() if state.opened is not None
+            }
+        try:
+            write_json_atomically(self.state_path, {"hosts": hosts})
+        except OSError:
+            # remembering failing hosts is an optimization, failing to isn't an error
+            pass
+
+    def _mirror_url(self, url, host):
+        parts = urlsplit(url)
+        # the fragment can name the file, e.g. "…/v1.0.tar.gz#/foo-1.0.tar.gz"
+        return (
+            self.mirrors[host]
+            + parts.path
+            + (f"?{parts.query}" if parts.query else "")
+            + (f"#{parts.fragment}" if parts.fragment else "")
+        )
+
+    def route(self, url):
+        """Determine the URL to fetch a file from.
+
+        Raises CircuitOpenError if the host of the URL is down and no
+        mirror is configured for it.
+        """
+        host = url_host(url)
+
+        with self._lock:
+            state = self.hosts.get(host)
+            if state is None or state.opened is None:
+                return url
+            if not state.probing and time.time() - state.opened >= self.probe_interval:
+                log_debug("Probing if %s is back", host)
+                state.probing = True
+                return url
+
+        if host in self.mirrors:
+            mirror_url = self._mirror_url(url, host)
+            log_debug("%s is down, fetching %s from %s", host, url, mirror_url)
+            return mirror_url
+
+        raise CircuitOpenError(f"Couldn't download {url}: {host} is down, not trying it")
+
+    def record(self, url, ok):
+        """Note whether reaching the host of a URL worked."""
+        host = url_host(url)
+
+        with self._lock:
+            state = self._state(host)
+            state.probing = False
+            if ok:
+                if state.opened is not None:
+                    log_debug("%s is back", host)
+                state.failures = 0
+                state.opened = None
+                return
+            state.failures += 1
+            if state.failures >= self.failures:
+                if state.opened is None:
+                    print(f"{host} is down, not trying it for {self.probe_interval} seconds")
+                state.opened = time.time()
+
+    @contextlib.contextmanager
+    def attempt(self, url):
+        """Fetch a URL, or a mirror of it, and note if its host could be reached."""
+        fetch_url = self.route(url)
+        try:
+            yield fetch_url
+        except HostDownError:
+            self.record(fetch_url, False)
+            raise
+        except Exception:
+            # the host answered, e.g. that the file doesn't exist
+            self.record(fetch_url, True)
+            raise
+        else:
+            self.record(fetch_url, True)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# rpmspectool.bundle: ship fetched files to nodes without network access
+
+import errno
+import io
+import json
+import os
+import tarfile
+import time
+from tempfile import NamedTemporaryFile
+
+from .download import TargetLock, _fix_mode, _link_into_place
+from .lockfile import file_sha512
+from .version import version
+
+BUNDLE_VERSION = 1
+
+# the last member of a bundle, describing the others
+MANIFEST_NAME = "rpmspectool-bundle.json"
+
+# what a manifest entry describes
+ENTRY_KEYS = ("url", "filename", "size", "mtime", "sha512", "member", "offset")
+
+# chunk size for copying data out of a bundle
+COPY_CHUNK_SIZE = 1 << 20
+
+
+class BundleError(RuntimeError):
+    pass
+
+
+def _padded(size):
+    return -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+
+def write_bundle(path, files):
+    """Write fetched files and a manifest into an uncompressed tar archive.
+
+    files maps URLs to the paths of the fetched files. Files with
+    identical content are only stored once. The manifest lists for every
+    URL the file name, size, mtime, SHA512 hash and the offset of the
+    data in the bundle, so it can be copied out without unpacking the
+    archive.
+    """
+    entries = []
+    members = {}
+
+    dirname = os.path.dirname(path) or os.curdir
+    with NamedTemporaryFile(dir=dirname, prefix=os.path.basename(path), delete=False) as fobj:
+        try:
+            with tarfile.open(fileobj=fobj, mode="w", format=tarfile.PAX_FORMAT) as tar:
+                for url, fpath in sorted(files.items()):
+                    sha512 = file_sha512(fpath)
+                    st = os.stat(fpath)
+                    filename = os.path.basename(fpath)
+
+                    if sha512 not in members:
+                        tarinfo = tarfile.TarInfo(f"{sha512[:32]}/{filename}")
+                        tarinfo.size = st.st_size
+                        tarinfo.mtime = int(st.st_mtime)
+                        tarinfo.mode = 0o644
+                        with open(fpath, "rb") as src_fobj:
+                            tar.addfile(tarinfo, src_fobj)
+                        members[sha512] = (tarinfo.name, tar.offset - _padded(st.st_size))
+
+                    member, offset = members[sha512]
+                    entries.append(
+                        {
+                            "url": url,
+                            "filename": filename,
+                            "size": st.st_size,
+                            "mtime": int(st.st_mtime),
+                            "sha512": sha512,
+                            "member": member,
+                            "offset": offset,
+                        }
+                    )
+
+                manifest = json.dumps(
+                    {
+                        "version": BUNDLE_VERSION,
+                        "generator": f"rpmspectool {version}",
+                        "files": entries,
+                    },
+                    indent=2,
+                ).encode("utf-8")
+                tarinfo = tarfile.TarInfo(MANIFEST_NAME)
+                tarinfo.size = len(manifest)
+                tarinfo.mtime = int(time.time())
+                tar.addfile(tarinfo, io.BytesIO(manifest))
+        except BaseException:
+            os.unlink(fobj.name)
+            raise
+
+    os.chmod(fobj.name, 0o644)
+    os.replace(fobj.name, path)
+
+    return entries
+
+
+class Bundle(object):
+    """A bundle written by write_bundle(), to copy files out of."""
+
+    def __init__(self, path):
+        self.path = path
+
+        try:
+            with tarfile.open(path, mode="r:") as tar:
+                manifest = json.load(tar.extractfile(MANIFEST_NAME))
+        except OSError as exc:
+            raise BundleError(f"Can’t read bundle {path}: {exc.strerror}")
+        except (KeyError, ValueError, tarfile.TarError) as exc:
+            raise BundleError(f"Can’t read bundle {path}: {exc}")
+
+        if not isinstance(manifest, dict) or manifest.get("version") != BUNDLE_VERSION:
+            raise BundleError(f"Unsupported bundle {path}")
+
+        entries = manifest.get("files")
+        if not isinstance(entries, list) or not all(
+            isinstance(entry, dict) and all(key in entry for key in ENTRY_KEYS) for entry in entries
+        ):
+            raise BundleError(f"Invalid manifest in bundle {self.path}")
+
+        # maps URLs to their entries
+        self.files = {}
+        for entry in entries:
+            self.files.setdefault(entry["url"], []).append(entry)
+
+    def lookup(self, url, sha512=None):
+        """Find the entry for a URL, with the expected hash if known."""
+        for entry in self.files.get(url, ()):
+            if sha512 is None or entry["sha512"] == sha512:
+                return entry
+        return None
+
+    def _copy_data(self, entry, dst_fobj):
+        with open(self.path, "rb") as src_fobj:
+            src_fd = src_fobj.fileno()
+            dst_fd = dst_fobj.fileno()
+            offset = entry["offset"]
+            remaining = entry["size"]
+
+            # copy_file_range() lets the file system share or copy blocks without
+            # going through user space
+            try:
+                while remaining:
+                    copied = os.copy_file_range(
+                        src_fd, dst_fd, min(remaining, COPY_CHUNK_SIZE), offset_src=offset
+                    )
+                    if not copied:
+                        break
+                    offset += copied
+                    remaining -= copied
+            except OSError as exc:
+                if exc.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+
+            while remaining:
+                data = os.pread(src_fd, min(remaining, COPY_CHUNK_SIZE), offset)
+                if not data:
+                    break
+                dst_fobj.write(data)
+                offset += len(data)
+                remaining -= len(data)
+
+    def copy_file(self, entry, where=None, dry_run=False, force=False):
+        """Copy a file out of the bundle into a directory, verifying it."""
+        if where is None:
+            where = os.getcwd()
+
+        fpath = os.path.join(where, entry["filename"])
+
+        if dry_run:
+            print(f"NOT copying '{entry['url']}' from bundle '{self.path}' to '{fpath}'")
+            return
+
+        with TargetLock(fpath) as lock:
+            if lock.waited and os.path.exists(fpath):
+                print(f"Using '{fpath}' fetched by another process")
+                return
+
+            print(f"Copying '{entry['url']}' from bundle '{self.path}' to '{fpath}'")
+
+            with NamedTemporaryFile(dir=where, prefix=entry["filename"], mode="wb") as fobj:
+                self._copy_data(entry, fobj)
+                fobj.flush()
+
+                if (
+                    os.path.getsize(fobj.name) != entry["size"]
+                    or file_sha512(fobj.name) != entry["sha512"]
+                ):
+                    raise BundleError(
+                        f"Bundle {self.path} is damaged: {entry['member']} doesn’t match its hash"
+                    )
+
+                _link_into_place(fobj.name, fpath, force)
+
+            os.utime(fpath, (time.time(), entry["mtime"]))
+            _fix_mode(fpath)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# rpmspectool.cache: store results of evaluating spec files
+
+import hashlib
+import json
+import os
+from tempfile import NamedTemporaryFile
+
+from .rpm import RPMSpecHandler
+from .srpm import open_spec
+from .version import version
+
+
+def cache_dir():
+    """The directory in which rpmspectool caches data."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "rpmspectool")
+
+
+def preamble_digest(preamble, definitions=()):
+    """Compute a key for the result of evaluating a preamble.
+
+    The key covers the rpmspectool version, the macro definitions given
+    on the command line and the preamble text. It doesn't cover the
+    macro configuration of rpm (e.g. _sourcedir in ~/.rpmmacros), files
+    pulled in with %include, or output of %(...) and %{lua:...}:
+    computing the key must not involve running rpm.
+    """
+    digest = hashlib.sha256(f"rpmspectool {version}\0".encode("utf-8"))
+    for definition in definitions:
+        digest.update(f"%define {definition}\0".encode("utf-8"))
+    digest.update(preamble)
+    return digest.hexdigest()
+
+
+def spec_digest(specpath, definitions=()):
+    """Compute the key for the result of evaluating a spec file."""
+    with open_spec(specpath) as fobj:
+        preamble, _ = RPMSpecHandler.extract_preamble(fobj)
+    return preamble_digest(preamble, definitions)
+
+
+def write_json_atomically(path, data):
+    """Write data as JSON so that readers never see partial files."""
+    dirname = os.path.dirname(path)
+    os.makedirs(dirname, exist_ok=True)
+    with NamedTemporaryFile("w", dir=dirname, prefix=os.path.basename(path), delete=False) as fobj:
+        json.dump(data, fobj)
+    os.replace(fobj.name, path)
+
+
+class ResultCache(object):
+    """Results of evaluating spec files, keyed by digests of their preambles."""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(cache_dir(), "results")
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self._entry_path(key)) as fobj:
+                data = json.load(fobj)
+        except (OSError, ValueError):
+            return None
+
+        return {
+            "sources": {int(i): url for i, url in data["sources"].items()},
+            "patches": {int(i): url for i, url in data["patches"].items()},
+            "srcdir": data["srcdir"],
+        }
+
+    def put(self, key, result):
+        data = {
+            "sources": result["sources"],
+            "patches": result["patches"],
+            "srcdir": result.get("srcdir"),
+        }
+        try:
+            write_json_atomically(self._entry_path(key), data)
+        except OSError:
+            # caching is an optimization, failing to cache isn't an error
+            pass
@@ -6,19 +6,55 @@
 
 import argparse
 import atexit
+import contextlib
+import functools
+import json
 import logging
 import os
 import shutil
 import sys
 import tempfile
+import threading
+import time
 from logging import debug as log_debug
 from logging import error as log_error
 
 import argcomplete
 
-from .download import DownloadError, download, is_url
-from .rpm import RPMSpecEvalError, RPMSpecHandler
+from .breaker import HOST_FAILURES, PROBE_INTERVAL, HostCircuitBreaker, mirror_spec
+from .bundle import Bundle, BundleError, write_bundle
+from .cache import ResultCache, cache_dir, preamble_digest, spec_digest
+from .download import (
+    CHECK_CONNECTIONS,
+    CHECK_TIMEOUT,
+    DownloadError,
+    TransferCoalescer,
+    check_urls,
+    copy_local,
+    download,
+    is_local,
+    is_url,
+)
+from .extract import ExtractError, extract_archive
+from .lockfile import LockfileError, lock_entry, read_lockfile, verify_file, write_lockfile
+from .pipeline import Pipeline
+from .remote import RemoteSpecCache
+from .rpm import EVAL_STRATEGIES, RPMSpecEvalError, RPMSpecHandler, eval_specfiles
+from .schedule import DownloadSchedule
+from .shard import (
+    ShardError,
+    file_sizes,
+    merge_reports,
+    read_records,
+    select_shard,
+    shard_spec,
+    spec_weights,
+)
+from .srpm import SRPMError, is_srpm, open_spec
+from .trace import span, start_tracing, stop_tracing
+from .tree import TreeError, changed_specfiles, find_specfiles
 from .version import version
+from .watch import SpecWatcher, WatchError
 
 
 class IntListAction(argparse.Action):
@@ -41,7 +77,77 @@ class IntListAction(argparse.Action):
             getattr(namespace, self.dest).extend(int_list)
 
 
+# completing must feel instant, stop looking up stored results after this
+# long, in seconds
+COMPLETION_TIME_BUDGET = 0.05
+
+
+class IndexCompleter(object):
+    """Complete --source/--patch indices of the spec files on the command line.
+
+    Only results stored with --cache are offered, with their URLs as
+    descriptions. Completing never runs rpm, and skips source RPM packages:
+    finding their spec file can mean decompressing large archives.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+
+    @staticmethod
+    def _specfiles(parsed_args):
+        specfiles = [
+            specpath
+            for specpath in getattr(parsed_args, "specfiles", None) or ()
+            if not is_srpm(specpath)
+        ]
+        # spec files following the option being completed aren't parsed yet
+        for word in os.environ.get("COMP_LINE", "").split():
+            if word.endswith(".spec") and word not in specfiles:
+                specfiles.append(word)
+        return specfiles
+
+    def __call__(self, prefix, parsed_args, **kwargs):
+        deadline = time.monotonic() + COMPLETION_TIME_BUDGET
+
+        # indices are comma separated, only complete the last one
+        head = prefix[: prefix.rfind(",") + 1]
+        already = set(head.split(","))
+
+        result_cache = ResultCache()
+        definitions = getattr(parsed_args, "define", None) or []
+        urls = {}
+        for specpath in self._specfiles(parsed_args):
+            if time.monotonic() > deadline:
+                break
+            try:
+                result = result_cache.get(spec_digest(specpath, definitions))
+            except OSError:
+                continue
+            if result is not None:
+                for index, url in result[self.kind].items():
+                    urls.setdefault(index, url)
+
+        return {
+            f"{head}{index}": urls[index]
+            for index in sorted(urls)
+            if str(index) not in already and f"{head}{index}".startswith(prefix)
+        }
+
+
+def positive_int(value):
+    try:
+        int_value = int(value)
+    except ValueError:
+        int_value = 0
+    if int_value < 1:
+        raise argparse.ArgumentTypeError(f"{value!r} isn't a positive integer")
+    return int_value
+
+
 class CLI(object):
+    # local copies of spec files given as URLs, see fetch_remote_specs()
+    remote_specs = {}
+
     def _rm_tmpdir(self):
         def onerror(func, path, exc_info):
             log_error("Couldn't remove '%s': %s", path, exc_info)
@@ -60,6 +166,11 @@ class CLI(object):
     def get_arg_parser(self):
         parser = argparse.ArgumentParser(description="Utility for RPM spec files")
         parser.add_argument("--debug", "-D", action="store_true")
+        parser.add_argument(
+            "--profile",
+            metavar="FILE",
+            help="Record where time is spent in FILE, in Chrome trace event format",
+        )
 
         commands = parser.add_subparsers(dest="cmd", help="Commands")
 
@@ -69,24 +180,205 @@ class CLI(object):
 
         source_group = action_parser.add_mutually_exclusive_group()
         source_group.add_argument("--sources", "-S", action="store_true")
-        source_group.add_argument("--source", "-s", action=IntListAction, type=str)
+        source_group.add_argument(
+            "--source", "-s", action=IntListAction, type=str
+        ).completer = IndexCompleter("sources")
 
         patches_group = action_parser.add_mutually_exclusive_group()
         patches_group.add_argument("--patches", "-P", action="store_true")
-        patches_group.add_argument("--patch", "-p", action=IntListAction, type=str)
+        patches_group.add_argument(
+            "--patch", "-p", action=IntListAction, type=str
+        ).completer = IndexCompleter("patches")
+
+        action_parser.add_argument(
+            "--jobs",
+            "-j",
+            type=positive_int,
+            default=1,
+            help="Number of spec files to evaluate in parallel",
+        )
+
+        action_parser.add_argument(
+            "--batch-size",
+            type=positive_int,
+            default=1,
+            help="Evaluate up to this many spec files in one rpmbuild run, so the cost of"
+            + " starting rpmbuild and loading its configuration is shared",
+        )
+
+        action_parser.add_argument(
+            "--eval-strategy",
+            choices=EVAL_STRATEGIES,
+            default=EVAL_STRATEGIES[0],
+            help="How to get sources and patches out of rpmbuild: print the preamble from %%prep"
+            + " and parse it (heredoc), or have rpm's Lua interpreter print what rpm parsed"
+            + " (lua, needs rpm >= 4.15)",
+        )
+
+        action_parser.add_argument(
+            "--cache",
+            action="store_true",
+            default=False,
+            help="Store results of evaluating spec files and reuse them while their preamble and"
+            + " --define arguments don't change. Changes to the rpm macro configuration or to"
+            + " files the spec file includes aren't noticed.",
+        )
+        action_parser.add_argument(
+            "--changed-since",
+            metavar="REV",
+            help="Only process spec files whose preamble or sources file changed since the git"
+            + " revision REV",
+        )
+
+        action_parser.add_argument(
+            "--shard",
+            metavar="I/N",
+            type=shard_spec,
+            help="Only process the I-th of N shards of the spec files, to spread work across"
+            + " nodes which get the same arguments",
+        )
+        action_parser.add_argument(
+            "--shard-sizes",
+            metavar="REPORT",
+            help="Balance shards by the sizes of files fetched per spec file, from JSON Lines"
+            + " output of get or a merged report. get also fetches larger files first.",
+        )
+
+        action_parser.add_argument(
+            "--watch",
+            "-w",
+            action="store_true",
+            default=False,
+            help="Keep running and process spec files again when their preamble changes",
+        )
 
-        action_parser.add_argument("specfile", help="The RPM spec file to read")
+        action_parser.add_argument(
+            "--format",
+            choices=("text", "jsonl"),
+            default="text",
+            help="Output format, jsonl writes a JSON record per line as soon as it is known",
+        )
+
+        specfiles_help = (
+            "The RPM spec file(s) or source RPM packages to read, as paths or URLs, or"
+            + " directories to search for spec files"
+        )
 
         get_cmd = commands.add_parser("get", parents=[action_parser], help="Download files")
+        get_cmd.add_argument(
+            "specfiles", nargs="*", metavar="specfile", help=specfiles_help + ", unless --from-lock"
+        )
+        get_cmd.add_argument(
+            "--from-lock",
+            metavar="LOCKFILE",
+            help="Fetch the files recorded in LOCKFILE (written by list --lockfile), verify"
+            + " them and give them the recorded mtime, without evaluating spec files",
+        )
         get_cmd.add_argument("--insecure", action="store_true", default=False)
         get_cmd.add_argument("--force", "-f", action="store_true", default=False)
         get_cmd.add_argument("--dry-run", "--dryrun", "-n", action="store_true", default=False)
+        get_cmd.add_argument(
+            "--download-jobs",
+            "-J",
+            type=positive_int,
+            default=1,
+            help="Number of files to download in parallel",
+        )
+
+        get_cmd.add_argument(
+            "--probe-sizes",
+            action="store_true",
+            default=False,
+            help="Ask servers for the sizes of files not known from --shard-sizes or a lockfile,"
+            + " to fetch larger files first",
+        )
+        get_cmd.add_argument(
+            "--bundle",
+            metavar="FILE",
+            action="append",
+            help="Copy files out of FILE, written by --export-bundle, instead of fetching them if"
+            + " it contains them (can be given several times)",
+        )
+        get_cmd.add_argument(
+            "--export-bundle",
+            metavar="FILE",
+            help="Also write the fetched files into FILE, to use with --bundle on other nodes",
+        )
+
+        get_cmd.add_argument(
+            "--host-failures",
+            metavar="N",
+            type=positive_int,
+            default=HOST_FAILURES,
+            help="Stop trying a host after N consecutive failures to reach it, fail its other"
+            + " files immediately or fetch them from a --mirror",
+        )
+        get_cmd.add_argument(
+            "--probe-interval",
+            metavar="SECONDS",
+            type=positive_int,
+            default=PROBE_INTERVAL,
+            help="Try a host which is down again after this long, to find out if it's back",
+        )
+        get_cmd.add_argument(
+            "--mirror",
+            metavar="HOST=URL",
+            type=mirror_spec,
+            action="append",
+            help="Fetch files on HOST from under URL while HOST is down (can be given several"
+            + " times)",
+        )
+        get_cmd.add_argument(
+            "--remember-down-hosts",
+            metavar="SECONDS",
+            type=positive_int,
+            help="Remember hosts which are down for this long, so later runs don't try them"
+            + " first either",
+        )
 
         get_src_group = get_cmd.add_mutually_exclusive_group()
         get_src_group.add_argument("--directory", "-C", action="store")
         get_src_group.add_argument("--sourcedir", "-R", action="store_true")
+        get_cmd.add_argument(
+            "--extract",
+            "-x",
+            metavar="DIR",
+            help="Also unpack archives into DIR, tar archives while they're downloaded if possible",
+        )
 
-        commands.add_parser("list", parents=[action_parser], help="List files")
+        list_cmd = commands.add_parser("list", parents=[action_parser], help="List files")
+        list_cmd.add_argument("specfiles", nargs="+", metavar="specfile", help=specfiles_help)
+        list_cmd.add_argument(
+            "--lockfile",
+            metavar="LOCKFILE",
+            help="Record URLs, file names and, for files present in the source directory or"
+            + " next to the spec file, their size, mtime and SHA512 hash in LOCKFILE",
+        )
+
+        check_cmd = commands.add_parser(
+            "check", parents=[action_parser], help="Check if files can be downloaded"
+        )
+        check_cmd.add_argument("specfiles", nargs="+", metavar="specfile", help=specfiles_help)
+        check_cmd.add_argument("--insecure", action="store_true", default=False)
+        check_cmd.add_argument(
+            "--connections",
+            "-c",
+            type=positive_int,
+            default=CHECK_CONNECTIONS,
+            help="Maximum number of concurrent requests",
+        )
+        check_cmd.add_argument(
+            "--timeout",
+            type=positive_int,
+            default=CHECK_TIMEOUT,
+            help="Timeout per request in seconds",
+        )
+
+        merge_cmd = commands.add_parser(
+            "merge", help="Merge JSON Lines output of several shards into one report"
+        )
+        merge_cmd.add_argument("reports", nargs="+", metavar="report")
+        merge_cmd.add_argument("--output", "-o", metavar="FILE", help="Write the report to FILE")
 
         version_cmd = commands.add_parser("version", help="Show rpmspectool version")
         version_cmd.set_defaults(cmd="version")
@@ -119,6 +411,643 @@ class CLI(object):
 
         return sources, patches
 
+    def eval_specfile(self, specpath):
+        """Evaluate a spec file, report errors and record the exit code."""
+        return self.eval_specfiles([specpath])[specpath]
+
+    def eval_specfiles(self, specpaths):
+        """Evaluate spec files together, report errors and record the exit code.
+
+        Returns the results by spec file, None for spec files which
+        couldn't be evaluated.
+        """
+        results = {}
+        # intermediate spec file handlers and cache keys, by spec file
+        handlers = {}
+        cache_keys = {}
+
+        for specpath in specpaths:
+            try:
+                specfile = open_spec(self.remote_specs.get(specpath, specpath))
+            except OSError as exc:
+                print(f"Can’t open {specpath}: {exc}", file=sys.stderr)
+                self.exit_code = max(self.exit_code, 1)
+                results[specpath] = None
+                continue
+            except SRPMError as exc:
+                print(exc, file=sys.stderr)
+                self.exit_code = max(self.exit_code, 1)
+                results[specpath] = None
+                continue
+
+            if self.cache is not None:
+                preamble, _ = RPMSpecHandler.extract_preamble(specfile)
+                cache_keys[specpath] = preamble_digest(preamble, self.args.define)
+                specfile_res = self.cache.get(cache_keys[specpath])
+                if specfile_res is not None:
+                    log_debug("Using cached result for %s", specpath)
+                    specfile.close()
+                    results[specpath] = specfile_res
+                    continue
+                specfile.seek(0)
+
+            tmpdir = tempfile.mkdtemp(dir=self.tmpdir, prefix="spec_")
+            specname = os.path.basename(specpath)
+            if is_srpm(specname):
+                specname = specname.removesuffix(".src.rpm") + ".spec"
+            parsed_spec_path = os.path.join(tmpdir, "rpmspectool-" + specname)
+            handlers[specpath] = RPMSpecHandler(
+                tmpdir, specfile, parsed_spec_path, strategy=self.args.eval_strategy
+            )
+
+        try:
+            outcomes = eval_specfiles(handlers.values(), self.args.define)
+        finally:
+            for handler in handlers.values():
+                handler.in_specfile.close()
+
+        for specpath, outcome in zip(handlers, outcomes):
+            if isinstance(outcome, RPMSpecEvalError):
+                self._report_eval_error(specpath, outcome)
+                results[specpath] = None
+                continue
+
+            if self.cache is not None:
+                self.cache.put(cache_keys[specpath], outcome)
+            results[specpath] = outcome
+
+        return results
+
+    def _report_eval_error(self, specpath, exc):
+        parsed_specpath, returncode, stderr = exc.args
+        if self.args.debug:
+            print(
+                f"Error parsing intermediate spec file '{parsed_specpath}' for {specpath}.",
+                file=sys.stderr,
+            )
+        else:
+            print(f"Error parsing intermediate spec file for {specpath}.", file=sys.stderr)
+        if self.args.verbose:
+            print(f"RPM error:\n{stderr}", file=sys.stderr)
+        self.exit_code = 2
+
+    def cached_result(self, specpath):
+        """Look up the stored result for a spec file without evaluating it."""
+        if self.cache is None:
+            return None
+        try:
+            return self.cache.get(
+                spec_digest(self.remote_specs.get(specpath, specpath), self.args.define)
+            )
+        except (OSError, SRPMError):
+            return None
+
+    def _unchanged(self, specpath):
+        return self.changed is not None and os.path.abspath(specpath) not in self.changed
+
+    def produce_batch_items(self, specpaths):
+        """Evaluate spec files together and yield records of files to process."""
+        with span("evaluate", "spec", specs=len(specpaths)):
+            results = self.eval_specfiles([s for s in specpaths if not self._unchanged(s)])
+
+        for specpath in specpaths:
+            yield from self.produce_items(specpath, results)
+
+    def produce_items(self, specpath, results=None):
+        """Evaluate a spec file and yield records of files to process.
+
+        results holds results of spec files which were evaluated already.
+        """
+        args = self.args
+
+        if results is not None and specpath in results:
+            specfile_res = results[specpath]
+            if specfile_res is None:
+                return
+        elif self._unchanged(specpath):
+            # Nothing to fetch, but sources and patches of unchanged spec
+            # files are still listed, from stored results if possible.
+            if args.cmd != "list":
+                return
+            specfile_res = self.cached_result(specpath)
+        else:
+            specfile_res = None
+
+        if specfile_res is None:
+            with span("evaluate", "spec", spec=specpath):
+                specfile_res = self.eval_specfile(specpath)
+        if specfile_res is None:
+            return
+
+        sources, patches = self.filter_sources_patches(
+            args, specfile_res["sources"], specfile_res["patches"]
+        )
+
+        for kind, what in (("source", sources), ("patch", patches)):
+            for i in sorted(what):
+                url = what[i]
+                yield {
+                    "specfile": specpath,
+                    "kind": kind,
+                    "index": i,
+                    "url": url,
+                    "filename": url.split("/")[-1],
+                    "srcdir": specfile_res["srcdir"],
+                }
+
+    def produce_lock_items(self, specpath):
+        """Yield records of files to process from lockfile entries of a spec file."""
+        sources = {}
+        patches = {}
+        for entry in self.locked[specpath]:
+            (sources if entry["kind"] == "source" else patches)[entry["index"]] = entry
+
+        sources, patches = self.filter_sources_patches(self.args, sources, patches)
+
+        for what in (sources, patches):
+            for i in sorted(what):
+                yield dict(what[i])
+
+    def emit_record(self, record):
+        """Write a record as JSON line, immediately."""
+        with self.output_lock:
+            print(json.dumps(record), file=self.output, flush=True)
+
+    def list_item(self, record):
+        if self.args.lockfile:
+            key = (record["specfile"], record["kind"], record["index"])
+            self.lock_entries[key] = lock_entry(
+                record, (record["srcdir"], os.path.dirname(record["specfile"]) or os.curdir)
+            )
+
+        if self.args.format == "jsonl":
+            self.emit_record(record | {"status": "listed"})
+            return
+
+        line = f"{record['kind'].capitalize()}{record['index']}: {record['url']}"
+        if self.prefix_specfiles:
+            line = f"{record['specfile']}: {line}"
+        print(line, file=self.output)
+
+    def collect_url(self, record):
+        url = record["url"]
+        if is_url(url):
+            self.urls.setdefault(url, []).append(record["specfile"])
+
+    def print_check_result(self, result):
+        if self.args.format == "jsonl":
+            self.emit_record(result | {"specfiles": self.urls[result["url"]]})
+            return
+
+        if result["ok"]:
+            details = []
+            if result["status"]:
+                details.append(f"status {result['status']}")
+            if result["size"] is not None:
+                details.append(f"size {result['size']}")
+            if result["last_modified"]:
+                details.append(f"last modified {result['last_modified']}")
+            if result["redirects"]:
+                details.append(f"redirects {result['redirects']}")
+            details.append(f"latency {result['latency']:.3f}s")
+            print(f"OK {result['url']}: {', '.join(details)}", file=self.output)
+        else:
+            reason = result["error"] or f"status {result['status']}"
+            print(f"FAILED {result['url']}: {reason}", file=self.output)
+
+    def check_specfiles(self, args, specfiles):
+        """Check the URLs of sources and patches in spec files.
+
+        Every URL is only checked once, even if several spec files
+        reference it.
+        """
+        self.urls = {}
+
+        inputs, produce = self.pipeline_inputs(args, specfiles)
+        pipeline = Pipeline(produce, self.collect_url, producers=args.jobs)
+        pipeline.run(inputs)
+
+        with span("check_urls", "download", urls=len(self.urls)):
+            for result in check_urls(
+                self.urls,
+                max_connections=args.connections,
+                insecure=args.insecure,
+                timeout=args.timeout,
+            ):
+                self.print_check_result(result)
+                if not result["ok"]:
+                    self.retval = 1
+
+    def get_item(self, record):
+        args = self.args
+        url = record["url"]
+
+        if getattr(args, "sourcedir"):
+            where = record["srcdir"]
+        else:
+            where = getattr(args, "directory")
+
+        if self.fetched is not None and (where, url) in self.fetched:
+            # watch mode: fetched before, only newly referenced files are fetched
+            status, error = "unchanged", None
+        else:
+            self.schedule.start()
+            with span("fetch", "download", spec=record["specfile"], url=url) as span_args:
+                status, error = self._fetch(url, where, sha512=record.get("sha512"))
+                span_args["status"] = status
+            if "sha512" in record and status in ("downloaded", "copied", "bundled"):
+                # fetched from a lockfile
+                error = self._verify(record, where)
+                if error is not None:
+                    status = "failed"
+            if self.fetched is not None and status in ("downloaded", "copied", "bundled"):
+                self.fetched.add((where, url))
+
+        if self.export_files is not None and status in (
+            "downloaded",
+            "copied",
+            "bundled",
+            "unchanged",
+        ):
+            self.export_files.setdefault(url, os.path.join(where or os.curdir, record["filename"]))
+
+        if status in ("downloaded", "copied", "bundled", "unchanged"):
+            size = self._fetched_size(where, record["filename"])
+        else:
+            size = None
+
+        self.schedule.done(record, size)
+        if self.show_progress:
+            print(self.schedule.progress(), file=sys.stderr)
+
+        if args.format == "jsonl":
+            self.emit_record(record | {"status": status, "error": error, "size": size})
+
+    def _verify(self, entry, where):
+        """Check a file fetched from a lockfile, remove it if it differs.
+
+        Files which match get the modification time recorded in the
+        lockfile, so fetching them yields the same tree every time.
+        """
+        path = os.path.join(where or os.curdir, entry["filename"])
+        error = verify_file(entry, path)
+        if error is not None:
+            log_error(error)
+            self.retval = 1
+            with contextlib.suppress(OSError):
+                os.unlink(path)
+        elif entry.get("mtime") is not None:
+            try:
+                os.utime(path, (entry["mtime"], entry["mtime"]))
+            except OSError as exc:
+                log_debug("Can’t set mtime of %s: %s", path, exc.strerror)
+        return error
+
+    @staticmethod
+    def _fetched_size(where, filename):
+        try:
+            return os.path.getsize(os.path.join(where or os.curdir, filename))
+        except OSError:
+            return None
+
+    def _bundled(self, url, sha512=None):
+        """Find a file in the bundles, return the bundle and its entry."""
+        for bundle in self.bundles:
+            entry = bundle.lookup(url, sha512)
+            if entry is not None:
+                return bundle, entry
+        return None, None
+
+    def _fetch(self, url, where, sha512=None):
+        args = self.args
+        error = None
+
+        # identical URLs are fetched once, into one directory, so only extract then
+        extract_kwargs = {"extract_dir": args.extract} if args.extract else {}
+
+        bundle, entry = self._bundled(url, sha512)
+
+        try:
+            if bundle is not None:
+                bundle.copy_file(entry, where=where, dry_run=args.dry_run, force=args.force)
+                if args.extract and not args.dry_run:
+                    extract_archive(
+                        os.path.join(where or os.curdir, entry["filename"]), args.extract
+                    )
+                status = "dry-run" if args.dry_run else "bundled"
+            elif is_url(url):
+                with self.breaker.attempt(url) as fetch_url:
+                    self.coalescer.fetch(
+                        fetch_url,
+                        download,
+                        where=where,
+                        dry_run=args.dry_run,
+                        insecure=args.insecure,
+                        force=args.force,
+                        **extract_kwargs,
+                    )
+                status = "dry-run" if args.dry_run else "downloaded"
+            elif is_local(url):
+                copy_local(url, where=where, dry_run=args.dry_run, force=args.force)
+                if args.extract and not args.dry_run:
+                    extract_archive(
+                        os.path.join(where or os.curdir, url.split("/")[-1]), args.extract
+                    )
+                status = "dry-run" if args.dry_run else "copied"
+            else:
+                status = "skipped"
+        except (BundleError, DownloadError, ExtractError) as e:
+            error = e.args[0]
+        except FileExistsError as e:
+            error = (
+                e.args[1] + f": {e.filename}"
+                if e.filename
+                else "" + f", {e.filename2}"
+                if e.filename2
+                else ""
+            )
+
+        if error is not None:
+            log_error(error)
+            self.retval = 1
+            status = "failed"
+
+        return status, error
+
+    def pipeline_inputs(self, args, specfiles):
+        """Determine what to feed into the pipeline, and what produces items from it.
+
+        With --batch-size, spec files are grouped into batches evaluated
+        together.
+        """
+        if getattr(args, "from_lock", None):
+            return specfiles, self.produce_lock_items
+        if args.batch_size > 1:
+            batches = [
+                specfiles[i : i + args.batch_size]
+                for i in range(0, len(specfiles), args.batch_size)
+            ]
+            return batches, self.produce_batch_items
+        return specfiles, self.produce_items
+
+    def produce_scheduled_items(self, input, produce):
+        """Yield records of files to fetch, noting their expected sizes."""
+        args = self.args
+
+        records = list(produce(input))
+
+        if args.probe_sizes and not args.dry_run:
+            with span("probe_sizes", "download", files=len(records)):
+                self.schedule.probe(records, insecure=args.insecure)
+
+        for record in records:
+            self.schedule.add(record)
+            yield record
+
+    def run_specfiles(self, args, specfiles):
+        if args.cmd == "check":
+            self.check_specfiles(args, specfiles)
+            return
+
+        if args.cmd == "list":
+            inputs, produce = self.pipeline_inputs(args, specfiles)
+            pipeline = Pipeline(produce, self.list_item, producers=args.jobs)
+        else:  # args.cmd == "get"
+            if args.download_jobs > 1:
+                # Fetch the largest files first, evaluate spec files with large files
+                # first so they're known early.
+                priority = self.schedule.priority
+                specfiles = sorted(specfiles, key=lambda s: -self.spec_sizes.get(s, 0))
+            else:
+                # the total time doesn't depend on the order
+                priority = None
+            inputs, produce = self.pipeline_inputs(args, specfiles)
+            pipeline = Pipeline(
+                functools.partial(self.produce_scheduled_items, produce=produce),
+                self.get_item,
+                producers=args.jobs,
+                consumers=args.download_jobs,
+                priority=priority,
+            )
+
+        pipeline.run(inputs)
+
+    def _spec_digest(self, specpath):
+        try:
+            return spec_digest(self.remote_specs.get(specpath, specpath), self.args.define)
+        except (OSError, SRPMError):
+            # e.g. an editor is replacing the file right now
+            return None
+
+    def watch_specfiles(self, args):
+        """Process spec files, then again whenever their preamble changes.
+
+        Changes outside of the preamble, e.g. to %changelog, are ignored.
+        Stops on Ctrl+C.
+        """
+        try:
+            with SpecWatcher(self.specfiles) as watcher:
+                self._watch_specfiles(args, watcher)
+        except WatchError as exc:
+            print(exc.args[0], file=sys.stderr)
+            sys.exit(1)
+
+    def _watch_specfiles(self, args, watcher):
+        digests = {specpath: self._spec_digest(specpath) for specpath in self.specfiles}
+
+        self.run_specfiles(args, self.specfiles)
+
+        # from now on, every spec file that changed is processed
+        self.changed = None
+
+        print("Watching for changes, press Ctrl+C to stop.", file=sys.stderr)
+        try:
+            while True:
+                changed_specs = watcher.wait()
+                if not changed_specs:
+                    continue
+
+                changed = []
+                for specpath in sorted(changed_specs):
+                    digest = self._spec_digest(specpath)
+                    if digest is None or digest == digests[specpath]:
+                        log_debug("%s: preamble unchanged", specpath)
+                        continue
+                    digests[specpath] = digest
+                    changed.append(specpath)
+
+                if changed:
+                    self.run_specfiles(args, changed)
+        except KeyboardInterrupt:
+            pass
+
+    def fetch_remote_specs(self, args):
+        """Fetch spec files given as URLs, or revalidate copies fetched before.
+
+        Spec files which couldn't be fetched are reported and dropped.
+        Returns the paths of the local copies by URL.
+        """
+        urls = [specpath for specpath in self.specfiles if is_url(specpath)]
+        if not urls:
+            return {}
+
+        with span("fetch_remote_specs", "spec", specs=len(urls)):
+            paths, errors = RemoteSpecCache().fetch(urls, insecure=getattr(args, "insecure", False))
+
+        for url in errors:
+            print(errors[url], file=sys.stderr)
+            self.exit_code = max(self.exit_code, 1)
+        self.specfiles = [specpath for specpath in self.specfiles if specpath not in errors]
+
+        return paths
+
+    def process_specfiles(self, args):
+        """Evaluate spec files and list or download their sources and patches.
+
+        Evaluating spec files and downloading files overlap, each with
+        their own number of workers.
+        """
+        self.retval = 0
+        self.exit_code = 0
+
+        # fetch every URL only once, even if several spec files reference it
+        self.coalescer = TransferCoalescer()
+
+        # stop trying hosts which are down
+        if args.cmd == "get":
+            self.breaker = HostCircuitBreaker(
+                failures=args.host_failures,
+                probe_interval=args.probe_interval,
+                mirrors=args.mirror,
+                state_path=(
+                    os.path.join(cache_dir(), "down-hosts.json")
+                    if args.remember_down_hosts
+                    else None
+                ),
+                expiry=args.remember_down_hosts,
+            )
+
+        self.output = sys.stdout
+        self.output_lock = threading.Lock()
+
+        self.cache = ResultCache() if args.cache else None
+
+        # Spec files are evaluated in worker threads, create the temporary
+        # directory they share up front instead of racing for it.
+        self.tmpdir
+
+        try:
+            self.bundles = [Bundle(path) for path in getattr(args, "bundle", None) or ()]
+        except BundleError as exc:
+            print(exc.args[0], file=sys.stderr)
+            sys.exit(1)
+
+        if getattr(args, "from_lock", None):
+            try:
+                entries = read_lockfile(args.from_lock)
+            except LockfileError as exc:
+                print(exc.args[0], file=sys.stderr)
+                sys.exit(1)
+            self.locked = {}
+            for entry in entries:
+                self.locked.setdefault(entry["specfile"], []).append(entry)
+            self.specfiles = list(self.locked)
+            sizes = file_sizes(entries)
+            self.spec_sizes = spec_weights(entries)
+        else:
+            self.specfiles = list(find_specfiles(args.specfiles))
+            sizes = {}
+            self.spec_sizes = {}
+        # shards of a run list the same way, no matter how many spec files they got
+        self.prefix_specfiles = len(self.specfiles) > 1
+
+        if args.shard_sizes:
+            try:
+                records = read_records(args.shard_sizes)
+            except ShardError as exc:
+                print(exc.args[0], file=sys.stderr)
+                sys.exit(1)
+        else:
+            records = []
+
+        if args.shard:
+            self.specfiles = select_shard(
+                self.specfiles, *args.shard, weights=spec_weights(records) or None
+            )
+
+        self.remote_specs = self.fetch_remote_specs(args)
+
+        # sizes in a lockfile are what's expected, sizes from an earlier run what was
+        self.spec_sizes = spec_weights(records) | self.spec_sizes
+        self.schedule = DownloadSchedule(file_sizes(records) | sizes)
+        self.show_progress = args.cmd == "get" and args.format == "text" and sys.stderr.isatty()
+
+        if args.changed_since:
+            try:
+                self.changed = changed_specfiles(self.specfiles, args.changed_since)
+            except TreeError as exc:
+                print(exc.args[0], file=sys.stderr)
+                sys.exit(1)
+        else:
+            self.changed = None
+
+        # in watch mode, what was fetched already, as (where, url) tuples
+        self.fetched = set() if args.watch else None
+
+        if args.format == "jsonl":
+            # keep progress messages out of the stream of records
+            ctxmgr = contextlib.redirect_stdout(sys.stderr)
+        else:
+            ctxmgr = contextlib.nullcontext()
+
+        # for list --lockfile, entries by (specfile, kind, index)
+        self.lock_entries = {}
+
+        # for get --export-bundle, paths of fetched files by URL
+        self.export_files = {} if getattr(args, "export_bundle", None) else None
+
+        with ctxmgr:
+            if args.watch:
+                self.watch_specfiles(args)
+            else:
+                self.run_specfiles(args, self.specfiles)
+
+        if args.cmd == "get":
+            self.breaker.save()
+
+        if getattr(args, "lockfile", None):
+            write_lockfile(args.lockfile, self.lock_entries.values())
+
+        if self.export_files is not None:
+            try:
+                entries = write_bundle(args.export_bundle, self.export_files)
+            except OSError as exc:
+                print(f"Can’t write bundle {args.export_bundle}: {exc}", file=sys.stderr)
+                sys.exit(1)
+            print(f"Wrote {len(entries)} files to bundle '{args.export_bundle}'", file=sys.stderr)
+
+        if self.exit_code:
+            sys.exit(self.exit_code)
+
+        return self.retval
+
+    def merge(self, args):
+        try:
+            report = merge_reports(args.reports)
+        except ShardError as exc:
+            print(exc.args[0], file=sys.stderr)
+            return 1
+
+        if args.output:
+            with open(args.output, "w") as fobj:
+                json.dump(report, fobj, indent=2)
+                fobj.write("\n")
+        else:
+            json.dump(report, sys.stdout, indent=2)
+            print()
+
+        return 0
+
     def main(self):
         argparser = self.get_arg_parser()
         argcomplete.autocomplete(argparser)
@@ -131,74 +1060,34 @@ class CLI(object):
 
         log_debug("args: %s", args)
 
+        if getattr(args, "cmd", None) == "get":
+            if args.from_lock:
+                if args.specfiles or args.watch or args.changed_since:
+                    argparser.error(
+                        "--from-lock can't be used with spec files, --watch or --changed-since"
+                    )
+            elif not args.specfiles:
+                argparser.error("the following arguments are required: specfile")
+            if args.export_bundle and args.dry_run:
+                argparser.error("--export-bundle can't be used with --dry-run")
+
+        if getattr(args, "watch", False) and any(is_url(s) for s in args.specfiles or ()):
+            argparser.error("--watch can't be used with spec file URLs")
+
         if not getattr(args, "cmd"):
             argparser.print_usage()
         elif args.cmd == "version":
             print(f"{sys.argv[0]} {version}")
-        else:
-            parsed_spec_path = os.path.join(
-                self.tmpdir, "rpmspectool-" + os.path.basename(self.args.specfile)
-            )
+        elif args.cmd == "merge":
+            retval = self.merge(args)
+        elif args.profile:
+            start_tracing()
             try:
-                ctxmgr = open(self.args.specfile, "rb")
-            except OSError as exc:
-                print(f"Can’t open {self.args.specfile}: {exc}", file=sys.stderr)
-                sys.exit(1)
-
-            with ctxmgr as specfile:
-                spechandler = RPMSpecHandler(self.tmpdir, specfile, parsed_spec_path)
-
-                try:
-                    specfile_res = spechandler.eval_specfile(self.args.define)
-                except RPMSpecEvalError as e:
-                    specpath, returncode, stderr = e.args
-                    if args.debug:
-                        print(
-                            f"Error parsing intermediate spec file '{specpath}'.", file=sys.stderr
-                        )
-                    else:
-                        print("Error parsing intermediate spec file.", file=sys.stderr)
-                    if args.verbose:
-                        print(f"RPM error:\n{stderr}", file=sys.stderr)
-                    sys.exit(2)
-
-            sources, patches = self.filter_sources_patches(
-                args, specfile_res["sources"], specfile_res["patches"]
-            )
-
-            if args.cmd == "list":
-                for prefix, what in (("Source", sources), ("Patch", patches)):
-                    for i in sorted(what):
-                        print(f"{prefix}{i}: {what[i]}")
-            else:  # args.cmd == "get"
-                if getattr(args, "sourcedir"):
-                    where = specfile_res["srcdir"]
-                else:
-                    where = getattr(args, "directory")
-                for what in sources, patches:
-                    for i in sorted(what):
-                        url = what[i]
-                        if is_url(url):
-                            try:
-                                download(
-                                    url,
-                                    where=where,
-                                    dry_run=args.dry_run,
-                                    insecure=args.insecure,
-                                    force=args.force,
-                                )
-                            except DownloadError as e:
-                                log_error(e.args[0])
-                                retval = 1
-                            except FileExistsError as e:
-                                log_error(
-                                    e.args[1] + f": {e.filename}"
-                                    if e.filename
-                                    else "" + f", {e.filename2}"
-                                    if e.filename2
-                                    else ""
-                                )
-                                retval = 1
+                retval = self.process_specfiles(args)
+            finally:
+                stop_tracing().write(args.profile)
+        else:
+            retval = self.process_specfiles(args)
 
         return retval
 
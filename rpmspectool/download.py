@@ -3,31 +3,409 @@
 # rpmspectool.download: download handling for rpmspectool
 # Copyright © 2015 Red Hat, Inc.
 
+import contextlib
+import errno
+import fcntl
 import os
 import re
+import shutil
+import socket
+import threading
 import time
+from collections import deque
+from datetime import datetime, timezone
+from logging import debug as log_debug
 from tempfile import NamedTemporaryFile
+from types import SimpleNamespace
+from urllib.parse import unquote, urlsplit
 
 import pycurl
 
+from .extract import ExtractError, StreamExtractor, extract_archive, stream_compression
 from .version import version
 
 umask = os.umask(0)
 os.umask(umask)
 
+# from linux/fs.h, not exported by the fcntl module before Python 3.12
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+
+# chunk size for copy_file_range(), large enough to not matter
+COPY_CHUNK_SIZE = 1 << 30
+
+# downloaded data is collected and written to files in chunks of this size
+WRITE_BUFFER_SIZE = 1 << 20
+
+# defaults for checking URLs
+CHECK_CONNECTIONS = 8
+CHECK_TIMEOUT = 30
+
+# CONTENT_LENGTH_DOWNLOAD is deprecated in newer libcurl versions
+CONTENT_LENGTH_INFO = getattr(pycurl, "CONTENT_LENGTH_DOWNLOAD_T", pycurl.CONTENT_LENGTH_DOWNLOAD)
+
+# HTTP status codes of servers which don't like HEAD requests
+HEAD_UNSUPPORTED_STATUSES = {400, 403, 405, 501}
+
+# curl errors and HTTP status codes which mean a host is down, rather than a file missing
+HOST_DOWN_ERRORS = {
+    pycurl.E_COULDNT_RESOLVE_HOST,
+    pycurl.E_COULDNT_CONNECT,
+    pycurl.E_OPERATION_TIMEDOUT,
+    pycurl.E_SSL_CONNECT_ERROR,
+    pycurl.E_GOT_NOTHING,
+    pycurl.E_SEND_ERROR,
+    pycurl.E_RECV_ERROR,
+}
+HOST_DOWN_STATUSES = {502, 503, 504}
+
+# how often to check if a target file locked by another process is free, in seconds
+LOCK_POLL_INTERVAL = 0.2
+
 
 class DownloadError(RuntimeError):
     pass
 
 
+class HostDownError(DownloadError):
+    """The host of a URL couldn't be reached or is unavailable."""
+
+
 protocols_re = re.compile(r"^(?:ftp|https?)://", re.IGNORECASE)
+http_re = re.compile(r"^https?://", re.IGNORECASE)
+file_url_re = re.compile(r"^file://", re.IGNORECASE)
+content_length_re = re.compile(rb"^content-length\s*:\s*(?P<size>\d+)", re.IGNORECASE)
+content_range_re = re.compile(rb"^content-range\s*:\s*bytes\s+[^/]*/(?P<size>\d+)", re.IGNORECASE)
 
 
 def is_url(url):
     return bool(protocols_re.search(url))
 
 
-def download(url, where=None, dry_run=False, insecure=False, force=False):
+def is_local(url):
+    """Check if a source refers to a file on a locally mounted file system.
+
+    These are file:// URLs and absolute paths, e.g. onto a mirror of
+    source files mounted via NFS.
+    """
+    return bool(file_url_re.search(url)) or os.path.isabs(url)
+
+
+def local_path(url):
+    """Get the file system path of a local source."""
+    if file_url_re.search(url):
+        return unquote(urlsplit(url).path)
+    # strip a trailing '#/name' which renames the file
+    return url.split("#", 1)[0]
+
+
+def _link_into_place(tmp_path, fpath, force):
+    if force:
+        try:
+            os.remove(fpath)
+        except FileNotFoundError:
+            pass
+    os.link(tmp_path, fpath)
+
+
+def _fix_mode(fpath):
+    # NamedTemporaryFile sets mode to 0600, change it to default per umask
+    os.chmod(fpath, 0o666 & ~umask)
+
+
+def _copy_file_data(src_fobj, dst_fobj):
+    """Copy file contents, avoiding to copy the data if possible.
+
+    Attempt in turn to clone the file (reflink on e.g. Btrfs or XFS),
+    use copy_file_range() which lets the kernel or NFS server do the
+    copying, then fall back to copying through user space.
+    """
+    src_fd = src_fobj.fileno()
+    dst_fd = dst_fobj.fileno()
+
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return "reflink"
+    except OSError:
+        pass
+
+    try:
+        while os.copy_file_range(src_fd, dst_fd, COPY_CHUNK_SIZE):
+            pass
+        return "copy_file_range"
+    except OSError as exc:
+        if exc.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+            raise
+
+    src_fobj.seek(0)
+    dst_fobj.seek(0)
+    dst_fobj.truncate()
+    shutil.copyfileobj(src_fobj, dst_fobj)
+    return "copy"
+
+
+# fcntl locks belong to processes, threads must take turns on their own
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+
+def _thread_lock(path):
+    with _thread_locks_lock:
+        return _thread_locks.setdefault(path, threading.Lock())
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class TargetLock(object):
+    """Advisory lock on a target file, shared by processes and hosts.
+
+    The lock is held on a hidden lock file next to the target file which
+    contains PID and host name of its holder. If the holder is on the
+    same host but doesn't run anymore (e.g. the lock survived on an NFS
+    server), the lock is considered stale and broken. The kernel releases
+    locks of crashed local processes by itself.
+
+    After entering, `waited` tells if another process held the lock, e.g.
+    because it was fetching the same file.
+    """
+
+    def __init__(self, fpath):
+        dirname, fname = os.path.split(fpath)
+        self.lock_path = os.path.join(dirname, f".{fname}.rpmspectool-lock")
+        self.hostname = socket.gethostname()
+        self.waited = False
+        self.fd = None
+
+    def _holder(self, fd):
+        try:
+            pid, hostname = os.pread(fd, 4096, 0).decode("utf-8").split()
+            return int(pid), hostname
+        except (OSError, UnicodeDecodeError, ValueError):
+            return None, None
+
+    def _is_current(self, fd):
+        # the lock file might have been removed or broken meanwhile
+        try:
+            return os.path.samestat(os.fstat(fd), os.stat(self.lock_path))
+        except FileNotFoundError:
+            return False
+
+    def _try_lock(self):
+        """Attempt to take the lock, return if that worked."""
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o666)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as exc:
+            if exc.errno not in (errno.EACCES, errno.EAGAIN):
+                os.close(fd)
+                raise
+            pid, hostname = self._holder(fd)
+            if hostname == self.hostname and pid != os.getpid() and not _process_alive(pid):
+                log_debug("Breaking stale lock '%s' of process %s", self.lock_path, pid)
+                if self._is_current(fd):
+                    os.unlink(self.lock_path)
+                os.close(fd)
+                return False
+            if not self.waited:
+                print(f"Waiting for process {pid} on {hostname} to finish fetching")
+                self.waited = True
+            os.close(fd)
+            time.sleep(LOCK_POLL_INTERVAL)
+            return False
+
+        if not self._is_current(fd):
+            os.close(fd)
+            return False
+
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, f"{os.getpid()} {self.hostname}\n".encode("utf-8"), 0)
+        self.fd = fd
+        return True
+
+    def __enter__(self):
+        self._thread_lock = _thread_lock(self.lock_path)
+        self._thread_lock.acquire()
+        try:
+            while not self._try_lock():
+                pass
+        except OSError as exc:
+            # e.g. a read-only directory, fetching will tell what's wrong
+            log_debug("Couldn't lock '%s': %s", self.lock_path, exc)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.fd is not None:
+            try:
+                os.unlink(self.lock_path)
+            except FileNotFoundError:
+                pass
+            os.close(self.fd)
+            self.fd = None
+        self._thread_lock.release()
+
+
+def copy_local(url, where=None, dry_run=False, force=False):
+    """Materialize a local source in the target directory.
+
+    Hard links the file if that doesn't change its metadata, otherwise
+    copies it without going through user space if possible. The
+    resulting file has the modification time of the original and the
+    mode set from the umask, like downloaded files.
+    """
+    if where is None:
+        where = os.getcwd()
+
+    assert is_local(url)
+
+    src = local_path(url)
+    fname = url.split("/")[-1]
+    fpath = os.path.join(where, fname)
+
+    if dry_run:
+        print(f"NOT copying '{src}' to '{fpath}'")
+        return
+
+    try:
+        src_stat = os.stat(src)
+    except OSError as exc:
+        raise DownloadError(f"Couldn't copy {src}: {exc.strerror}")
+
+    try:
+        if os.path.samefile(src, fpath):
+            return
+    except FileNotFoundError:
+        pass
+
+    with TargetLock(fpath) as lock:
+        if lock.waited and os.path.exists(fpath):
+            print(f"Using '{fpath}' fetched by another process")
+            return
+
+        print(f"Copying '{src}' to '{fpath}'")
+
+        where_stat = os.stat(where)
+        if src_stat.st_dev == where_stat.st_dev and src_stat.st_mode & 0o7777 == 0o666 & ~umask:
+            try:
+                _link_into_place(src, fpath, force)
+            except FileExistsError:
+                raise
+            except OSError:
+                # e.g. EPERM with fs.protected_hardlinks, EMLINK
+                pass
+            else:
+                return
+
+        with (
+            open(src, "rb") as src_fobj,
+            NamedTemporaryFile(dir=where, prefix=fname, mode="wb") as fobj,
+        ):
+            _copy_file_data(src_fobj, fobj)
+            fobj.flush()
+            _link_into_place(fobj.name, fpath, force)
+
+        os.utime(fpath, ns=(time.time_ns(), src_stat.st_mtime_ns))
+        _fix_mode(fpath)
+
+
+class _DownloadWriter(object):
+    """Write downloaded data to a file in large chunks.
+
+    libcurl hands over data in small pieces, often 16 KiB, collecting
+    them saves system calls. If the size of the file is known, space for
+    it is allocated up front, which keeps file systems like XFS from
+    fragmenting large files, and fails early if there's too little.
+
+    libcurl can't pass exceptions through, errors are kept and the
+    transfer is aborted.
+    """
+
+    def __init__(self, fobj, tee=None):
+        self.fobj = fobj
+        # also gets every piece of data, e.g. to extract it
+        self.tee = tee
+        self.buffer = bytearray()
+        # the size announced in the headers of the last response
+        self.size = None
+        self.written = 0
+        self.allocated = 0
+        self.started = False
+        self.error = None
+
+    def _start(self):
+        self.started = True
+        fd = self.fobj.fileno()
+
+        # posix_fadvise() and posix_fallocate() don't exist everywhere, e.g. macOS
+        if hasattr(os, "posix_fadvise"):  # pragma: no branch
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        if self.size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, 0, self.size)
+            except OSError as exc:
+                if exc.errno == errno.ENOSPC:
+                    raise
+                # e.g. not supported by the file system
+                log_debug("Couldn't allocate space for '%s': %s", self.fobj.name, exc)
+            else:
+                self.allocated = self.size
+
+    def header(self, line):
+        if line.startswith(b"HTTP/"):
+            # a new response, e.g. after a redirect
+            self.size = None
+            return
+        m = content_length_re.search(line)
+        if m:
+            self.size = int(m.group("size"))
+
+    def _flush(self, size):
+        with memoryview(self.buffer) as view, view[:size] as chunk:
+            self.fobj.write(chunk)
+        del self.buffer[:size]
+        self.written += size
+
+    def write(self, data):
+        try:
+            if not self.started:
+                self._start()
+            self.buffer += data
+            if len(self.buffer) >= WRITE_BUFFER_SIZE:
+                self._flush(len(self.buffer) - len(self.buffer) % WRITE_BUFFER_SIZE)
+        except OSError as exc:
+            self.error = exc
+            # abort the transfer
+            return 0
+
+        if self.tee is not None:
+            self.tee(data)
+
+    def finish(self):
+        """Write what's left, free space allocated beyond the end of the data."""
+        if self.buffer:
+            self._flush(len(self.buffer))
+        self.fobj.flush()
+        if self.allocated > self.written:
+            os.ftruncate(self.fobj.fileno(), self.written)
+
+
+def download(url, where=None, dry_run=False, insecure=False, force=False, extract_dir=None):
+    """Download a file into a directory.
+
+    With extract_dir, archives are also unpacked there: tar archives
+    compressed in a way tarfile can stream are unpacked while they're
+    downloaded, others afterwards.
+    """
     if where is None:
         where = os.getcwd()
 
@@ -41,36 +419,320 @@ def download(url, where=None, dry_run=False, insecure=False, force=False):
         print(f"NOT downloading '{url}' to '{fpath}'")
         return
 
-    with NamedTemporaryFile(dir=where, prefix=fname, mode="wb") as fobj:
-        c = pycurl.Curl()
-        c.setopt(c.URL, url)
-        c.setopt(c.WRITEDATA, fobj)
-        c.setopt(c.FOLLOWLOCATION, True)
-        # request file modification time
+    with TargetLock(fpath) as lock:
+        if lock.waited and os.path.exists(fpath):
+            print(f"Using '{fpath}' fetched by another process")
+            if extract_dir is not None:
+                extract_archive(fpath, extract_dir)
+            return
+
+        compression = stream_compression(fname) if extract_dir is not None else None
+        extractor = None
+
+        with NamedTemporaryFile(dir=where, prefix=fname, mode="wb") as fobj:
+            c = new_curl(url, insecure=insecure)
+            if compression is not None:
+                print(f"Extracting '{fpath}' to '{extract_dir}' while downloading")
+                extractor = StreamExtractor(fpath, compression, extract_dir)
+            writer = _DownloadWriter(fobj, tee=extractor.write if extractor else None)
+            c.setopt(c.HEADERFUNCTION, writer.header)
+            c.setopt(c.WRITEFUNCTION, writer.write)
+            # request file modification time
+            c.setopt(c.OPT_FILETIME, True)
+            try:
+                print(f"Downloading '{url}' to '{fpath}'")
+                try:
+                    c.perform()
+                    writer.finish()
+                except pycurl.error as exc:
+                    if writer.error is not None:
+                        raise DownloadError(f"Couldn't write {fpath}: {writer.error.strerror}")
+                    errno_, errmsg = exc.args
+                    if errno_ in HOST_DOWN_ERRORS:
+                        raise HostDownError(f"Couldn't download {url}: {errmsg}")
+                    raise DownloadError(f"Couldn't download {url}: {errmsg}")
+                except OSError as exc:
+                    raise DownloadError(f"Couldn't write {fpath}: {exc.strerror}")
+                ts = c.getinfo(c.INFO_FILETIME)
+                http_status = c.getinfo(pycurl.HTTP_CODE)
+                if not 200 <= http_status < 300:
+                    if http_status in HOST_DOWN_STATUSES:
+                        raise HostDownError(f"Couldn't download {url}: {http_status}")
+                    raise DownloadError(f"Couldn't download {url}: {http_status}")
+            except BaseException:
+                if extractor is not None:
+                    # the download failing is what matters
+                    with contextlib.suppress(ExtractError):
+                        extractor.finish()
+                raise
+            finally:
+                c.close()
+
+            _link_into_place(fobj.name, fpath, force)
+
+        # set file modification time
+        if ts != -1:
+            os.utime(fpath, (time.time(), ts))
+        _fix_mode(fpath)
+
+        if extractor is not None:
+            extractor.finish()
+        elif extract_dir is not None:
+            extract_archive(fpath, extract_dir)
+
+
+class TransferCoalescer(object):
+    """Coalesce transfers of identical URLs within one run.
+
+    The first request for a URL fetches the file, requests for the same
+    URL wait for this transfer to finish (if it still is in flight) and
+    then hard link the result into their target directories, or copy it
+    if that isn't possible.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._transfers = {}
+
+    def fetch(self, url, fetch_func, where=None, dry_run=False, force=False, **kwargs):
+        if dry_run:
+            fetch_func(url, where=where, dry_run=dry_run, force=force, **kwargs)
+            return
+
+        # waiters copy from the fetched file, which must be given as absolute path
+        target_dir = os.path.abspath(where if where is not None else os.getcwd())
+
+        with self._lock:
+            transfer = self._transfers.get(url)
+            if transfer is None:
+                transfer = self._transfers[url] = SimpleNamespace(
+                    done=threading.Event(), fetched_path=None
+                )
+                owner = True
+            else:
+                owner = False
+
+        if owner:
+            try:
+                fetch_func(url, where=where, dry_run=dry_run, force=force, **kwargs)
+                transfer.fetched_path = os.path.join(target_dir, url.split("/")[-1])
+            finally:
+                transfer.done.set()
+            return
+
+        transfer.done.wait()
+
+        if transfer.fetched_path is None:
+            # the first transfer failed, try again independently
+            fetch_func(url, where=where, dry_run=dry_run, force=force, **kwargs)
+        else:
+            copy_local(transfer.fetched_path, where=target_dir, force=force)
+
+
+def new_curl(url, insecure=False):
+    """Create a handle to transfer a URL, with the options all transfers have."""
+    c = pycurl.Curl()
+    c.setopt(c.URL, url)
+    c.setopt(c.FOLLOWLOCATION, True)
+    c.setopt(c.USERAGENT, f"rpmspectool/{version}")
+    if insecure:
+        c.setopt(c.SSL_VERIFYPEER, False)
+        c.setopt(c.SSL_VERIFYHOST, False)
+    c.url = url
+    return c
+
+
+def curl_share():
+    """Share DNS and TLS session caches and connections between transfers."""
+    share = pycurl.CurlShare()
+    for lock_data in ("LOCK_DATA_DNS", "LOCK_DATA_SSL_SESSION", "LOCK_DATA_CONNECT"):
+        # LOCK_DATA_CONNECT needs a recent libcurl
+        if hasattr(pycurl, lock_data):  # pragma: no branch
+            share.setopt(pycurl.SH_SHARE, getattr(pycurl, lock_data))
+    return share
+
+
+class TransferPool(object):
+    """Run transfers concurrently, reusing connections.
+
+    All transfers run in one multi handle, which keeps a pool of
+    connections for reuse, and share DNS and TLS session caches.
+    """
+
+    def __init__(self, max_connections=CHECK_CONNECTIONS, insecure=False, timeout=CHECK_TIMEOUT):
+        self.max_connections = max_connections
+        self.insecure = insecure
+        self.timeout = timeout
+
+        self.share = curl_share()
+
+        self.multi = pycurl.CurlMulti()
+        self.handles = set()
+
+    def curl(self, url):
+        """Create a handle to transfer a URL in the pool."""
+        c = new_curl(url, insecure=self.insecure)
+        c.setopt(c.SHARE, self.share)
+        c.setopt(c.CONNECTTIMEOUT, self.timeout)
+        c.setopt(c.TIMEOUT, self.timeout)
+        return c
+
+    def add(self, c):
+        """Start a transfer, also while others are completing."""
+        self.multi.add_handle(c)
+        self.handles.add(c)
+
+    def transfers(self, items, start):
+        """Run transfers, yield their handles and errors as they complete.
+
+        start() creates the handle for an item, or returns None to skip it.
+        At most max_connections items are transferred at once. Handles are closed after they are
+        yielded, and the pool when done or if the generator is closed.
+        """
+        pending = deque(items)
+
+        try:
+            while pending or self.handles:
+                while pending and len(self.handles) < self.max_connections:
+                    c = start(pending.popleft())
+                    if c is not None:
+                        self.add(c)
+
+                self.multi.perform()
+
+                _, ok_list, err_list = self.multi.info_read()
+
+                for c, errno_, errmsg in [(c, None, None) for c in ok_list] + err_list:
+                    self.multi.remove_handle(c)
+                    self.handles.remove(c)
+                    try:
+                        yield c, errno_, errmsg
+                    finally:
+                        c.close()
+
+                if self.handles:
+                    self.multi.select(1.0)
+        finally:
+            for c in self.handles:
+                self.multi.remove_handle(c)
+                c.close()
+            self.handles.clear()
+            self.multi.close()
+            self.share.close()
+
+
+class _URLChecker(object):
+    """Check URLs concurrently, reusing connections."""
+
+    def __init__(self, max_connections=CHECK_CONNECTIONS, insecure=False, timeout=CHECK_TIMEOUT):
+        self.pool = TransferPool(
+            max_connections=max_connections, insecure=insecure, timeout=timeout
+        )
+
+    def _transfer(self, url, method, elapsed=0.0):
+        c = self.pool.curl(url)
         c.setopt(c.OPT_FILETIME, True)
-        c.setopt(c.USERAGENT, f"rpmspectool/{version}")
-        if insecure:
-            c.setopt(c.SSL_VERIFYPEER, False)
-            c.setopt(c.SSL_VERIFYHOST, False)
+
+        c.method = method
+        c.elapsed = elapsed
+        c.total_size = None
+        c.got_body = False
+
+        if method == "HEAD":
+            c.setopt(c.NOBODY, True)
+        else:
+            # Only request the first byte, the total size is in the
+            # Content-Range header. Servers ignoring the range would send
+            # the whole file, so stop at the first chunk of the body.
+            c.setopt(c.RANGE, "0-0")
+
+            def header_function(line):
+                m = content_range_re.search(line)
+                if m:
+                    c.total_size = int(m.group("size"))
+
+            def write_function(data):
+                c.got_body = True
+                return 0
+
+            c.setopt(c.HEADERFUNCTION, header_function)
+            c.setopt(c.WRITEFUNCTION, write_function)
+
+        return c
+
+    def _result(self, c, errno_=None, errmsg=None):
+        elapsed = c.elapsed + c.getinfo(c.TOTAL_TIME)
+
+        if errno_ == pycurl.E_WRITE_ERROR and c.got_body:
+            # aborted deliberately after receiving the headers
+            errno_ = errmsg = None
+
+        status = c.getinfo(c.RESPONSE_CODE) or None
+
+        if errno_ is None and status and http_re.search(c.getinfo(c.EFFECTIVE_URL)):
+            if c.method == "HEAD" and status in HEAD_UNSUPPORTED_STATUSES:
+                return None, elapsed
+
+        size = c.total_size
+        if size is None:
+            content_length = c.getinfo(CONTENT_LENGTH_INFO)
+            if content_length >= 0 and not (c.method == "GET" and status == 206):
+                size = int(content_length)
+
+        filetime = c.getinfo(c.INFO_FILETIME)
+        if filetime != -1:
+            last_modified = datetime.fromtimestamp(filetime, timezone.utc).isoformat()
+        else:
+            last_modified = None
+
+        effective_url = c.getinfo(c.EFFECTIVE_URL)
+
+        if errno_ is not None:
+            ok = False
+        elif http_re.search(effective_url):
+            ok = 200 <= status < 300
+        else:
+            # e.g. FTP doesn't have HTTP status codes
+            ok = True
+
+        result = {
+            "url": c.url,
+            "ok": ok,
+            "status": status,
+            "size": size,
+            "last_modified": last_modified,
+            "redirects": c.getinfo(c.REDIRECT_COUNT),
+            "effective_url": effective_url,
+            "latency": round(elapsed, 6),
+            "method": c.method,
+            "error": errmsg,
+        }
+
+        return result, elapsed
+
+    def check(self, urls):
+        """Check URLs, yield results in the order they complete."""
+        transfers = self.pool.transfers(urls, lambda url: self._transfer(url, "HEAD"))
         try:
-            print(f"Downloading '{url}' to '{fpath}'")
-            c.perform()
-            ts = c.getinfo(c.INFO_FILETIME)
-            http_status = c.getinfo(pycurl.HTTP_CODE)
-            if not 200 <= http_status < 300:
-                raise DownloadError(f"Couldn't download {url}: {http_status}")
+            for c, errno_, errmsg in transfers:
+                result, elapsed = self._result(c, errno_, errmsg)
+                if result is None:
+                    # retry with a ranged GET request
+                    self.pool.add(self._transfer(c.url, "GET", elapsed))
+                else:
+                    yield result
         finally:
-            c.close()
+            # clean up transfers still running if the caller stops early
+            transfers.close()
 
-        if force:
-            try:
-                os.remove(fpath)
-            except FileNotFoundError:
-                pass
-        os.link(fobj.name, fpath)
 
-    # set file modification time
-    if ts != -1:
-        os.utime(fpath, (time.time(), ts))
-    # NamedTemporaryFile sets mode to 0600, change it to default per umask
-    os.chmod(fpath, 0o666 & ~umask)
+def check_urls(urls, max_connections=CHECK_CONNECTIONS, insecure=False, timeout=CHECK_TIMEOUT):
+    """Check if URLs can be downloaded, without downloading them.
+
+    Sends HEAD requests (or ranged GET requests if servers refuse HEAD)
+    through a shared pool of connections and yields a dictionary per
+    URL, containing the HTTP status, size, last modification time, the
+    number of redirects and the latency.
+    """
+    checker = _URLChecker(max_connections=max_connections, insecure=insecure, timeout=timeout)
+    yield from checker.check(urls)
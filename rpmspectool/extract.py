@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# rpmspectool.extract: unpack downloaded archives
+
+import os
+import subprocess
+import tarfile
+import threading
+import zipfile
+
+# tarfile only handles Zstandard if the compression.zstd module exists (Python >= 3.14)
+ZSTD_SUPPORTED = "zst" in tarfile.TarFile.OPEN_METH
+ZSTD_TAR_SUFFIXES = (".tar.zst", ".tzst")
+
+# archives which can be unpacked while they're downloaded, by file name suffix
+STREAM_COMPRESSIONS = {
+    ".tar": "",
+    ".tar.gz": "gz",
+    ".tgz": "gz",
+    ".tar.bz2": "bz2",
+    ".tbz2": "bz2",
+    ".tar.xz": "xz",
+    ".txz": "xz",
+}
+if ZSTD_SUPPORTED:  # pragma: no cover
+    STREAM_COMPRESSIONS |= dict.fromkeys(ZSTD_TAR_SUFFIXES, "zst")
+
+# how much to read at once when skipping over data following an archive
+DRAIN_CHUNK_SIZE = 1 << 20
+
+
+class ExtractError(RuntimeError):
+    pass
+
+
+def stream_compression(fname):
+    """Determine how to unpack a file while downloading it, None if not possible."""
+    lower = fname.lower()
+    for suffix, compression in STREAM_COMPRESSIONS.items():
+        if lower.endswith(suffix):
+            return compression
+    return None
+
+
+def extract_archive(fpath, extract_dir):
+    """Unpack a tar or zip archive, return if the file was one.
+
+    Like with streaming extraction, tar members are filtered so they can't
+    end up outside of extract_dir or be e.g. device files.
+    """
+    if not ZSTD_SUPPORTED and fpath.lower().endswith(ZSTD_TAR_SUFFIXES):
+        _extract_zstd_tar(fpath, extract_dir)
+        return True
+
+    try:
+        if tarfile.is_tarfile(fpath):
+            print(f"Extracting '{fpath}' to '{extract_dir}'")
+            os.makedirs(extract_dir, exist_ok=True)
+            with tarfile.open(fpath) as tar:
+                tar.extractall(extract_dir, filter="data")
+        elif zipfile.is_zipfile(fpath):
+            print(f"Extracting '{fpath}' to '{extract_dir}'")
+            os.makedirs(extract_dir, exist_ok=True)
+            with zipfile.ZipFile(fpath) as zip:
+                zip.extractall(extract_dir)
+        else:
+            return False
+    except (OSError, tarfile.TarError, zipfile.BadZipFile) as exc:
+        raise ExtractError(f"Couldn't extract {fpath}: {exc}")
+
+    return True
+
+
+def _extract_zstd_tar(fpath, extract_dir):
+    """Unpack a tar archive compressed with Zstandard, decompressed by the zstd program.
+
+    Python < 3.14 can't decompress Zstandard itself.
+    """
+    try:
+        proc = subprocess.Popen(
+            ("zstd", "-dcq", fpath), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+    except OSError:
+        raise ExtractError(f"Couldn't extract {fpath}: zstd isn't available")
+
+    print(f"Extracting '{fpath}' to '{extract_dir}'")
+    try:
+        os.makedirs(extract_dir, exist_ok=True)
+        with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+            tar.extractall(extract_dir, filter="data")
+        # consume padding after the end of the archive, zstd would block otherwise
+        while proc.stdout.read(DRAIN_CHUNK_SIZE):
+            pass
+    except (OSError, tarfile.TarError) as exc:
+        proc.kill()
+        raise ExtractError(f"Couldn't extract {fpath}: {exc}")
+    finally:
+        proc.stdout.close()
+        stderr = proc.stderr.read().decode("utf-8", errors="replace").strip()
+        proc.stderr.close()
+        proc.wait()
+
+    if proc.returncode:
+        raise ExtractError(f"Couldn't extract {fpath}: {stderr or 'zstd failed'}")
+
+
+class StreamExtractor(object):
+    """Unpack a tar archive from data fed to it, e.g. while downloading it.
+
+    The data is passed through a pipe to a thread which unpacks it, so a
+    slow extraction slows down the transfer instead of piling up data in
+    memory. If extraction fails, further data is dropped and finish()
+    raises the error.
+    """
+
+    def __init__(self, fname, compression, extract_dir):
+        self.fname = fname
+        self.error = None
+
+        os.makedirs(extract_dir, exist_ok=True)
+        read_fd, write_fd = os.pipe()
+        self._reader = os.fdopen(read_fd, "rb")
+        self._writer = os.fdopen(write_fd, "wb")
+        self._thread = threading.Thread(
+            target=self._extract, args=(compression, extract_dir), daemon=True
+        )
+        self._thread.start()
+
+    def _extract(self, compression, extract_dir):
+        try:
+            with tarfile.open(fileobj=self._reader, mode=f"r|{compression}") as tar:
+                tar.extractall(extract_dir, filter="data")
+            # consume padding after the end of the archive, the writer would block otherwise
+            while self._reader.read(DRAIN_CHUNK_SIZE):
+                pass
+        except Exception as exc:
+            self.error = exc
+        finally:
+            self._reader.close()
+
+    def write(self, data):
+        if self._writer.closed:
+            return
+        try:
+            self._writer.write(data)
+        except BrokenPipeError:
+            # extraction failed and stopped reading
+            self._close_writer()
+
+    def _close_writer(self):
+        try:
+            self._writer.close()
+        except BrokenPipeError:
+            # buffered data couldn't be written anymore, the file is closed anyway
+            pass
+
+    def finish(self):
+        """Wait for extraction to finish, raise ExtractError if it failed."""
+        self._close_writer()
+        self._thread.join()
+
+        if self.error is not None:
+            raise ExtractError(f"Couldn't extract {self.fname}: {self.error}")
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# rpmspectool.lockfile: record resolved sources and patches, fetch them without rpm
+
+import hashlib
+import json
+import os
+
+from .cache import write_json_atomically
+from .version import version
+
+LOCKFILE_VERSION = 1
+
+# what an entry describes, in this order
+ENTRY_KEYS = ("specfile", "kind", "index", "url", "filename", "srcdir")
+
+
+class LockfileError(RuntimeError):
+    pass
+
+
+def file_sha512(path):
+    with open(path, "rb") as fobj:
+        return hashlib.file_digest(fobj, "sha512").hexdigest()
+
+
+def lock_entry(record, search_dirs):
+    """Describe a listed file, with size, mtime and hash if a local copy exists.
+
+    The first of search_dirs which contains the file is used.
+    """
+    entry = {key: record[key] for key in ENTRY_KEYS}
+    entry |= {"size": None, "mtime": None, "sha512": None}
+
+    for dirpath in search_dirs:
+        if not dirpath:
+            continue
+        path = os.path.join(dirpath, record["filename"])
+        try:
+            st = os.stat(path)
+            sha512 = file_sha512(path)
+        except OSError:
+            continue
+        entry |= {"size": st.st_size, "mtime": int(st.st_mtime), "sha512": sha512}
+        break
+
+    return entry
+
+
+def write_lockfile(path, entries):
+    kind_order = {"source": 0, "patch": 1}
+    entries = sorted(entries, key=lambda e: (e["specfile"], kind_order[e["kind"]], e["index"]))
+    write_json_atomically(
+        path,
+        {"version": LOCKFILE_VERSION, "generator": f"rpmspectool {version}", "entries": entries},
+    )
+
+
+def read_lockfile(path):
+    try:
+        with open(path, "r") as fobj:
+            data = json.load(fobj)
+    except OSError as exc:
+        raise LockfileError(f"Can’t read lockfile {path}: {exc.strerror}")
+    except ValueError as exc:
+        raise LockfileError(f"Can’t parse lockfile {path}: {exc}")
+
+    if not isinstance(data, dict) or data.get("version") != LOCKFILE_VERSION:
+        raise LockfileError(f"Unsupported lockfile {path}")
+
+    entries = data.get("entries")
+    if not isinstance(entries, list) or not all(
+        isinstance(entry, dict) and all(key in entry for key in ENTRY_KEYS) for entry in entries
+    ):
+        raise LockfileError(f"Invalid entries in lockfile {path}")
+
+    return entries
+
+
+def verify_file(entry, path):
+    """Check a fetched file against its lockfile entry, return an error message if it differs."""
+    try:
+        size = os.path.getsize(path)
+        if entry.get("size") is not None and size != entry["size"]:
+            return f"{path}: size {size} doesn’t match lockfile ({entry['size']})"
+        if entry.get("sha512") and file_sha512(path) != entry["sha512"]:
+            return f"{path}: SHA512 doesn’t match lockfile"
+    except OSError as exc:
+        return f"Can’t verify {path}: {exc.strerror}"
+    return None
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+#
+# rpmspectool.pipeline: overlap processing stages of batch runs
+
+import itertools
+import math
+import queue
+import threading
+
+# marks the end of the work for consumers
+_DONE = object()
+
+# how often blocked workers check if the pipeline was aborted, in seconds
+POLL_INTERVAL = 0.1
+
+
+class Pipeline(object):
+    """Run two stages of work concurrently, connected by a bounded queue.
+
+    Producer workers call `produce` on each input, which returns an
+    iterable of items. Each item is handed to `consume` in a consumer
+    worker as soon as it is produced, so e.g. downloading the sources of
+    one spec file overlaps with evaluating the next. The bounded queue
+    keeps producers from running too far ahead of consumers.
+
+    With one producer and one consumer, items are consumed in the order
+    they were produced. With `priority`, the queue is unbounded unless
+    queue_size is given, and of the items produced so far, consumers
+    pick the one for which `priority` returns the lowest value first.
+
+    If either callable raises an exception, the pipeline is aborted and
+    the exception is raised again from run().
+    """
+
+    def __init__(self, produce, consume, producers=1, consumers=1, queue_size=None, priority=None):
+        self.produce = produce
+        self.consume = consume
+        self.producers = producers
+        self.consumers = consumers
+        self.priority = priority
+        if queue_size is None:
+            queue_size = 0 if priority is not None else 2 * consumers
+        self.queue_size = queue_size
+
+    def _put(self, q, item):
+        if self.priority is not None:
+            # the counter keeps items with equal priority in order, and from being compared
+            rank = math.inf if item is _DONE else self.priority(item)
+            item = (rank, next(self._counter), item)
+        while not self._abort.is_set():
+            try:
+                q.put(item, timeout=POLL_INTERVAL)
+            except queue.Full:
+                continue
+            return
+
+    def _get(self, q):
+        while not self._abort.is_set():
+            try:
+                item = q.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            return item if self.priority is None else item[2]
+        return _DONE
+
+    def _fail(self, exc):
+        with self._lock:
+            if self._exception is None:
+                self._exception = exc
+        self._abort.set()
+
+    def _producer(self):
+        try:
+            while not self._abort.is_set():
+                try:
+                    input = self._inputs.get_nowait()
+                except queue.Empty:
+                    break
+                for item in self.produce(input):
+                    self._put(self._items, item)
+        except BaseException as exc:
+            self._fail(exc)
+        finally:
+            with self._lock:
+                self._producers_left -= 1
+                last_producer = not self._producers_left
+            if last_producer:
+                for _ in range(self.consumers):
+                    self._put(self._items, _DONE)
+
+    def _consumer(self):
+        try:
+            while (item := self._get(self._items)) is not _DONE:
+                self.consume(item)
+        except BaseException as exc:
+            self._fail(exc)
+
+    def run(self, inputs):
+        self._inputs = queue.SimpleQueue()
+        for input in inputs:
+            self._inputs.put(input)
+        if self.priority is None:
+            self._items = queue.Queue(maxsize=self.queue_size)
+        else:
+            self._items = queue.PriorityQueue(maxsize=self.queue_size)
+            self._counter = itertools.count()
+        self._abort = threading.Event()
+        self._lock = threading.Lock()
+        self._exception = None
+        self._producers_left = self.producers
+
+        threads = [
+            threading.Thread(target=self._producer, daemon=True) for _ in range(self.producers)
+        ] + [threading.Thread(target=self._consumer, daemon=True) for _ in range(self.consumers)]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._exception is not None:
+            raise self._exception
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#
+# rpmspectool.remote: fetch spec files from URLs, revalidating cached copies
+
+import hashlib
+import json
+import os
+from logging import debug as log_debug
+from tempfile import NamedTemporaryFile
+from urllib.parse import unquote, urlsplit
+
+from .cache import cache_dir, write_json_atomically
+from .download import CHECK_CONNECTIONS, CHECK_TIMEOUT, DownloadError, TransferPool, http_re
+
+# response headers which let a cached copy be revalidated, and the request headers to do that
+VALIDATORS = {"etag": "If-None-Match", "last-modified": "If-Modified-Since"}
+
+
+def spec_filename(url):
+    """The file name of a spec file (or source RPM package) at a URL."""
+    return os.path.basename(unquote(urlsplit(url).path)) or "remote.spec"
+
+
+class RemoteSpecCache(object):
+    """Local copies of spec files fetched from URLs.
+
+    Copies are revalidated with conditional requests, using the ETag and
+    Last-Modified headers the server sent with them. Spec files which
+    didn't change cost one request answered with 304 Not Modified.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(cache_dir(), "specs")
+
+    def _entry_path(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, key[:2], key)
+
+    def cached_path(self, url):
+        """The path of the cached copy of a spec file, and its validators."""
+        entry_path = self._entry_path(url)
+        try:
+            with open(f"{entry_path}.json") as fobj:
+                data = json.load(fobj)
+            path = os.path.join(entry_path, data["filename"])
+            validators = {name: data["validators"][name] for name in VALIDATORS}
+        except (OSError, ValueError, KeyError, TypeError):
+            return None, {}
+
+        if not os.path.isfile(path):
+            return None, {}
+
+        return path, validators
+
+    def _store(self, url, tmp_path, validators):
+        entry_path = self._entry_path(url)
+        filename = spec_filename(url)
+
+        os.replace(tmp_path, os.path.join(entry_path, filename))
+
+        write_json_atomically(
+            f"{entry_path}.json",
+            {
+                "url": url,
+                "filename": filename,
+                "validators": {name: validators.get(name) for name in VALIDATORS},
+            },
+        )
+
+        return os.path.join(entry_path, filename)
+
+    def _transfer(self, pool, url):
+        # source RPM packages can be large, don't keep them in memory
+        entry_path = self._entry_path(url)
+        os.makedirs(entry_path, exist_ok=True)
+        fobj = NamedTemporaryFile(dir=entry_path, prefix=spec_filename(url), delete=False)
+
+        c = pool.curl(url)
+        c.fobj = fobj
+
+        c.cached_path, validators = self.cached_path(url)
+        if c.cached_path is not None:
+            c.setopt(
+                c.HTTPHEADER,
+                [
+                    f"{VALIDATORS[name]}: {value}"
+                    for name, value in validators.items()
+                    if value is not None
+                ],
+            )
+
+        c.validators = {}
+
+        def header_function(line):
+            line = line.decode("iso-8859-1")
+            if line.startswith("HTTP/"):
+                # the headers of a response following a redirect
+                c.validators = {}
+            name, sep, value = line.partition(":")
+            if sep and name.strip().lower() in VALIDATORS:
+                c.validators[name.strip().lower()] = value.strip()
+
+        c.setopt(c.HEADERFUNCTION, header_function)
+        c.setopt(c.WRITEDATA, c.fobj)
+
+        return c
+
+    @staticmethod
+    def _discard(c):
+        c.fobj.close()
+        try:
+            os.unlink(c.fobj.name)
+        except FileNotFoundError:
+            pass
+
+    def _finish(self, c, errmsg):
+        c.fobj.close()
+
+        if errmsg is not None:
+            raise DownloadError(f"Couldn't download {c.url}: {errmsg}")
+
+        status = c.getinfo(c.RESPONSE_CODE)
+        if http_re.search(c.getinfo(c.EFFECTIVE_URL)):
+            if status == 304 and c.cached_path is not None:
+                log_debug("%s not modified, using '%s'", c.url, c.cached_path)
+                return c.cached_path
+            if not 200 <= status < 300:
+                raise DownloadError(f"Couldn't download {c.url}: {status}")
+
+        try:
+            return self._store(c.url, c.fobj.name, c.validators)
+        except OSError as exc:
+            raise DownloadError(f"Couldn't store {c.url}: {exc.strerror}")
+
+    def fetch(self, urls, insecure=False, max_connections=CHECK_CONNECTIONS, timeout=CHECK_TIMEOUT):
+        """Fetch spec files concurrently, through one pool of connections.
+
+        Returns the paths of the local copies and error messages, both by
+        URL.
+        """
+        paths = {}
+        errors = {}
+
+        pool = TransferPool(max_connections=max_connections, insecure=insecure, timeout=timeout)
+        running = set()
+
+        def start(url):
+            try:
+                c = self._transfer(pool, url)
+            except OSError as exc:
+                errors[url] = f"Couldn't store {url}: {exc.strerror}"
+                return None
+            running.add(c)
+            return c
+
+        try:
+            for c, errno_, errmsg in pool.transfers(dict.fromkeys(urls), start):
+                running.remove(c)
+                try:
+                    paths[c.url] = self._finish(c, errmsg)
+                except DownloadError as exc:
+                    errors[c.url] = exc.args[0]
+                finally:
+                    # unless stored, e.g. if not modified
+                    self._discard(c)
+        finally:
+            # interrupted transfers
+            for c in running:
+                self._discard(c)
+
+        return paths, errors
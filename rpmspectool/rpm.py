@@ -3,17 +3,90 @@
 # rpmspectool.rpm: RPM spec handling for rpmspectool
 # Copyright © 2015 Red Hat, Inc.
 
+import inspect
+import os
 import re
 from collections import defaultdict
 from functools import lru_cache
 from logging import debug as log_debug
 from subprocess import DEVNULL, PIPE, Popen
 
+from .srpm import open_spec
+from .trace import rusage_args, span
+
 
 class RPMSpecEvalError(Exception):
     pass
 
 
+def _can_hook_try_wait():
+    """Check if Popen._try_wait() looks like RusagePopen expects it to."""
+    try:
+        parameters = list(inspect.signature(Popen._try_wait).parameters)
+    except AttributeError:
+        return False
+    return parameters == ["self", "wait_flags"]
+
+
+_TRY_WAIT_HOOKABLE = _can_hook_try_wait()
+
+
+class RusagePopen(Popen):
+    """Popen which records the resource usage of the child process.
+
+    This hooks into the private Popen._try_wait(). If it changed in the
+    running Python version, no resource usage is recorded.
+    """
+
+    rusage = None
+
+    def _try_wait(self, wait_flags):
+        if not _TRY_WAIT_HOOKABLE:
+            return super()._try_wait(wait_flags)
+
+        try:
+            pid, sts, rusage = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            # see Popen._try_wait()
+            return self.pid, 0
+        if pid == self.pid:
+            self.rusage = rusage
+        return pid, sts
+
+
+# ways to get sources and patches out of rpmbuild, the first is the default
+EVAL_STRATEGIES = ("heredoc", "lua")
+
+# marks lines with records written by the Lua strategy
+LUA_RECORD_MARKER = b"@rpmspectool@"
+
+# marks where the output of a spec file evaluated in a batch begins and ends
+SPEC_MARKER = b"@rpmspectool-spec@"
+spec_marker_re = re.compile(
+    rb"^" + re.escape(SPEC_MARKER) + rb" (?P<which>begin|end) (?P<id>\d+)$", re.MULTILINE
+)
+
+# Print a record per source and patch as rpm numbered them, and the source
+# directory, while rpmbuild parses %prep. The "%" character is built from its
+# code so the snippet survives whether or not rpm expands macros in it.
+LUA_EMIT_RECORDS = rb"""%{lua:
+local pct = string.char(37)
+local marker = "@rpmspectool@"
+assert(source_nums and patch_nums, "rpm doesn't number sources and patches for Lua")
+local function emit(kind, tag, nums)
+    for _, num in ipairs(nums) do
+        local url = rpm.expand(pct .. "{" .. tag .. "URL" .. num .. "}")
+        io.stdout:write(marker, "\t", kind, "\t", num, "\t", url, "\n")
+    end
+end
+emit("source", "SOURCE", source_nums)
+emit("patch", "PATCH", patch_nums)
+io.stdout:write(marker, "\tsrcdir\t\t", rpm.expand(pct .. "{_sourcedir}"), "\n")
+io.stdout:flush()
+}
+"""
+
+
 class RPMSpecHandler(object):
     rpmcmd = "rpm"
     rpmbuildcmd = "rpmbuild"
@@ -83,11 +156,14 @@ class RPMSpecHandler(object):
 
     rpm_cmd_macros = ("_topdir", "_sourcedir", "_builddir", "_srcrpmdir", "_rpmdir")
 
-    def __init__(self, tmpdir, in_specfile, out_specfile):
+    def __init__(self, tmpdir, in_specfile, out_specfile, strategy=EVAL_STRATEGIES[0]):
         self.tmpdir = tmpdir
+        self.strategy = strategy
+        # set when evaluated together with other spec files, see eval_specfiles()
+        self.batch_id = None
         if isinstance(in_specfile, str):
             self.in_specfile_path = in_specfile
-            self.in_specfile = open(in_specfile, "rb")
+            self.in_specfile = open_spec(in_specfile)
         else:
             self.in_specfile_path = in_specfile.name
             self.in_specfile = in_specfile
@@ -104,113 +180,208 @@ class RPMSpecHandler(object):
 
         log_debug("writing parsed file '%s'", self.out_specfile_path)
 
+        with span("write_rpm_macros", "rpm", spec=self.in_specfile_path):
+            self.write_rpm_macros()
+        with span("write_preamble", "rpm", spec=self.in_specfile_path):
+            self.write_preamble(definitions)
+        with span("run_rpmbuild", "rpm", spec=self.in_specfile_path):
+            stdout = self.run_rpmbuild()
+        with span("parse_output", "rpm", spec=self.in_specfile_path):
+            return self.parse_output(stdout)
+
+    def rpm_macro_values(self):
+        """Look up the values of macros used by rpmbuild."""
         cmdline = (self.rpmcmd, "--eval")
+        values = {}
+
+        for macro in self.rpm_cmd_macros:
+            with span("rpm --eval", "subprocess", macro=macro) as span_args:
+                with RusagePopen(
+                    cmdline + (f"%{macro}\n",),
+                    stdin=DEVNULL,
+                    stdout=PIPE,
+                    stderr=DEVNULL,
+                    close_fds=True,
+                ) as rpmpipe:
+                    values[macro] = rpmpipe.stdout.read()
+                span_args |= rusage_args(rpmpipe.rusage)
+
+        return values
+
+    def write_rpm_macros(self, values=None):
+        """Write the values of macros used by rpmbuild into the intermediate spec file."""
+        if values is None:
+            values = self.rpm_macro_values()
 
         for macro in self.rpm_cmd_macros:
             self.out_specfile.write(f"%undefine {macro}\n%define {macro} ".encode("utf-8"))
-            with Popen(
-                cmdline + (f"%{macro}\n",),
-                stdin=DEVNULL,
-                stdout=PIPE,
-                stderr=DEVNULL,
-                close_fds=True,
-            ) as rpmpipe:
-                self.out_specfile.write(rpmpipe.stdout.read())
+            self.out_specfile.write(values[macro])
         self.out_specfile.write(b"\n")
 
-        for definition in definitions:
-            self.out_specfile.write(f"%define {definition}\n".encode("utf-8"))
+    @classmethod
+    def extract_preamble(cls, in_specfile):
+        """Extract the preamble from a spec file, ready for evaluation.
 
-        if self.need_conditionals_quirk:
-            self._write_conditionals_quirk()
+        Arch specific tags are dropped, legacy tags replaced and open
+        conditional blocks closed. Stops reading at the end of the
+        preamble.
 
+        :param in_specfile: the spec file, opened in binary mode
+        :return: the preamble as bytes, and whether it has a Group tag
+        """
         preamble = []
         group_seen = False
         conditional_depth = 0
 
-        for line in self.in_specfile.readlines():
-            m = self.macro_re.search(line)
+        for line in in_specfile:
+            m = cls.macro_re.search(line)
             if m:
                 name = m.group("name")
-                if name in self.preamble_delimiters:
+                if name in cls.preamble_delimiters:
                     # unwind open conditional blocks
-                    unwinding_lines = [b"%endif\n"] * conditional_depth
-                    preamble.extend(unwinding_lines)
-                    self.out_specfile.write(b"".join(unwinding_lines))
+                    preamble.extend([b"%endif\n"] * conditional_depth)
 
                     # we're only interested in the preamble
                     break
-                elif name in self.conditional_names:
+                elif name in cls.conditional_names:
                     conditional_depth += 1
                 elif name == b"endif":
                     conditional_depth -= 1
 
             # ignore arch specifics
-            if self.archstuff_re.search(line):
+            if cls.archstuff_re.search(line):
                 continue
 
             # replace legacy tags
-            line = self.copyright_re.sub(rb"License", line)
-            line = self.serial_re.sub(rb"Epoch", line)
+            line = cls.copyright_re.sub(rb"License", line)
+            line = cls.serial_re.sub(rb"Epoch", line)
 
             preamble.append(line)
-            self.out_specfile.write(line)
 
-            if self.group_re.search(line):
+            if cls.group_re.search(line):
                 group_seen = True
 
+        return b"".join(preamble), group_seen
+
+    def write_preamble(self, definitions=()):
+        """Copy the preamble of the spec file into the intermediate spec file.
+
+        With the heredoc strategy, the preamble is copied twice: once to
+        be parsed by rpmbuild, and once into the %prep section which
+        prints it with macros expanded. With the Lua strategy, it's
+        copied once, and the %prep section prints the sources and
+        patches rpm found in it.
+        """
+        for definition in definitions:
+            self.out_specfile.write(f"%define {definition}\n".encode("utf-8"))
+
+        if self.need_conditionals_quirk:
+            self._write_conditionals_quirk()
+
+        preamble_bytes, group_seen = self.extract_preamble(self.in_specfile)
         self.in_specfile.close()
 
-        if not group_seen:
-            preamble.append(b"Group: rpmspectool\n")
+        self.out_specfile.write(preamble_bytes)
 
-        preamble_bytes = b"".join(preamble)
+        self.out_specfile.write(b"%description\n%prep\n" + self._spec_marker(b"begin"))
 
-        self.out_specfile.write(
-            b"%description\n%prep\ncat << EOF\n"
-            + preamble_bytes
-            + b"\nSrcDir: %{_sourcedir}\n"
-            + b"EOF\n"
-        )
+        if self.strategy == "lua":
+            self.out_specfile.write(LUA_EMIT_RECORDS)
+        else:
+            if not group_seen:
+                preamble_bytes += b"Group: rpmspectool\n"
+
+            self.out_specfile.write(
+                b"cat << EOF\n" + preamble_bytes + b"\nSrcDir: %{_sourcedir}\n" + b"EOF\n"
+            )
+
+        self.out_specfile.write(self._spec_marker(b"end"))
 
         self.out_specfile.close()
 
+    def _spec_marker(self, which):
+        """Mark the output of a spec file evaluated in a batch, in %prep."""
+        if self.batch_id is None:
+            return b""
+        marker = SPEC_MARKER + b" " + which + b" " + str(self.batch_id).encode("ascii")
+        if self.strategy == "lua":
+            # records are written while parsing, before %prep runs
+            return b'%{lua: io.stdout:write("' + marker + b'\\n") io.stdout:flush()}\n'
+        return b"echo '" + marker + b"'\n"
+
+    def run_rpmbuild(self):
+        """Run rpmbuild on the intermediate spec file and return its output."""
+        returncode, stdout, stderr = self._rpmbuild([self.out_specfile_path])
+
+        if returncode:
+            raise RPMSpecEvalError(self.out_specfile_path, returncode, stderr)
+
+        return stdout
+
+    def _rpmbuild(self, specpaths):
+        """Run rpmbuild on intermediate spec files, return exit code and output."""
         cmdline = [self.rpmbuildcmd]
 
         for macro in self.rpm_cmd_macros:
             cmdline.extend(("--define", f"{macro} {self.tmpdir}"))
 
-        cmdline.extend(("--nodeps", "-bp", self.out_specfile_path))
+        cmdline.extend(("--nodeps", "-bp", *specpaths))
+
+        with span("rpmbuild -bp", "subprocess", specs=len(specpaths)) as span_args:
+            with RusagePopen(
+                cmdline, stdin=DEVNULL, stdout=PIPE, stderr=PIPE, close_fds=True
+            ) as rpm:
+                stdout, stderr = rpm.communicate()
+            span_args |= rusage_args(rpm.rusage)
+
+        return rpm.returncode, stdout, stderr
+
+    def parse_output(self, stdout):
+        """Parse sources, patches and the source directory from rpmbuild output."""
+        if self.strategy == "lua":
+            return self.parse_lua_output(stdout)
 
         ret_dict = defaultdict(dict)
 
         sourcepatchidx = {b"source": -1, b"patch": -1}
 
-        with Popen(cmdline, stdin=DEVNULL, stdout=PIPE, stderr=PIPE, close_fds=True) as rpm:
-            stdout, stderr = rpm.communicate()
-            if rpm.returncode:
-                raise RPMSpecEvalError(self.out_specfile_path, rpm.returncode, stderr)
-
-            for line in stdout.split(b"\n"):
-                line = line.strip()
-                m = self.source_patch_re.search(line)
-                if m:
-                    sourcepatch = m.group("sourcepatch").lower()
-                    if sourcepatch == b"source":
-                        log_debug("Found source: %r", line)
-                        spdict = ret_dict["sources"]
-                    else:
-                        log_debug("Found patch: %r", line)
-                        spdict = ret_dict["patches"]
-                    try:
-                        index = int(m.group("index"))
-                    except TypeError:
-                        index = sourcepatchidx[sourcepatch] + 1
-                    sourcepatchidx[sourcepatch] = index
-                    spdict[index] = m.group("fileurl").decode("utf-8")
-                m = self.srcdir_re.search(line)
-                if m:
-                    ret_dict["srcdir"] = m.group("srcdir").decode("utf-8")
+        for line in stdout.split(b"\n"):
+            line = line.strip()
+            m = self.source_patch_re.search(line)
+            if m:
+                sourcepatch = m.group("sourcepatch").lower()
+                if sourcepatch == b"source":
+                    log_debug("Found source: %r", line)
+                    spdict = ret_dict["sources"]
+                else:
+                    log_debug("Found patch: %r", line)
+                    spdict = ret_dict["patches"]
+                try:
+                    index = int(m.group("index"))
+                except TypeError:
+                    index = sourcepatchidx[sourcepatch] + 1
+                sourcepatchidx[sourcepatch] = index
+                spdict[index] = m.group("fileurl").decode("utf-8")
+            m = self.srcdir_re.search(line)
+            if m:
+                ret_dict["srcdir"] = m.group("srcdir").decode("utf-8")
+
+        return ret_dict
+
+    def parse_lua_output(self, stdout):
+        """Parse the records printed by the Lua strategy."""
+        ret_dict = defaultdict(dict)
+
+        for line in stdout.split(b"\n"):
+            if not line.startswith(LUA_RECORD_MARKER + b"\t"):
+                continue
+            _, kind, index, value = line.split(b"\t", 3)
+            value = value.decode("utf-8")
+            if kind == b"srcdir":
+                ret_dict["srcdir"] = value
+            else:
+                log_debug("Found %s %s: %r", kind.decode("utf-8"), int(index), value)
+                ret_dict["sources" if kind == b"source" else "patches"][int(index)] = value
 
         return ret_dict
 
@@ -238,3 +409,99 @@ class RPMSpecHandler(object):
             self.out_specfile.write(
                 f"%undefine {macro}\n%define {macro}() %{{expand:{expansion}}}\n".encode("utf-8")
             )
+
+
+def split_batch_output(stdout):
+    """Split the output of a batch into that of its spec files, by batch id.
+
+    Only spec files whose output ended are included.
+    """
+    segments = {}
+    begin = {}
+    for m in spec_marker_re.finditer(stdout):
+        batch_id = int(m.group("id"))
+        if m.group("which") == b"begin":
+            begin[batch_id] = m.end()
+        elif batch_id in begin:
+            segments[batch_id] = stdout[begin.pop(batch_id) : m.start()]
+    return segments
+
+
+def eval_specfiles(handlers, definitions=()):
+    """Evaluate several spec files, in as few rpmbuild runs as possible.
+
+    The intermediate spec files mark where their output begins and ends,
+    so it can be told apart. The values of rpm macros are looked up only
+    once. If rpmbuild fails, the spec files whose output is complete
+    are done, the first incomplete one is evaluated alone to get its
+    error, and the rest are evaluated again together.
+
+    Returns a list with the result or the RPMSpecEvalError for each
+    handler.
+    """
+    handlers = list(handlers)
+
+    if len(handlers) == 1:
+        try:
+            return [handlers[0].eval_specfile(definitions)]
+        except RPMSpecEvalError as exc:
+            return [exc]
+
+    results = [None] * len(handlers)
+    if not handlers:
+        return results
+
+    with span("write_rpm_macros", "rpm", specs=len(handlers)):
+        macro_values = handlers[0].rpm_macro_values()
+
+    for batch_id, handler in enumerate(handlers):
+        handler.batch_id = batch_id
+        with span("write_preamble", "rpm", spec=handler.in_specfile_path):
+            handler.write_rpm_macros(macro_values)
+            handler.write_preamble(definitions)
+
+    pending = list(range(len(handlers)))
+    while pending:
+        if len(pending) == 1:
+            results[pending[0]] = _eval_alone(handlers[pending[0]])
+            break
+
+        with span("run_rpmbuild", "rpm", specs=len(pending)):
+            returncode, stdout, _ = handlers[pending[0]]._rpmbuild(
+                [handlers[batch_id].out_specfile_path for batch_id in pending]
+            )
+
+        segments = split_batch_output(stdout)
+        incomplete = []
+        for batch_id in pending:
+            if batch_id in segments:
+                with span("parse_output", "rpm", spec=handlers[batch_id].in_specfile_path):
+                    results[batch_id] = handlers[batch_id].parse_output(segments[batch_id])
+            else:
+                incomplete.append(batch_id)
+
+        if not incomplete:
+            break
+
+        # The first spec file without complete output is the one which failed,
+        # evaluate it alone to get its error and the others together again.
+        failed, *pending = incomplete
+        log_debug(
+            "rpmbuild exited with %s, evaluating %s alone",
+            returncode,
+            handlers[failed].in_specfile_path,
+        )
+        results[failed] = _eval_alone(handlers[failed])
+
+    return results
+
+
+def _eval_alone(handler):
+    """Evaluate an already written intermediate spec file on its own."""
+    try:
+        with span("run_rpmbuild", "rpm", spec=handler.in_specfile_path):
+            stdout = handler.run_rpmbuild()
+    except RPMSpecEvalError as exc:
+        return exc
+    with span("parse_output", "rpm", spec=handler.in_specfile_path):
+        return handler.parse_output(stdout)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# rpmspectool.schedule: order downloads by size, estimate when they're done
+
+import threading
+import time
+from datetime import timedelta
+
+from .download import check_urls, is_url
+
+SIZE_UNITS = ("B", "KiB", "MiB", "GiB")
+
+
+def _format_size(size):
+    exponent = 0
+    while size >= 1024 and exponent < len(SIZE_UNITS) - 1:
+        size /= 1024
+        exponent += 1
+    return f"{size} B" if not exponent else f"{size:.1f} {SIZE_UNITS[exponent]}"
+
+
+class DownloadSchedule(object):
+    """Expected sizes of files to fetch, and the progress of fetching them.
+
+    Fetching the largest files first keeps a large file which happens to
+    come last from dominating the duration of a run with parallel
+    downloads: smaller files fill up the gaps around the large ones.
+    Sizes are known from a lockfile or an earlier run, or probed. Files
+    of unknown size count as average ones.
+    """
+
+    def __init__(self, sizes=None):
+        # maps URLs to their expected sizes
+        self.sizes = {}
+        self._total_size = 0
+        for url, size in (sizes or {}).items():
+            self._set_size(url, size)
+
+        self._lock = threading.Lock()
+        # maps pending URLs to the number of times they're to be fetched
+        self._pending = {}
+        self.files = 0
+        self.done_files = 0
+        self.done_bytes = 0
+        self.started = None
+
+    def expected_size(self, url):
+        with self._lock:
+            return self._expected_size(url)
+
+    def _set_size(self, url, size):
+        self._total_size += size - self.sizes.get(url, 0)
+        self.sizes[url] = size
+
+    def _expected_size(self, url):
+        size = self.sizes.get(url)
+        if size is None:
+            size = self._total_size // len(self.sizes) if self.sizes else 0
+        return size
+
+    def priority(self, record):
+        """Priority for Pipeline, larger files first."""
+        return -self.expected_size(record["url"])
+
+    def probe(self, records, insecure=False):
+        """Find out the sizes of files of unknown size, by asking servers."""
+        urls = {
+            record["url"]: None
+            for record in records
+            if is_url(record["url"]) and record["url"] not in self.sizes
+        }
+        if not urls:
+            return
+        for result in check_urls(urls, insecure=insecure):
+            if result["ok"] and result["size"] is not None:
+                with self._lock:
+                    self._set_size(result["url"], result["size"])
+
+    def add(self, record):
+        """Note that a file is to be fetched."""
+        with self._lock:
+            self._pending[record["url"]] = self._pending.get(record["url"], 0) + 1
+            self.files += 1
+
+    def start(self):
+        """Note that fetching a file starts, to measure the transfer rate from."""
+        with self._lock:
+            if self.started is None:
+                self.started = time.monotonic()
+
+    def done(self, record, size=None):
+        """Note that fetching a file is done, with the actual size if it succeeded."""
+        url = record["url"]
+        with self._lock:
+            if self._pending.get(url, 0) > 1:
+                self._pending[url] -= 1
+            else:
+                self._pending.pop(url, None)
+            self.done_files += 1
+            if size is not None:
+                self.done_bytes += size
+                if url not in self.sizes:
+                    self._set_size(url, size)
+
+    def remaining_bytes(self):
+        with self._lock:
+            return sum(self._expected_size(url) * n for url, n in self._pending.items())
+
+    def eta(self):
+        """Estimate in how many seconds all files known so far are fetched."""
+        remaining = self.remaining_bytes()
+        with self._lock:
+            if not remaining:
+                return 0.0
+            if self.started is None or not self.done_bytes:
+                return None
+            rate = self.done_bytes / (time.monotonic() - self.started)
+        return remaining / rate
+
+    def progress(self):
+        """Describe the progress of the run so far, in one line."""
+        eta = self.eta()
+        remaining = self.remaining_bytes()
+        with self._lock:
+            line = (
+                f"Fetched {self.done_files} of {self.files} files,"
+                + f" {_format_size(self.done_bytes)} of"
+                + f" {_format_size(self.done_bytes + remaining)}"
+            )
+        if eta is None:
+            return f"{line}, ETA unknown"
+        finish = time.strftime("%H:%M:%S", time.localtime(time.time() + eta))
+        return f"{line}, ETA {finish} (in {timedelta(seconds=round(eta))})"
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# rpmspectool.shard: split batch runs across nodes and merge their results
+
+import argparse
+import hashlib
+import json
+from collections import Counter
+
+
+class ShardError(RuntimeError):
+    pass
+
+
+def shard_spec(value):
+    """Parse I/N, the I-th of N shards, counting from 1."""
+    try:
+        index, count = (int(x) for x in value.split("/"))
+    except ValueError:
+        index = count = 0
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"{value!r} isn't a shard like 1/4")
+    return index, count
+
+
+def _path_hash(specpath):
+    return int.from_bytes(hashlib.sha256(specpath.encode("utf-8")).digest()[:8], "big")
+
+
+def read_records(path):
+    """Read records from JSON Lines output or from a merged report."""
+    try:
+        with open(path, "r") as fobj:
+            content = fobj.read()
+    except OSError as exc:
+        raise ShardError(f"Can’t read {path}: {exc.strerror}")
+
+    try:
+        report = json.loads(content)
+    except ValueError:
+        report = None
+    if isinstance(report, dict) and "records" in report:
+        return report["records"]
+
+    try:
+        return [json.loads(line) for line in content.splitlines() if line.strip()]
+    except ValueError as exc:
+        raise ShardError(f"Can’t parse {path}: {exc}")
+
+
+def spec_weights(records):
+    """Sum up the sizes of fetched files per spec file."""
+    weights = Counter()
+    for record in records:
+        if record.get("size"):
+            weights[record["specfile"]] += record["size"]
+    return dict(weights)
+
+
+def file_sizes(records):
+    """Map URLs to the sizes of the files fetched from them."""
+    return {
+        record["url"]: record["size"]
+        for record in records
+        if record.get("url") and record.get("size")
+    }
+
+
+def select_shard(specfiles, index, count, weights=None):
+    """Select the spec files a shard processes, in their original order.
+
+    Without weights, spec files are assigned by a hash of their path, so
+    adding or removing spec files doesn't move others between shards.
+    With weights, e.g. the bytes fetched for each spec file in an earlier
+    run, spec files are assigned heaviest first to the shard with the
+    least weight so far. Spec files without a known weight count as
+    average ones.
+
+    Every node must get the same spec file arguments (and weights) for
+    the shards to cover all spec files exactly once.
+    """
+    specfiles = list(specfiles)
+
+    if not weights:
+        selected = {s for s in specfiles if _path_hash(s) % count == index - 1}
+    else:
+        known = [weights[s] for s in specfiles if s in weights]
+        default = sum(known) // len(known) if known else 1
+
+        loads = [0] * count
+        selected = set()
+        for specpath in sorted(
+            set(specfiles), key=lambda s: (-weights.get(s, default), _path_hash(s), s)
+        ):
+            shard = min(range(count), key=lambda i: (loads[i], i))
+            loads[shard] += weights.get(specpath, default)
+            if shard == index - 1:
+                selected.add(specpath)
+
+    return [s for s in specfiles if s in selected]
+
+
+def merge_reports(paths):
+    """Combine the JSON Lines output of several shards into one report.
+
+    Records are sorted by spec file, kind and index, duplicate records of
+    the same file are only kept once (the last one read).
+    """
+    records = {}
+    for path in paths:
+        for record in read_records(path):
+            key = (
+                str(record.get("specfile", "")),
+                str(record.get("kind", "")),
+                record.get("index", -1),
+                str(record.get("url", "")),
+            )
+            records[key] = record
+
+    merged = [records[key] for key in sorted(records)]
+
+    return {
+        "records": merged,
+        "summary": {
+            "specfiles": len({record.get("specfile") for record in merged}),
+            "files": len(merged),
+            "bytes": sum(record.get("size") or 0 for record in merged),
+            "status": dict(sorted(Counter(str(record.get("status")) for record in merged).items())),
+        },
+    }
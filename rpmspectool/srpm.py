@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#
+# rpmspectool.srpm: read spec files from source RPM packages
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import struct
+import subprocess
+import zlib
+
+try:
+    from compression import zstd
+except ImportError:  # pragma: no cover
+    zstd = None
+
+LEAD_SIZE = 96
+LEAD_MAGIC = b"\xed\xab\xee\xdb"
+# the lead type of source packages
+LEAD_TYPE_SOURCE = 1
+
+HEADER_MAGIC = b"\x8e\xad\xe8\x01"
+HEADER_INTRO = struct.Struct(">4s4xII")
+HEADER_INDEX_ENTRY = struct.Struct(">iiii")
+
+# header tags and types which are needed to find the spec file in the payload
+TAG_FILESIZES = 1028
+TAG_BASENAMES = 1117
+TAG_PAYLOADFORMAT = 1124
+TAG_PAYLOADCOMPRESSOR = 1125
+TAG_LONGFILESIZES = 5008
+
+TYPE_INT32 = 4
+TYPE_INT64 = 5
+# other tags needed are strings or arrays of them
+TYPE_STRING = 6
+TYPE_STRING_ARRAY = 8
+
+# cpio "new ASCII" format, and the variant rpm uses if file sizes exceed 4 GiB
+CPIO_NEWC_MAGIC = b"070701"
+CPIO_STRIPPED_MAGIC = b"07070X"
+CPIO_NEWC_HEADER_SIZE = 110
+CPIO_STRIPPED_HEADER_SIZE = 14
+CPIO_TRAILER = "TRAILER!!!"
+
+# how to read payloads, by the compressor named in the header
+PAYLOAD_OPENERS = {
+    "gzip": lambda fobj: gzip.GzipFile(fileobj=fobj, mode="rb"),
+    "bzip2": bz2.BZ2File,
+    "xz": lzma.LZMAFile,
+    "lzma": lzma.LZMAFile,
+}
+if zstd is not None:  # pragma: no cover
+    PAYLOAD_OPENERS["zstd"] = zstd.ZstdFile
+
+# how much to read at once when skipping over payload members
+SKIP_CHUNK_SIZE = 1 << 20
+
+
+class SRPMError(RuntimeError):
+    pass
+
+
+def is_srpm(path):
+    return path.endswith(".src.rpm")
+
+
+def _padding(size, alignment):
+    return -size % alignment
+
+
+def _read(fobj, size):
+    data = fobj.read(size)
+    if len(data) != size:
+        raise ValueError("unexpected end of file")
+    return data
+
+
+def _skip(fobj, size):
+    """Read over data without keeping it, e.g. decompressed payload members."""
+    while size:
+        data = fobj.read(min(size, SKIP_CHUNK_SIZE))
+        if not data:
+            raise ValueError("unexpected end of file")
+        size -= len(data)
+
+
+def _read_header(fobj, tags):
+    """Read a header structure, return the values of some tags in it."""
+    magic, nindex, hsize = HEADER_INTRO.unpack(_read(fobj, HEADER_INTRO.size))
+    if magic != HEADER_MAGIC:
+        raise ValueError("bad header magic")
+
+    index = _read(fobj, nindex * HEADER_INDEX_ENTRY.size)
+    store = _read(fobj, hsize)
+
+    values = {}
+    for tag, type_, offset, count in HEADER_INDEX_ENTRY.iter_unpack(index):
+        if tag not in tags:
+            continue
+        if type_ == TYPE_INT32:
+            values[tag] = struct.unpack_from(f">{count}I", store, offset)
+        elif type_ == TYPE_INT64:
+            values[tag] = struct.unpack_from(f">{count}Q", store, offset)
+        else:
+            strings = store[offset:].split(b"\0", count)[:count]
+            strings = [s.decode("utf-8", errors="surrogateescape") for s in strings]
+            values[tag] = strings[0] if type_ == TYPE_STRING else strings
+
+    return values, HEADER_INTRO.size + len(index) + hsize
+
+
+def _open_payload(fobj, compressor):
+    """Decompress the payload following the headers as it is read."""
+    if compressor in PAYLOAD_OPENERS:
+        return PAYLOAD_OPENERS[compressor](fobj)
+
+    if compressor == "zstd":
+        # Python < 3.14 can’t decompress Zstandard, the zstd program can
+        os.lseek(fobj.fileno(), fobj.tell(), os.SEEK_SET)
+        try:
+            proc = subprocess.Popen(
+                ("zstd", "-dcq"), stdin=fobj, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+        except OSError:
+            raise ValueError("payload compressed with zstd which isn’t available")
+        return _ProcessPayload(proc)
+
+    raise ValueError(f"unsupported payload compressor {compressor!r}")
+
+
+class _ProcessPayload(object):
+    """The payload as decompressed by another program."""
+
+    def __init__(self, proc):
+        self.proc = proc
+
+    def read(self, size):
+        return self.proc.stdout.read(size)
+
+    def close(self):
+        # the rest of the payload isn't needed
+        self.proc.kill()
+        self.proc.stdout.close()
+        self.proc.wait()
+
+
+def _find_spec(payload, filenames, filesizes):
+    """Read cpio members until the spec file, return its name and content."""
+    while True:
+        magic = _read(payload, 6)
+
+        if magic == CPIO_NEWC_MAGIC:
+            fields = _read(payload, CPIO_NEWC_HEADER_SIZE - 6)
+            filesize = int(fields[48:56], 16)
+            namesize = int(fields[88:96], 16)
+            name = _read(payload, namesize).rstrip(b"\0").decode("utf-8", errors="surrogateescape")
+            _read(payload, _padding(CPIO_NEWC_HEADER_SIZE + namesize, 4))
+            if name == CPIO_TRAILER:
+                return None, None
+        elif magic == CPIO_STRIPPED_MAGIC:
+            fileindex = int(_read(payload, CPIO_STRIPPED_HEADER_SIZE - 6), 16)
+            _read(payload, _padding(CPIO_STRIPPED_HEADER_SIZE, 4))
+            try:
+                name = filenames[fileindex]
+                filesize = filesizes[fileindex]
+            except IndexError:
+                raise ValueError(f"payload references unknown file {fileindex}")
+        else:
+            raise ValueError("bad cpio magic in payload")
+
+        name = name.removeprefix("./")
+        if name.endswith(".spec") and "/" not in name:
+            return name, _read(payload, filesize)
+
+        _skip(payload, filesize + _padding(filesize, 4))
+
+
+def read_spec(path):
+    """Read the spec file out of a source RPM package.
+
+    Only the payload members up to the spec file are decompressed, and
+    their content isn't kept. Members are sorted by name, so archives like
+    foo-1.0.tar.gz usually precede foo.spec and have to be decompressed,
+    members following the spec file aren't touched at all.
+
+    Returns the file name and the content of the spec file.
+    """
+    try:
+        with open(path, "rb") as fobj:
+            lead = _read(fobj, LEAD_SIZE)
+            if lead[:4] != LEAD_MAGIC:
+                raise SRPMError(f"{path} isn’t an RPM package")
+            if struct.unpack_from(">H", lead, 6)[0] != LEAD_TYPE_SOURCE:
+                raise SRPMError(f"{path} isn’t a source RPM package")
+
+            # the signature header is padded to a multiple of 8 bytes
+            _, size = _read_header(fobj, ())
+            _read(fobj, _padding(size, 8))
+
+            tags = _read_header(
+                fobj,
+                (
+                    TAG_FILESIZES,
+                    TAG_LONGFILESIZES,
+                    TAG_BASENAMES,
+                    TAG_PAYLOADFORMAT,
+                    TAG_PAYLOADCOMPRESSOR,
+                ),
+            )[0]
+
+            payload_format = tags.get(TAG_PAYLOADFORMAT, "cpio")
+            if payload_format != "cpio":
+                raise SRPMError(f"{path}: unsupported payload format {payload_format!r}")
+
+            payload = _open_payload(fobj, tags.get(TAG_PAYLOADCOMPRESSOR, "gzip"))
+            try:
+                name, content = _find_spec(
+                    payload,
+                    tags.get(TAG_BASENAMES, ()),
+                    tags.get(TAG_LONGFILESIZES, tags.get(TAG_FILESIZES, ())),
+                )
+            finally:
+                payload.close()
+    except OSError as exc:
+        raise SRPMError(f"Can’t read {path}: {exc.strerror or exc}")
+    except (EOFError, ValueError, struct.error, lzma.LZMAError, zlib.error) as exc:
+        raise SRPMError(f"Can’t read {path}: {exc}")
+
+    if name is None:
+        raise SRPMError(f"{path} doesn’t contain a spec file")
+
+    return name, content
+
+
+def open_spec(path):
+    """Open a spec file, or the spec file in a source RPM package, for reading."""
+    if not is_srpm(path):
+        return open(path, "rb")
+
+    _, content = read_spec(path)
+    fobj = io.BytesIO(content)
+    fobj.name = path
+    return fobj
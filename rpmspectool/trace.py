@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#
+# rpmspectool.trace: record what takes how long, in Chrome trace event format
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_tracer = None
+
+
+class Tracer(object):
+    """Record spans of time as trace events.
+
+    The events can be viewed in trace viewers understanding the Chrome
+    trace event format, e.g. Perfetto or chrome://tracing.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.start_ns = time.perf_counter_ns()
+
+    @contextmanager
+    def span(self, name, cat, **args):
+        start_ns = time.perf_counter_ns()
+        try:
+            yield args
+        finally:
+            end_ns = time.perf_counter_ns()
+            event = {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": (start_ns - self.start_ns) / 1000,
+                "dur": (end_ns - start_ns) / 1000,
+                "pid": self.pid,
+                "tid": threading.get_native_id(),
+                "args": args,
+            }
+            with self.lock:
+                self.events.append(event)
+
+    def write(self, path):
+        thread_names = {thread.native_id: thread.name for thread in threading.enumerate()}
+        metadata = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": self.pid,
+                "tid": tid,
+                "args": {"name": thread_names.get(tid, f"thread-{tid}")},
+            }
+            for tid in sorted({event["tid"] for event in self.events})
+        ]
+
+        with open(path, "w") as fobj:
+            json.dump({"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}, fobj)
+
+
+def start_tracing():
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop_tracing():
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+@contextmanager
+def span(name, cat, **args):
+    """Record a span of time if tracing, yield a dict to add arguments to."""
+    if _tracer is None:
+        yield args
+    else:
+        with _tracer.span(name, cat, **args) as span_args:
+            yield span_args
+
+
+def rusage_args(rusage):
+    """Convert the resource usage of a process into span arguments."""
+    if rusage is None:
+        return {}
+    return {
+        "utime": rusage.ru_utime,
+        "stime": rusage.ru_stime,
+        "maxrss_kib": rusage.ru_maxrss,
+    }
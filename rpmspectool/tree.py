@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+#
+# rpmspectool.tree: find spec files in trees and changes to them
+
+import os
+from logging import debug as log_debug
+from subprocess import DEVNULL, PIPE, CalledProcessError, run
+
+from .rpm import RPMSpecHandler
+
+# a file next to a spec file which lists the sources in dist-git
+SOURCES_FILE = "sources"
+
+
+class TreeError(RuntimeError):
+    pass
+
+
+def find_specfiles(paths):
+    """Expand directories in paths into the spec files found in them.
+
+    Hidden directories like .git are skipped. Other paths are passed
+    through unchanged.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+            for filename in sorted(filenames):
+                if filename.endswith(".spec"):
+                    yield os.path.join(dirpath, filename)
+
+
+def _git(toplevel, *args):
+    try:
+        return run(
+            ("git", "-C", toplevel) + args, stdin=DEVNULL, stdout=PIPE, stderr=PIPE, check=True
+        ).stdout
+    except CalledProcessError as exc:
+        raise TreeError(f"git {' '.join(args)} failed: {exc.stderr.decode('utf-8').strip()}")
+
+
+def _git_toplevel(path):
+    return _git(path, "rev-parse", "--show-toplevel").decode("utf-8").strip()
+
+
+def _changed_paths(toplevel, rev):
+    """Files changed or added since a revision, including uncommitted changes."""
+    changed = _git(toplevel, "diff", "--name-only", "--no-renames", "-z", rev, "--")
+    untracked = _git(toplevel, "ls-files", "--others", "--exclude-standard", "-z")
+    return {
+        os.path.join(toplevel, path.decode("utf-8"))
+        for path in (changed + untracked).split(b"\0")
+        if path
+    }
+
+
+def _preamble_at_rev(toplevel, rev, path):
+    relpath = os.path.relpath(path, toplevel)
+    try:
+        content = _git(toplevel, "show", f"{rev}:{relpath}")
+    except TreeError:
+        # the spec file didn't exist yet
+        return None
+    preamble, _ = RPMSpecHandler.extract_preamble(content.splitlines(keepends=True))
+    return preamble
+
+
+def changed_specfiles(specfiles, rev):
+    """Determine which spec files changed in relevant ways since a revision.
+
+    A spec file is considered changed if its preamble or the sources
+    file next to it changed. Other changes, e.g. to %changelog, don't
+    affect which sources and patches are needed.
+    """
+    changed = set()
+    changed_paths_by_toplevel = {}
+    toplevel_by_dir = {}
+
+    for specfile in specfiles:
+        specfile = os.path.abspath(specfile)
+        specdir = os.path.dirname(specfile)
+
+        toplevel = toplevel_by_dir.get(specdir)
+        if toplevel is None:
+            toplevel = toplevel_by_dir[specdir] = os.path.realpath(_git_toplevel(specdir))
+        if toplevel not in changed_paths_by_toplevel:
+            changed_paths_by_toplevel[toplevel] = _changed_paths(toplevel, rev)
+        changed_paths = changed_paths_by_toplevel[toplevel]
+
+        realspec = os.path.realpath(specfile)
+        sources_file = os.path.join(os.path.dirname(realspec), SOURCES_FILE)
+
+        if sources_file in changed_paths:
+            log_debug("%s: sources file changed since %s", specfile, rev)
+            changed.add(specfile)
+        elif realspec in changed_paths:
+            with open(specfile, "rb") as fobj:
+                preamble, _ = RPMSpecHandler.extract_preamble(fobj)
+            if preamble != _preamble_at_rev(toplevel, rev, realspec):
+                log_debug("%s: preamble changed since %s", specfile, rev)
+                changed.add(specfile)
+            else:
+                log_debug("%s: only changed outside of the preamble since %s", specfile, rev)
+
+    return changed
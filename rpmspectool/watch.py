@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# rpmspectool.watch: notice when spec files change
+
+import ctypes
+import os
+import select
+import struct
+from logging import debug as log_debug
+
+# from linux/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_ONLYDIR = 0x01000000
+IN_CLOEXEC = os.O_CLOEXEC
+
+# struct inotify_event without the trailing name
+EVENT_HEADER = struct.Struct("iIII")
+
+# editors often write files in several steps, wait for this long after an
+# event for others to arrive before reporting changes, in seconds
+SETTLE_DELAY = 0.1
+
+
+class WatchError(RuntimeError):
+    pass
+
+
+def _libc():
+    libc = ctypes.CDLL(None, use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        raise WatchError("Watching files needs inotify, which isn’t available on this system")
+    return libc
+
+
+class SpecWatcher(object):
+    """Watch spec files for changes using inotify.
+
+    The directories containing the spec files are watched rather than the
+    files themselves, because editors often save by writing a new file and
+    renaming it over the old one.
+    """
+
+    def __init__(self, specpaths):
+        self._libc = _libc()
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise_errno("Couldn’t initialize inotify")
+
+        # maps (real directory path, file name) to the spec paths as given
+        self.specpaths = {}
+        # maps watch descriptors to real directory paths
+        self.dirs = {}
+
+        try:
+            for specpath in specpaths:
+                dirpath, filename = os.path.split(os.path.realpath(specpath))
+                self.specpaths.setdefault((dirpath, filename), []).append(specpath)
+                if dirpath not in self.dirs.values():
+                    self._add_watch(dirpath)
+        except BaseException:
+            self.close()
+            raise
+
+    def _raise_errno(self, message):
+        errno = ctypes.get_errno()
+        raise WatchError(f"{message}: {os.strerror(errno)}")
+
+    def _add_watch(self, dirpath):
+        wd = self._libc.inotify_add_watch(
+            self.fd, os.fsencode(dirpath), IN_CLOSE_WRITE | IN_MOVED_TO | IN_ONLYDIR
+        )
+        if wd < 0:
+            self._raise_errno(f"Couldn’t watch '{dirpath}'")
+        self.dirs[wd] = dirpath
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _read_events(self):
+        changed = set()
+
+        buf = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, name_len = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(buf[offset : offset + name_len].rstrip(b"\0"))
+            offset += name_len
+
+            if mask & IN_Q_OVERFLOW:
+                log_debug("inotify event queue overflowed, assuming all spec files changed")
+                for specpaths in self.specpaths.values():
+                    changed.update(specpaths)
+                continue
+
+            changed.update(self.specpaths.get((self.dirs.get(wd), name), ()))
+
+        return changed
+
+    def wait(self, timeout=None):
+        """Wait until watched spec files change.
+
+        Returns the set of changed spec files, as they were passed in, or
+        an empty set if nothing changed before the timeout.
+        """
+        changed = set()
+        while True:
+            readable, _, _ = select.select([self.fd], [], [], timeout)
+            if not readable:
+                return changed
+            changed |= self._read_events()
+            if changed:
+                timeout = SETTLE_DELAY
@@ -1,7 +1,12 @@
+import hashlib
 import os
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler
 
 import pytest
 
+from benchmarks.server import LocalHTTPServer
+
 
 @pytest.fixture(scope="session", autouse=True)
 def ensure_home_env_var():
@@ -22,3 +27,116 @@ def ensure_home_env_var():
         del os.environ["HOME"]
     else:
         os.environ["HOME"] = old_home
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache_dir(tmp_path_factory, monkeypatch):
+    """Keep tests from using or filling the cache of the user running them."""
+    cache_home = tmp_path_factory.mktemp("cache")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(cache_home))
+    return cache_home / "rpmspectool"
+
+
+class HTTPRequestHandler(BaseHTTPRequestHandler):
+    """Serve files from a dictionary, with some misbehaving endpoints.
+
+    /files/NAME: serves NAME, honors Range requests
+    /nohead/NAME: like /files/NAME, but rejects HEAD requests
+    /norange/NAME: rejects HEAD requests, ignores Range requests
+    /redirect/NAME: redirects to /files/NAME
+    /unavailable/NAME: answers 503 Service Unavailable
+
+    Responses carry ETag and Last-Modified headers, conditional requests
+    are answered with 304 Not Modified if the file didn't change. The
+    headers of requests are recorded in the `requests` list of the server.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_file(self, with_body):
+        try:
+            _, kind, name = self.path.split("/", 2)
+        except ValueError:
+            kind = name = None
+
+        files = self.server.files
+        self.server.requests.append((self.command, self.path, dict(self.headers)))
+
+        if kind == "redirect":
+            self.send_response(302)
+            self.send_header("Location", f"/files/{name}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if kind == "unavailable":
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if name not in files or kind not in ("files", "nohead", "norange"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if not with_body and kind in ("nohead", "norange"):
+            self.send_response(405)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        content = files[name]
+        etag = f'"{hashlib.sha256(content).hexdigest()[:16]}"'
+        last_modified = formatdate(self.server.mtime, usegmt=True)
+
+        if self.headers.get("If-None-Match") == etag or (
+            "If-None-Match" not in self.headers
+            and self.headers.get("If-Modified-Since") == last_modified
+        ):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        range_header = self.headers.get("Range")
+        if range_header and kind != "norange":
+            start, end = (int(x) for x in range_header.split("=", 1)[1].split("-"))
+            body = content[start : end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(content)}")
+        else:
+            body = content
+            self.send_response(200)
+
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+
+        if with_body:
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self._send_file(with_body=False)
+
+    def do_GET(self):
+        self._send_file(with_body=True)
+
+
+@pytest.fixture
+def http_server():
+    """Run a local HTTP server in a thread.
+
+    Files to be served are put into the `files` dictionary of the
+    yielded server object, its `url()` method constructs URLs.
+    """
+    with LocalHTTPServer(HTTPRequestHandler) as server:
+        server.files = {}
+        server.requests = []
+        server.mtime = 10**9
+        yield server
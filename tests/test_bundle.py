@@ -0,0 +1,199 @@
+import errno
+import hashlib
+import io
+import json
+import os
+import tarfile
+from unittest import mock
+
+import pytest
+
+from rpmspectool import bundle
+
+
+@pytest.fixture
+def fetched(tmp_path):
+    src_dir = tmp_path / "src"
+    src_dir.mkdir()
+    files = {}
+    for fname, content in (
+        ("foo-1.tar.gz", b"foo" * 1000),
+        ("bar-1.tar.gz", b"bar"),
+        ("baz-1.tar.gz", b"bar"),
+    ):
+        path = src_dir / fname
+        path.write_bytes(content)
+        os.utime(path, (10**9, 10**9))
+        files[f"https://example.com/{fname}"] = str(path)
+    return files
+
+
+def test_write_bundle(fetched, tmp_path):
+    path = tmp_path / "sources.bundle"
+
+    entries = bundle.write_bundle(str(path), fetched)
+
+    assert [entry["filename"] for entry in entries] == [
+        "bar-1.tar.gz",
+        "baz-1.tar.gz",
+        "foo-1.tar.gz",
+    ]
+    # identical content is only stored once
+    assert entries[0]["member"] == entries[1]["member"]
+
+    with tarfile.open(path) as tar:
+        names = tar.getnames()
+        assert len(names) == 3
+        assert names[-1] == bundle.MANIFEST_NAME
+        manifest = json.load(tar.extractfile(bundle.MANIFEST_NAME))
+        for entry in entries:
+            assert tar.getmember(entry["member"]).offset_data == entry["offset"]
+
+    assert manifest["files"] == entries
+
+    with path.open("rb") as fobj:
+        fobj.seek(entries[2]["offset"])
+        assert fobj.read(entries[2]["size"]) == b"foo" * 1000
+
+
+@pytest.mark.parametrize("copy_file_range", ("works", "unsupported"))
+def test_copy_file(copy_file_range, fetched, tmp_path):
+    path = tmp_path / "sources.bundle"
+    bundle.write_bundle(str(path), fetched)
+    target_dir = tmp_path / "target"
+    target_dir.mkdir()
+
+    bundle_obj = bundle.Bundle(str(path))
+    entry = bundle_obj.lookup("https://example.com/foo-1.tar.gz")
+
+    with mock.patch.object(bundle.os, "copy_file_range", wraps=os.copy_file_range) as cfr:
+        if copy_file_range == "unsupported":
+            cfr.side_effect = OSError(errno.EXDEV, "Invalid cross-device link")
+        bundle_obj.copy_file(entry, where=str(target_dir))
+
+    target = target_dir / "foo-1.tar.gz"
+    assert target.read_bytes() == b"foo" * 1000
+    assert target.stat().st_mtime == 10**9
+
+
+def test_write_bundle_error(fetched, tmp_path):
+    path = tmp_path / "sources.bundle"
+    fetched["https://example.com/missing.tar.gz"] = str(tmp_path / "missing.tar.gz")
+
+    with pytest.raises(FileNotFoundError):
+        bundle.write_bundle(str(path), fetched)
+
+    # no partial bundle is left behind
+    assert sorted(os.listdir(tmp_path)) == ["src"]
+
+
+def test_copy_file_dry_run(fetched, tmp_path, capsys, monkeypatch):
+    path = tmp_path / "sources.bundle"
+    bundle.write_bundle(str(path), fetched)
+    bundle_obj = bundle.Bundle(str(path))
+    monkeypatch.chdir(tmp_path)
+
+    bundle_obj.copy_file(bundle_obj.lookup("https://example.com/foo-1.tar.gz"), dry_run=True)
+
+    assert "NOT copying" in capsys.readouterr().out
+    assert not (tmp_path / "foo-1.tar.gz").exists()
+
+
+def test_copy_file_damaged(fetched, tmp_path):
+    path = tmp_path / "sources.bundle"
+    entries = bundle.write_bundle(str(path), fetched)
+    with path.open("r+b") as fobj:
+        fobj.seek(entries[2]["offset"])
+        fobj.write(b"FOO")
+    target_dir = tmp_path / "target"
+    target_dir.mkdir()
+
+    bundle_obj = bundle.Bundle(str(path))
+
+    with pytest.raises(bundle.BundleError, match="is damaged"):
+        bundle_obj.copy_file(entries[2], where=str(target_dir))
+
+    assert not os.listdir(target_dir)
+
+
+def test_copy_file_truncated(fetched, tmp_path):
+    path = tmp_path / "sources.bundle"
+    entries = bundle.write_bundle(str(path), fetched)
+    os.truncate(path, entries[2]["offset"] + 10)
+    target_dir = tmp_path / "target"
+    target_dir.mkdir()
+
+    bundle_obj = bundle.Bundle.__new__(bundle.Bundle)
+    bundle_obj.path = str(path)
+
+    with pytest.raises(bundle.BundleError, match="is damaged"):
+        bundle_obj.copy_file(entries[2], where=str(target_dir))
+
+
+def test_copy_file_read_error(fetched, tmp_path):
+    path = tmp_path / "sources.bundle"
+    entries = bundle.write_bundle(str(path), fetched)
+    bundle_obj = bundle.Bundle(str(path))
+
+    with (
+        mock.patch.object(bundle.os, "copy_file_range", side_effect=OSError(errno.EIO, "I/O")),
+        pytest.raises(OSError),
+    ):
+        bundle_obj.copy_file(entries[2], where=str(tmp_path))
+
+    assert not (tmp_path / "foo-1.tar.gz").exists()
+
+
+def test_copy_file_fetched_by_other_process(fetched, tmp_path, capsys):
+    path = tmp_path / "sources.bundle"
+    entries = bundle.write_bundle(str(path), fetched)
+    bundle_obj = bundle.Bundle(str(path))
+    (tmp_path / "foo-1.tar.gz").write_bytes(b"foo")
+
+    with mock.patch.object(bundle, "TargetLock") as TargetLock:
+        TargetLock.return_value.__enter__.return_value.waited = True
+        bundle_obj.copy_file(entries[2], where=str(tmp_path))
+
+    assert "fetched by another process" in capsys.readouterr().out
+    assert (tmp_path / "foo-1.tar.gz").read_bytes() == b"foo"
+
+
+def test_lookup(fetched, tmp_path):
+    path = tmp_path / "sources.bundle"
+    bundle.write_bundle(str(path), fetched)
+    bundle_obj = bundle.Bundle(str(path))
+    url = "https://example.com/bar-1.tar.gz"
+
+    assert bundle_obj.lookup(url)["filename"] == "bar-1.tar.gz"
+    assert bundle_obj.lookup(url, hashlib.sha512(b"bar").hexdigest())["filename"] == "bar-1.tar.gz"
+    assert bundle_obj.lookup(url, hashlib.sha512(b"other").hexdigest()) is None
+    assert bundle_obj.lookup("https://example.com/missing.tar.gz") is None
+
+
+@pytest.mark.parametrize(
+    "manifest, match",
+    (
+        (None, "Can’t read bundle"),
+        (b"{", "Can’t read bundle"),
+        (b'{"version": 99, "files": []}', "Unsupported bundle"),
+        (b'{"version": 1, "files": [{"url": "foo"}]}', "Invalid manifest"),
+    ),
+)
+def test_bundle_error(manifest, match, tmp_path):
+    path = tmp_path / "sources.bundle"
+    if manifest is not None:
+        with tarfile.open(path, "w") as tar:
+            tarinfo = tarfile.TarInfo(bundle.MANIFEST_NAME)
+            tarinfo.size = len(manifest)
+            tar.addfile(tarinfo, io.BytesIO(manifest))
+
+    with pytest.raises(bundle.BundleError, match=match):
+        bundle.Bundle(str(path))
+
+
+def test_bundle_not_a_tar(tmp_path):
+    path = tmp_path / "sources.bundle"
+    path.write_bytes(b"not a tar archive" * 100)
+
+    with pytest.raises(bundle.BundleError, match="Can’t read bundle"):
+        bundle.Bundle(str(path))
@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+from rpmspectool import cache
+
+SPEC = b"""Name: test
+Version: 1
+Source0: https://example.com/test-%{version}.tar.gz
+
+%description
+Test.
+
+%changelog
+- Initial package
+"""
+
+
+@pytest.mark.parametrize("with_xdg_cache_home", (False, True), ids=("default", "xdg"))
+def test_cache_dir(with_xdg_cache_home, monkeypatch, tmp_path):
+    if with_xdg_cache_home:
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+        assert cache.cache_dir() == str(tmp_path / "rpmspectool")
+    else:
+        monkeypatch.delenv("XDG_CACHE_HOME")
+        monkeypatch.setenv("HOME", str(tmp_path))
+        assert cache.cache_dir() == str(tmp_path / ".cache" / "rpmspectool")
+
+
+def test_preamble_digest():
+    digest = cache.preamble_digest(b"Name: test\n")
+
+    assert digest == cache.preamble_digest(b"Name: test\n", ())
+    assert digest != cache.preamble_digest(b"Name: test2\n")
+    assert digest != cache.preamble_digest(b"Name: test\n", ("foo bar",))
+
+
+def test_spec_digest(tmp_path):
+    spec = tmp_path / "test.spec"
+    spec.write_bytes(SPEC)
+    digest = cache.spec_digest(str(spec))
+
+    # changes outside of the preamble don't matter
+    spec.write_bytes(SPEC + b"- Another change\n")
+    assert cache.spec_digest(str(spec)) == digest
+
+    spec.write_bytes(SPEC.replace(b"Version: 1", b"Version: 2"))
+    assert cache.spec_digest(str(spec)) != digest
+
+
+class TestResultCache:
+    def test_default_path(self, isolated_cache_dir):
+        assert cache.ResultCache().path == str(isolated_cache_dir / "results")
+
+    def test_get_put(self, tmp_path):
+        result_cache = cache.ResultCache(str(tmp_path / "results"))
+        key = cache.preamble_digest(b"Name: test\n")
+        result = {
+            "sources": {0: "https://example.com/test-1.tar.gz"},
+            "patches": {1: "fix.patch"},
+            "srcdir": "/foo/bar",
+        }
+
+        assert result_cache.get(key) is None
+
+        result_cache.put(key, result)
+
+        assert result_cache.get(key) == result
+        assert os.listdir(tmp_path / "results" / key[:2]) == [f"{key}.json"]
+
+    def test_get_corrupt(self, tmp_path):
+        result_cache = cache.ResultCache(str(tmp_path))
+        key = cache.preamble_digest(b"Name: test\n")
+        entry_dir = tmp_path / key[:2]
+        entry_dir.mkdir()
+        (entry_dir / f"{key}.json").write_text('{"sources": ')
+
+        assert result_cache.get(key) is None
+
+    def test_put_failure(self, tmp_path):
+        # the cache directory can't be created below a file
+        (tmp_path / "file").write_text("")
+        result_cache = cache.ResultCache(str(tmp_path / "file"))
+        key = cache.preamble_digest(b"Name: test\n")
+
+        result_cache.put(key, {"sources": {}, "patches": {}, "srcdir": None})
+
+        assert result_cache.get(key) is None
@@ -1,4 +1,7 @@
 import argparse
+import hashlib
+import json
+import os
 import stat
 import sys
 import tempfile
@@ -11,9 +14,11 @@ from unittest import mock
 
 import pytest
 
-from rpmspectool import cli, version
+from rpmspectool import breaker, cache, cli, lockfile, schedule, version
 from rpmspectool import download as download_mod
 
+from .util import SRPM_MEMBERS, SRPM_SPEC, make_srpm
+
 HERE = Path(__file__).parent
 TEST_SPEC_PATH = HERE / "test-data" / "test1.spec"
 TEST_EXPECTED_PATH = HERE / "test-data" / "test1.expected"
@@ -73,60 +78,118 @@ class TestCLI:
                     "dry_run": False,
                     "directory": None,
                     "sourcedir": False,
-                    "specfile": SPECFILE,
+                    "jobs": 1,
+                    "download_jobs": 1,
+                    "format": "text",
+                    "watch": False,
+                    "cache": False,
+                    "changed_since": None,
+                    "specfiles": [SPECFILE],
                 },
             ),
-            (("--debug", "get", SPECFILE), {"cmd": "get", "debug": True, "specfile": SPECFILE}),
+            (("--debug", "get", SPECFILE), {"cmd": "get", "debug": True, "specfiles": [SPECFILE]}),
             (
                 ("get", "--verbose", SPECFILE),
-                {"cmd": "get", "verbose": True, "specfile": SPECFILE},
+                {"cmd": "get", "verbose": True, "specfiles": [SPECFILE]},
             ),
             (
                 ("get", "--define", "foo bar", "-d", "bar baz", SPECFILE),
-                {"cmd": "get", "define": ["foo bar", "bar baz"], "specfile": SPECFILE},
+                {"cmd": "get", "define": ["foo bar", "bar baz"], "specfiles": [SPECFILE]},
             ),
             (
                 ("get", "--sources", SPECFILE),
-                {"cmd": "get", "sources": True, "source": None, "specfile": SPECFILE},
+                {"cmd": "get", "sources": True, "source": None, "specfiles": [SPECFILE]},
             ),
             (
                 ("get", "--source", "1", "-s", "2", SPECFILE),
-                {"cmd": "get", "sources": False, "source": [1, 2], "specfile": SPECFILE},
+                {"cmd": "get", "sources": False, "source": [1, 2], "specfiles": [SPECFILE]},
             ),
             (
                 ("get", "--patches", SPECFILE),
-                {"cmd": "get", "patches": True, "patch": None, "specfile": SPECFILE},
+                {"cmd": "get", "patches": True, "patch": None, "specfiles": [SPECFILE]},
             ),
             (
                 ("get", "--patch", "3", "-p", "4", SPECFILE),
-                {"cmd": "get", "patches": False, "patch": [3, 4], "specfile": SPECFILE},
+                {"cmd": "get", "patches": False, "patch": [3, 4], "specfiles": [SPECFILE]},
             ),
             (
                 ("get", "--insecure", SPECFILE),
-                {"cmd": "get", "insecure": True, "specfile": SPECFILE},
+                {"cmd": "get", "insecure": True, "specfiles": [SPECFILE]},
             ),
             (
                 ("get", "--force", SPECFILE),
-                {"cmd": "get", "force": True, "specfile": SPECFILE},
+                {"cmd": "get", "force": True, "specfiles": [SPECFILE]},
             ),
             (
                 ("get", "--dry-run", SPECFILE),
-                {"cmd": "get", "dry_run": True, "specfile": SPECFILE},
+                {"cmd": "get", "dry_run": True, "specfiles": [SPECFILE]},
             ),
             (
                 ("get", "--directory", "/boo", SPECFILE),
-                {"cmd": "get", "directory": "/boo", "specfile": SPECFILE},
+                {"cmd": "get", "directory": "/boo", "specfiles": [SPECFILE]},
             ),
             (
                 ("get", "--sourcedir", SPECFILE),
-                {"cmd": "get", "sourcedir": True, "specfile": SPECFILE},
+                {"cmd": "get", "sourcedir": True, "specfiles": [SPECFILE]},
             ),
-            (("list", SPECFILE), {"cmd": "list", "debug": False, "specfile": SPECFILE}),
+            (("list", SPECFILE), {"cmd": "list", "debug": False, "specfiles": [SPECFILE]}),
             (
                 ("list", "--source", "1-3", SPECFILE),
-                {"cmd": "list", "source": [1, 2, 3], "specfile": SPECFILE},
+                {"cmd": "list", "source": [1, 2, 3], "specfiles": [SPECFILE]},
             ),
             (("list", "--source", "boo", SPECFILE), argparse.ArgumentError),
+            (
+                ("list", "--jobs", "4", SPECFILE, SPECFILE),
+                {"cmd": "list", "jobs": 4, "specfiles": [SPECFILE, SPECFILE]},
+            ),
+            (
+                ("get", "-j", "2", "--download-jobs", "8", SPECFILE),
+                {"cmd": "get", "jobs": 2, "download_jobs": 8, "specfiles": [SPECFILE]},
+            ),
+            (
+                ("check", SPECFILE),
+                {
+                    "cmd": "check",
+                    "insecure": False,
+                    "connections": 8,
+                    "timeout": 30,
+                    "format": "text",
+                    "watch": False,
+                    "cache": False,
+                    "changed_since": None,
+                    "specfiles": [SPECFILE],
+                },
+            ),
+            (
+                ("check", "--connections", "32", "--timeout", "5", "--format", "jsonl", SPECFILE),
+                {"cmd": "check", "connections": 32, "timeout": 5, "format": "jsonl"},
+            ),
+            (("check", "--format", "xml", SPECFILE), argparse.ArgumentError),
+            (("list", "--format", "jsonl", SPECFILE), {"cmd": "list", "format": "jsonl"}),
+            (("get", "--watch", SPECFILE), {"cmd": "get", "watch": True}),
+            (("get", "--extract", "BUILD", SPECFILE), {"cmd": "get", "extract": "BUILD"}),
+            (("get", "--probe-sizes", SPECFILE), {"cmd": "get", "probe_sizes": True}),
+            (("list", SPECFILE), {"eval_strategy": "heredoc", "batch_size": 1}),
+            (("get", "--batch-size", "50", SPECFILE), {"cmd": "get", "batch_size": 50}),
+            (("list", "--eval-strategy", "lua", SPECFILE), {"eval_strategy": "lua"}),
+            (("list", "--eval-strategy", "magic", SPECFILE), argparse.ArgumentError),
+            (
+                ("get", "--shard", "2/3", "--shard-sizes", "report.json", SPECFILE),
+                {"cmd": "get", "shard": (2, 3), "shard_sizes": "report.json"},
+            ),
+            (("get", "--shard", "4/3", SPECFILE), argparse.ArgumentError),
+            (("merge", "a.jsonl", "b.jsonl"), {"cmd": "merge", "reports": ["a.jsonl", "b.jsonl"]}),
+            (
+                ("get", "--cache", "--changed-since", "HEAD~1", SPECFILE),
+                {"cmd": "get", "cache": True, "changed_since": "HEAD~1"},
+            ),
+            (
+                ("--profile", "trace.json", "get", SPECFILE),
+                {"cmd": "get", "profile": "trace.json"},
+            ),
+            (("list", "--jobs", "0", SPECFILE), argparse.ArgumentError),
+            (("get", "--download-jobs", "many", SPECFILE), argparse.ArgumentError),
+            (("list",), argparse.ArgumentError),
             (("version",), {"cmd": "version"}),
         ),
     )
@@ -156,8 +219,10 @@ class TestCLI:
                 if isinstance(parsed_value, IOBase):
                     parsed_value = parsed_value.name
 
-                if expected_value is SPECFILE:
-                    expected_value = str(empty_spec)
+                if isinstance(expected_value, list):
+                    expected_value = [
+                        str(empty_spec) if v is SPECFILE else v for v in expected_value
+                    ]
 
                 assert parsed_value == expected_value
 
@@ -191,6 +256,1253 @@ class TestCLI:
                 assert not sources
                 assert patches == {1: SPEC_PATCHES[1]}
 
+    @pytest.mark.parametrize("with_failure", (False, True), ids=("ok", "failure"))
+    @pytest.mark.parametrize("format", ("text", "jsonl"))
+    def test_main_check(self, format, with_failure, capsys):
+        url_source = "https://example.com/foo-1.tar.gz"
+        url_patch = "https://example.com/foo-fix.patch"
+        specfile_res = {
+            "sources": {0: url_source, 1: "foo.conf"},
+            "patches": {0: url_patch},
+            "srcdir": "/foo/bar",
+        }
+        results = [
+            {
+                "url": url_source,
+                "ok": True,
+                "status": 200,
+                "size": 12345,
+                "last_modified": "2001-09-09T01:46:40+00:00",
+                "redirects": 1,
+                "effective_url": url_source,
+                "latency": 0.5,
+                "method": "HEAD",
+                "error": None,
+            },
+            {
+                "url": url_patch,
+                "ok": not with_failure,
+                "status": 404 if with_failure else None,
+                "size": None,
+                "last_modified": None,
+                "redirects": 0,
+                "effective_url": url_patch,
+                "latency": 0.25,
+                "method": "HEAD",
+                "error": None,
+            },
+        ]
+
+        cli_obj = cli.CLI()
+
+        with (
+            mock.patch.object(sys, "argv", ["rpmspectool", "check", "--format", format]),
+            mock.patch.object(cli_obj, "eval_specfile") as eval_specfile,
+            mock.patch.object(cli, "check_urls") as check_urls,
+        ):
+            sys.argv.extend(("a.spec", "b.spec"))
+            eval_specfile.return_value = specfile_res
+            check_urls.return_value = results
+
+            retval = cli_obj.main()
+
+        check_urls.assert_called_once_with(
+            {url_source: ["a.spec", "b.spec"], url_patch: ["a.spec", "b.spec"]},
+            max_connections=8,
+            insecure=False,
+            timeout=30,
+        )
+
+        assert retval == (1 if with_failure else 0)
+
+        stdout, stderr = capsys.readouterr()
+        lines = stdout.splitlines()
+
+        if format == "jsonl":
+            records = [json.loads(line) for line in lines]
+            assert records == [result | {"specfiles": ["a.spec", "b.spec"]} for result in results]
+        else:
+            assert lines[0] == (
+                f"OK {url_source}: status 200, size 12345,"
+                + " last modified 2001-09-09T01:46:40+00:00, redirects 1, latency 0.500s"
+            )
+            if with_failure:
+                assert lines[1] == f"FAILED {url_patch}: status 404"
+            else:
+                assert lines[1] == f"OK {url_patch}: latency 0.250s"
+
+    def test_print_check_result_error(self, capsys):
+        cli_obj = cli.CLI()
+        cli_obj.args = mock.Mock(format="text")
+        cli_obj.output = sys.stdout
+
+        cli_obj.print_check_result(
+            {"url": "https://example.com/foo", "ok": False, "error": "Connection refused"}
+        )
+
+        stdout, stderr = capsys.readouterr()
+        assert stdout == "FAILED https://example.com/foo: Connection refused\n"
+
+    @pytest.mark.parametrize("dry_run", (False, True), ids=("wet-run", "dry-run"))
+    @pytest.mark.parametrize("cmd", ("list", "get"))
+    def test_main_jsonl(self, cmd, dry_run, capsys):
+        specfile_res = {
+            "sources": {
+                0: "https://example.com/foo-1.tar.gz",
+                1: "foo.conf",
+                2: "file:///mirror/foo-data.tar.gz",
+            },
+            "patches": {0: "https://example.com/missing.patch"},
+            "srcdir": "/foo/bar",
+        }
+
+        cli_obj = cli.CLI()
+
+        argv = ["rpmspectool", cmd, "--format", "jsonl"]
+        if cmd == "get":
+            argv.append("--sourcedir")
+            if dry_run:
+                argv.append("--dry-run")
+        argv.append("test.spec")
+
+        def mock_download(url, where=None, dry_run=False, insecure=False, force=False):
+            print(f"Downloading '{url}'")
+            if url.endswith("missing.patch"):
+                raise download_mod.DownloadError(f"Couldn't download {url}: 404")
+
+        with (
+            mock.patch.object(sys, "argv", argv),
+            mock.patch.object(cli_obj, "eval_specfile") as eval_specfile,
+            mock.patch.object(cli, "download") as download,
+            mock.patch.object(cli, "copy_local") as copy_local,
+        ):
+            eval_specfile.return_value = specfile_res
+            download.side_effect = mock_download
+            retval = cli_obj.main()
+
+        stdout, stderr = capsys.readouterr()
+        records = [json.loads(line) for line in stdout.splitlines()]
+
+        expected = [
+            {
+                "specfile": "test.spec",
+                "kind": kind,
+                "index": index,
+                "url": url,
+                "filename": filename,
+                "srcdir": "/foo/bar",
+            }
+            for kind, index, url, filename in (
+                ("source", 0, "https://example.com/foo-1.tar.gz", "foo-1.tar.gz"),
+                ("source", 1, "foo.conf", "foo.conf"),
+                ("source", 2, "file:///mirror/foo-data.tar.gz", "foo-data.tar.gz"),
+                ("patch", 0, "https://example.com/missing.patch", "missing.patch"),
+            )
+        ]
+
+        if cmd == "list":
+            for record in expected:
+                record["status"] = "listed"
+            assert not retval
+            download.assert_not_called()
+        elif dry_run:
+            for record in expected:
+                record["status"] = "dry-run"
+                record["error"] = None
+                record["size"] = None
+            expected[1]["status"] = "skipped"
+            expected[3]["status"] = "failed"
+            expected[3]["error"] = "Couldn't download https://example.com/missing.patch: 404"
+            assert retval == 1
+        else:
+            for record, status in zip(expected, ("downloaded", "skipped", "copied", "failed")):
+                record["status"] = status
+                record["error"] = None
+                # nothing was really fetched
+                record["size"] = None
+            expected[3]["error"] = "Couldn't download https://example.com/missing.patch: 404"
+            assert retval == 1
+            copy_local.assert_called_once_with(
+                "file:///mirror/foo-data.tar.gz", where="/foo/bar", dry_run=False, force=False
+            )
+
+        assert records == expected
+
+        if cmd == "get":
+            # progress messages don't end up in the stream of records
+            assert "Downloading 'https://example.com/foo-1.tar.gz'" in stderr
+
+    def test_main_jsonl_size(self, tmp_path, capsys):
+        cli_obj = cli.CLI()
+
+        def mock_download(url, where=None, dry_run=False, insecure=False, force=False):
+            (tmp_path / url.split("/")[-1]).write_bytes(b"content")
+
+        with (
+            mock.patch.object(
+                sys,
+                "argv",
+                ["rpmspectool", "get", "--format", "jsonl", "-C", str(tmp_path), "test.spec"],
+            ),
+            mock.patch.object(cli_obj, "eval_specfile") as eval_specfile,
+            mock.patch.object(cli, "download", side_effect=mock_download),
+        ):
+            eval_specfile.return_value = {
+                "sources": {0: "https://example.com/foo-1.tar.gz", 1: "foo.conf"},
+                "patches": {},
+                "srcdir": None,
+            }
+            cli_obj.main()
+
+        records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert [(r["status"], r["size"]) for r in records] == [("downloaded", 7), ("skipped", None)]
+
+    @pytest.mark.parametrize("weighted", (False, True), ids=("unweighted", "weighted"))
+    def test_main_shard(self, weighted, tmp_path, capsys):
+        specfiles = [f"pkg{i}.spec" for i in range(6)]
+        report_path = tmp_path / "report.jsonl"
+        report_path.write_text(
+            "".join(
+                json.dumps({"specfile": specfile, "size": (i + 1) * 100}) + "\n"
+                for i, specfile in enumerate(specfiles)
+            )
+        )
+
+        shards = []
+        for index in (1, 2):
+            argv = ["rpmspectool", "list", "--shard", f"{index}/2"]
+            if weighted:
+                argv.extend(("--shard-sizes", str(report_path)))
+            cli_obj = cli.CLI()
+            with (
+                mock.patch.object(sys, "argv", argv + specfiles),
+                mock.patch.object(cli_obj, "eval_specfile") as eval_specfile,
+            ):
+                eval_specfile.return_value = {
+                    "sources": {0: "foo.tar.gz"},
+                    "patches": {},
+                    "srcdir": None,
+                }
+                cli_obj.main()
+            shards.append([c.args[0] for c in eval_specfile.call_args_list])
+
+            # lines are prefixed like in unsharded runs
+            for line in capsys.readouterr().out.splitlines():
+                assert line.endswith(".spec: Source0: foo.tar.gz")
+
+        assert sorted(shards[0] + shards[1]) == specfiles
+        if weighted:
+            # heaviest first: 600, 500, 400, 300, 200, 100 bytes
+            assert sorted(shards[0]) == ["pkg1.spec", "pkg2.spec", "pkg5.spec"]
+
+    def test_main_shard_sizes_error(self, tmp_path, capsys):
+        cli_obj = cli.CLI()
+
+        with (
+            mock.patch.object(
+                sys,
+                "argv",
+                ["rpmspectool", "list", "--shard", "1/2", "--shard-sizes", str(tmp_path / "no")]
+                + ["test.spec"],
+            ),
+            pytest.raises(SystemExit) as excinfo,
+        ):
+            cli_obj.main()
+
+        assert excinfo.value.code == 1
+        assert "Can’t read" in capsys.readouterr().err
+
+    @pytest.mark.parametrize("to_file", (False, True), ids=("stdout", "file"))
+    def test_main_merge(self, to_file, tmp_path, capsys):
+        record = {"specfile": "a.spec", "kind": "source", "index": 0, "status": "downloaded"}
+        (tmp_path / "1.jsonl").write_text(json.dumps(record) + "\n")
+        (tmp_path / "2.jsonl").write_text("")
+        output_path = tmp_path / "report.json"
+
+        argv = ["rpmspectool", "merge", str(tmp_path / "1.jsonl"), str(tmp_path / "2.jsonl")]
+        if to_file:
+            argv.extend(("--output", str(output_path)))
+
+        with mock.patch.object(sys, "argv", argv):
+            retval = cli.CLI().main()
+
+        stdout, _ = capsys.readouterr()
+        report = json.loads(output_path.read_text() if to_file else stdout)
+
+        assert not retval
+        assert report["records"] == [record]
+        assert report["summary"]["files"] == 1
+
+    def test_main_merge_error(self, tmp_path, capsys):
+        with mock.patch.object(sys, "argv", ["rpmspectool", "merge", str(tmp_path / "missing")]):
+            retval = cli.CLI().main()
+
+        assert retval == 1
+        assert "Can’t read" in capsys.readouterr().err
+
+    def test_main_list_lockfile(self, tmp_path, capsys):
+        specpath = tmp_path / "foo.spec"
+        specpath.write_text("Name: foo\n")
+        (tmp_path / "foo-1.tar.gz").write_bytes(b"content")
+        lock_path = tmp_path / "sources.lock"
+
+        cli_obj = cli.CLI()
+
+        with (
+            mock.patch.object(
+                sys, "argv", ["rpmspectool", "list", "--lockfile", str(lock_path), str(specpath)]
+            ),
+            mock.patch.object(cli_obj, "eval_specfile") as eval_specfile,
+        ):
+            eval_specfile.return_value = {
+                "sources": {0: "https://example.com/foo-1.tar.gz"},
+                "patches": {0: "https://example.com/fix.patch"},
+                "srcdir": str(tmp_path / "SOURCES"),
+            }
+            retval = cli_obj.main()
+
+        assert not retval
+        entries = lockfile.read_lockfile(str(lock_path))
+        assert [(e["kind"], e["filename"], e["size"]) for e in entries] == [
+            ("source", "foo-1.tar.gz", 7),
+            ("patch", "fix.patch", None),
+        ]
+        assert entries[0]["sha512"] == hashlib.sha512(b"content").hexdigest()
+
+    @pytest.mark.parametrize("tampered", (False, True), ids=("intact", "tampered"))
+    def test_main_get_from_lock(self, tampered, tmp_path, capsys):
+        lock_path = tmp_path / "sources.lock"
+        entries = [
+            {
+                "specfile": specfile,
+                "kind": "source",
+                "index": 0,
+                "url": f"https://example.com/{filename}",
+                "filename": filename,
+                "srcdir": None,
+                "size": 7,
+                "mtime": 10**9,
+                "sha512": hashlib.sha512(b"content").hexdigest(),
+            }
+            for specfile, filename in (("foo.spec", "foo-1.tar.gz"), ("bar.spec", "bar-1.tar.gz"))
+        ]
+        entries.append(entries[1] | {"index": 1, "url": "bar.conf", "filename": "bar.conf"})
+        lockfile.write_lockfile(str(lock_path), entries)
+        out_dir = tmp_path / "out"
+        out_dir.mkdir()
+
+        def mock_download(url, where=None, dry_run=False, insecure=False, force=False):
+            content = b"CONTENT" if tampered and "foo" in url else b"content"
+            (out_dir / url.split("/")[-1]).write_bytes(content)
+
+        cli_obj = cli.CLI()
+
+        with (
+            mock.patch.object(
+                sys,
+                "argv",
+                ["rpmspectool", "get", "--from-lock", str(lock_path), "--source", "0"]
+                + ["--format", "jsonl", "-C", str(out_dir)],
+            ),
+            mock.patch.object(cli, "RPMSpecHandler") as RPMSpecHandler,
+            mock.patch.object(cli, "download", side_effect=mock_download) as download,
+        ):
+            retval = cli_obj.main()
+
+        stdout, _ = capsys.readouterr()
+        records = [json.loads(line) for line in stdout.splitlines()]
+
+        # rpm isn't involved at all
+        RPMSpecHandler.assert_not_called()
+        # --source filters like with spec files
+        assert download.call_count == 2
+        statuses = {record["filename"]: record["status"] for record in records}
+
+        if tampered:
+            assert retval == 1
+            assert statuses == {"bar-1.tar.gz": "downloaded", "foo-1.tar.gz": "failed"}
+            # files which don't match the lockfile are removed
+            assert sorted(os.listdir(out_dir)) == ["bar-1.tar.gz"]
+        else:
+            assert not retval
+            assert statuses == {"bar-1.tar.gz": "downloaded", "foo-1.tar.gz": "downloaded"}
+        # fetched files get the modification time recorded in the lockfile
+        assert os.stat(out_dir / "bar-1.tar.gz").st_mtime == 10**9
+
+    @pytest.mark.parametrize("mtime", (None, 10**9))
+    def test__verify_mtime(self, mtime, tmp_path):
+        (tmp_path / "foo-1.tar.gz").write_bytes(b"content")
+        entry = {"filename": "foo-1.tar.gz", "size": 7, "mtime": mtime, "sha512": None}
+
+        with mock.patch.object(
+            os, "utime", side_effect=PermissionError(13, "Permission denied")
+        ) as utime:
+            # if it can't be set, the file is fine, it just keeps its modification time
+            assert cli.CLI()._verify(entry, str(tmp_path)) is None
+
+        assert (tmp_path / "foo-1.tar.gz").exists()
+        # lockfiles don't have one for files which weren't available when writing them
+        assert utime.called == (mtime is not None)
+
+    @pytest.mark.parametrize(
+        "args, message",
+        (
+            (("get",), "the following arguments are required: specfile"),
+            (("get", "--from-lock", "sources.lock", "foo.spec"), "--from-lock can't be used"),
+            (("get", "--from-lock", "sources.lock", "--watch"), "--from-lock can't be used"),
+            (("get", "--from-lock", "missing.lock"), "Can’t read lockfile"),
+        ),
+    )
+    def test_main_get_from_lock_error(self, args, message, tmp_path, capsys, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+
+        with (
+            mock.patch.object(sys, "argv", ["rpmspectool", *args]),
+            pytest.raises(SystemExit) as excinfo,
+        ):
+            cli.CLI().main()
+
+        assert excinfo.value.code in (1, 2)
+        assert message in capsys.readouterr().err
+
+    def test_main_get_bundle(self, tmp_path, capsys):
+        specpath = tmp_path / "foo.spec"
+        specpath.write_text("Name: foo\n")
+        specfile_res = {
+            "sources": {0: "https://example.com/foo-1.tar.gz", 1: "https://example.com/foo.conf"},
+            "patches": {0: "fix.patch"},
+            "srcdir": None,
+        }
+        bundle_path = tmp_path / "sources.bundle"
+        online_dir = tmp_path / "online"
+        offline_dir = tmp_path / "offline"
+        online_dir.mkdir()
+        offline_dir.mkdir()
+
+        def mock_download(url, where=None, dry_run=False, insecure=False, force=False):
+            (online_dir / url.split("/")[-1]).write_bytes(url.encode("utf-8"))
+
+        # download once and export ...
+        cli_obj = cli.CLI()
+        with (
+            mock.patch.object(
+                sys,
+                "argv",
+                ["rpmspectool", "get", "--export-bundle", str(bundle_path)]
+                + ["-C", str(online_dir), str(specpath)],
+            ),
+            mock.patch.object(cli_obj, "eval_specfile", return_value=specfile_res),
+            mock.patch.object(cli, "download", side_effect=mock_download),
+        ):
+            assert not cli_obj.main()
+
+        assert "Wrote 2 files to bundle" in capsys.readouterr().err
+
+        # ... then fetch without network access
+        cli_obj = cli.CLI()
+        with (
+            mock.patch.object(
+                sys,
+                "argv",
+                ["rpmspectool", "get", "--bundle", str(bundle_path), "--format", "jsonl"]
+                + ["-C", str(offline_dir), str(specpath)],
+            ),
+            mock.patch.object(cli_obj, "eval_specfile", return_value=specfile_res),
+            mock.patch.object(cli, "download") as download,
+        ):
+            assert not cli_obj.main()
+
+        download.assert_not_called()
+        records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert [(r["filename"], r["status"]) for r in records] == [
+            ("foo-1.tar.gz", "bundled"),
+            ("foo.conf", "bundled"),
+            ("fix.patch", "skipped"),
+        ]
+        for fname in ("foo-1.tar.gz", "foo.conf"):
+            assert (offline_dir / fname).read_bytes() == (online_dir / fname).read_bytes()
+
+    @pytest.mark.parametrize(
+        "args, message",
+        (
+            (("--bundle", "missing.bundle"), "Can’t read bundle"),
+            (("--export-bundle", "sources.bundle", "--dry-run"), "can't be used with --dry-run"),
+            (("--export-bundle", "missing/sources.bundle"), "Can’t write bundle"),
+        ),
+    )
+    def test_main_get_bundle_error(self, args, message, tmp_path, capsys, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        cli_obj = cli.CLI()
+
+        with (
+            mock.patch.object(sys, "argv", ["rpmspectool", "get", *args, "foo.spec"]),
+            mock.patch.object(cli_obj, "run_specfiles"),
+            pytest.raises(SystemExit) as excinfo,
+        ):
+            cli_obj.main()
+
+        assert excinfo.value.code in (1, 2)
+        assert message in capsys.readouterr().err
+
+    @pytest.mark.parametrize("download_jobs", (1, 3))
+    def test_main_get_schedule(self, download_jobs, tmp_path):
+        report_path = tmp_path / "report.jsonl"
+        report_path.write_text(
+            "\n".join(
+                json.dumps({"specfile": specfile, "url": url, "size": size})
+                for specfile, url, size in (
+                    ("small.spec", "https://example.com/small.tar.gz", 10),
+                    ("big.spec", "https://example.com/big.tar.gz", 1000),
+                )
+            )
+        )
+
+        cli_obj = cli.CLI()
+
+        with (
+            mock.patch.object(
+                sys,
+                "argv",
+                ["rpmspectool", "get", "-J", str(download_jobs), "--shard-sizes", str(report_path)]
+                + ["small.spec", "other.spec", "big.spec"],
+            ),
+            mock.patch.object(cli, "Pipeline") as Pipeline,
+        ):
+            cli_obj.main()
+
+        assert cli_obj.schedule.sizes == {
+            "https://example.com/small.tar.gz": 10,
+            "https://example.com/big.tar.gz": 1000,
+        }
+        _, kwargs = Pipeline.call_args
+        if download_jobs == 1:
+            assert kwargs["priority"] is None
+            Pipeline.return_value.run.assert_called_once_with(
+                ["small.spec", "other.spec", "big.spec"]
+            )
+        else:
+            assert kwargs["priority"] == cli_obj.schedule.priority
+            # spec files with large files are evaluated first
+            Pipeline.return_value.run.assert_called_once_with(
+                ["big.spec", "small.spec", "other.spec"]
+            )
+
+    def test_main_get_probe_sizes(self, tmp_path, capsys):
+        specfile_res = {
+            "sources": {0: "https://example.com/foo-1.tar.gz", 1: "https://example.com/foo.conf"},
+            "patches": {0: "fix.patch"},
+            "srcdir": None,
+        }
+
+        def mock_download(url, where=None, dry_run=False, insecure=False, force=False):
+            (tmp_path / url.split("/")[-1]).write_bytes(b"x" * 2048)
+
+        cli_obj = cli.CLI()
+
+        with (
+            mock.patch.object(
+                sys,
+                "argv",
+                ["rpmspectool", "get", "-J", "2", "--probe-sizes", "-C", str(tmp_path)]
+                + ["foo.spec"],
+            ),
+            mock.patch.object(cli_obj, "eval_specfile", return_value=specfile_res),
+            mock.patch.object(cli, "download", side_effect=mock_download),
+            mock.patch("rpmspectool.schedule.check_urls") as check_urls,
+            mock.patch.object(sys.stderr, "isatty", return_value=True),
+        ):
+            check_urls.return_value = [
+                {"url": "https://example.com/foo-1.tar.gz", "ok": True, "size": 2048}
+            ]
+            assert not cli_obj.main()
+
+        check_urls.assert_called_once_with(
+            dict.fromkeys(("https://example.com/foo-1.tar.gz", "https://example.com/foo.conf")),
+            insecure=False,
+        )
+        progress = [
+            line for line in capsys.readouterr().err.splitlines() if line.startswith("Fetched")
+        ]
+        assert len(progress) == 3
+        assert progress[-1].startswith("Fetched 3 of 3 files, 4.0 KiB of 4.0 KiB, ETA ")
+
+    @pytest.mark.parametrize("mirror", (False, True), ids=("no-mirror", "mirror"))
+    def test_main_get_host_down(self, mirror, tmp_path, capsys, isolated_cache_dir):
+        specfile_res = {
+            "sources": {0: "https://example.com/foo-1.tar.gz"},
+            "patches": {i: f"https://git.example.com/{i}.patch" for i in range(5)},
+            "srcdir": None,
+        }
+        attempted = []
+
+        def mock_download(url, where=None, dry_run=False, insecure=False, force=False):
+            attempted.append(url)
+            if url.startswith("https://git.example.com/"):
+                raise download_mod.HostDownError(f"Couldn't download {url}: Connection refused")
+            (tmp_path / url.split("/")[-1]).write_bytes(b"x")
+
+        argv = ["rpmspectool", "get", "--format", "jsonl", "-C", str(tmp_path)]
+        argv += ["--host-failures", "2", "--remember-down-hosts", "600"]
+        if mirror:
+            argv += ["--mirror", "git.example.com=https://mirror.example.com/git"]
+
+        cli_obj = cli.CLI()
+
+        with (
+            mock.patch.object(sys, "argv", argv + ["foo.spec"]),
+            mock.patch.object(cli_obj, "eval_specfile", return_value=specfile_res),
+            mock.patch.object(cli, "download", side_effect=mock_download),
+        ):
+            retval = cli_obj.main()
+
+        records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+        # after two failures, git.example.com isn't tried anymore
+        assert attempted[:3] == [
+            "https://example.com/foo-1.tar.gz",
+            "https://git.example.com/0.patch",
+            "https://git.example.com/1.patch",
+        ]
+        assert retval == 1
+        if mirror:
+            assert attempted[3:] == [f"https://mirror.example.com/git/{i}.patch" for i in (2, 3, 4)]
+            assert [r["status"] for r in records] == ["downloaded", "failed", "failed"] + 3 * [
+                "downloaded"
+            ]
+        else:
+            assert len(attempted) == 3
+            assert [r["status"] for r in records] == ["downloaded"] + 5 * ["failed"]
+            assert records[-1]["error"] == (
+                "Couldn't download https://git.example.com/4.patch: git.example.com is down,"
+                + " not trying it"
+            )
+
+        with open(isolated_cache_dir / "down-hosts.json") as fobj:
+            assert list(json.load(fobj)["hosts"]) == ["git.example.com"]
+
+    def test_tmpdir_created_before_pipeline(self):
+        cli_obj = cli.CLI()
+
+        def run(specfiles):
+            # worker threads only ever see the finished temporary directory
+            assert os.path.isdir(cli_obj._tmpdir)
+
+        with (
+            mock.patch.object(sys, "argv", ["rpmspectool", "list", "-j", "2", "a.spec", "b.spec"]),
+            mock.patch.object(cli, "Pipeline") as Pipeline,
+        ):
+            Pipeline.return_value.run.side_effect = run
+            cli_obj.main()
+
+        Pipeline.return_value.run.assert_called_once_with(["a.spec", "b.spec"])
+
+    def test_main_profile(self, tmp_path):
+        trace_path = tmp_path / "trace.json"
+        specfile_res = {
+            "sources": {0: "https://example.com/foo-1.tar.gz"},
+            "patches": {},
+            "srcdir": "/foo/bar",
+        }
+
+        cli_obj = cli.CLI()
+
+        with (
+            mock.patch.object(
+                sys, "argv", ["rpmspectool", "--profile", str(trace_path), "get", "test.spec"]
+            ),
+            mock.patch.object(cli_obj, "eval_specfile") as eval_specfile,
+            mock.patch.object(cli, "download"),
+        ):
+            eval_specfile.return_value = specfile_res
+            retval = cli_obj.main()
+
+        assert not retval
+
+        with trace_path.open() as fobj:
+            events = json.load(fobj)["traceEvents"]
+
+        spans = {event["name"]: event for event in events if event["ph"] == "X"}
+        assert spans["evaluate"]["args"] == {"spec": "test.spec"}
+        assert spans["fetch"]["args"] == {
+            "spec": "test.spec",
+            "url": "https://example.com/foo-1.tar.gz",
+            "status": "downloaded",
+        }
+
+    @pytest.mark.parametrize("use_cache", (False, True), ids=("no-cache", "cache"))
+    def test_eval_specfile_cached(self, use_cache, isolated_cache_dir):
+        specfile_res = {
+            "sources": {0: "https://example.com/foo-1.tar.gz"},
+            "patches": {},
+            "srcdir": "/foo/bar",
+        }
+
+        cli_obj = cli.CLI()
+
+        with (
+            mock.patch.object(
+                sys,
+                "argv",
+                ["rpmspectool", "list"] + use_cache * ["--cache"] + [str(TEST_SPEC_PATH)],
+            ),
+            mock.patch.object(cli.RPMSpecHandler, "eval_specfile") as eval_specfile,
+        ):
+            eval_specfile.return_value = specfile_res
+            cli_obj.main()
+            cli_obj.main()
+
+        if not use_cache:
+            assert eval_specfile.call_count == 2
+            assert not isolated_cache_dir.exists()
+        else:
+            # the second run uses the stored result
+            eval_specfile.assert_called_once_with([])
+            assert list(isolated_cache_dir.glob("results/*/*.json"))
+
+    @pytest.mark.parametrize("cmd", ("list", "check"))
+    def test_main_batch(self, cmd, tmp_path, capsys, isolated_cache_dir):
+        specpaths = []
+        for name in ("a", "b", "c"):
+            specpath = tmp_path / f"{name}.spec"
+            specpath.write_text(f"Name: {name}\n")
+            specpaths.append(str(specpath))
+        batches = []
+
+        def eval_specfiles(handlers, definitions):
+            handlers = list(handlers)
+            batches.append([os.path.basename(h.in_specfile_path) for h in handlers])
+            return [
+                cli.RPMSpecEvalError("out.spec", 1, b"boo")
+                if h.in_specfile_path.endswith("b.spec")
+                else {
+                    "sources": {0: f"https://example.com/{os.path.basename(h.in_specfile_path)}"},
+                    "patches": {},
+                    "srcdir": None,
+                }
+                for h in handlers
+            ]
+
+        cli_obj = cli.CLI()
+
+        with (
+            mock.patch.object(
+                sys,
+                "argv",
+                ["rpmspectool", cmd, "--cache", "--batch-size", "2", *specpaths],
+            ),
+            mock.patch.object(cli, "eval_specfiles", side_effect=eval_specfiles),
+            mock.patch.object(cli, "check_urls", return_value=[]) as check_urls,
+            pytest.raises(SystemExit) as excinfo,
+        ):
+            cli_obj.main()
+
+        stdout, stderr = capsys.readouterr()
+
+        assert excinfo.value.code == 2
+        assert batches == [["a.spec", "b.spec"], ["c.spec"]]
+        assert f"Error parsing intermediate spec file for {specpaths[1]}." in stderr
+        if cmd == "list":
+            assert stdout.splitlines() == [
+                f"{specpaths[0]}: Source0: https://example.com/a.spec",
+                f"{specpaths[2]}: Source0: https://example.com/c.spec",
+            ]
+        else:
+            assert list(check_urls.call_args.args[0]) == [
+                "https://example.com/a.spec",
+                "https://example.com/c.spec",
+            ]
+        # results of successfully evaluated spec files are stored
+        assert len(list(isolated_cache_dir.glob("results/*/*.json"))) == 2
+
+    @pytest.mark.parametrize("cmd", ("list", "get"))
+    @pytest.mark.parametrize("cached", (False, True), ids=("uncached", "cached"))
+    def test_main_changed_since(self, cmd, cached, tmp_path, capsys):
+        changed_spec = tmp_path / "changed.spec"
+        unchanged_spec = tmp_path / "unchanged.spec"
+        for spec in (changed_spec, unchanged_spec):
+            spec.write_text(f"Name: {spec.stem}\n")
+        specfile_res = {
+            "sources": {0: "https://example.com/foo-1.tar.gz"},
+            "patches": {},
+            "srcdir": "/foo/bar",
+        }
+
+        cli_obj = cli.CLI()
+
+        if cached:
+            cache.ResultCache().put(cache.spec_digest(str(unchanged_spec)), specfile_res)
+
+        with (
+            mock.patch.object(
+                sys,
+                "argv",
+                ["rpmspectool", cmd, "--cache", "--changed-since", "HEAD", str(tmp_path)],
+            ),
+            mock.patch.object(cli, "changed_specfiles") as changed_specfiles,
+            mock.patch.object(cli_obj, "eval_specfile") as eval_specfile,
+            mock.patch.object(cli, "download") as download,
+        ):
+            changed_specfiles.return_value = {str(changed_spec)}
+            eval_specfile.return_value = specfile_res
+            retval = cli_obj.main()
+
+        stdout, stderr = capsys.readouterr()
+
+        assert not retval
+        changed_specfiles.assert_called_once_with([str(changed_spec), str(unchanged_spec)], "HEAD")
+
+        if cmd == "list" and not cached:
+            # unchanged spec files without stored results are evaluated
+            assert eval_specfile.call_args_list == [
+                mock.call(str(changed_spec)),
+                mock.call(str(unchanged_spec)),
+            ]
+        else:
+            eval_specfile.assert_called_once_with(str(changed_spec))
+
+        if cmd == "list":
+            assert stdout.splitlines() == [
+                f"{changed_spec}: Source0: https://example.com/foo-1.tar.gz",
+                f"{unchanged_spec}: Source0: https://example.com/foo-1.tar.gz",
+            ]
+        else:
+            download.assert_called_once()
+
+    def test_main_changed_since_error(self, tmp_path, capsys):
+        cli_obj = cli.CLI()
+
+        with (
+            mock.patch.object(
+                sys, "argv", ["rpmspectool", "list", "--changed-since", "HEAD", str(tmp_path)]
+            ),
+            mock.patch.object(cli, "changed_specfiles") as changed_specfiles,
+            pytest.raises(SystemExit) as excinfo,
+        ):
+            changed_specfiles.side_effect = cli.TreeError("git diff failed: boo")
+            cli_obj.main()
+
+        assert excinfo.value.code == 1
+        assert "git diff failed: boo" in capsys.readouterr().err
+
+    def test_main_srpm(self, tmp_path, capsys, isolated_cache_dir):
+        srpm_path = tmp_path / "foo-1-1.src.rpm"
+        srpm_path.write_bytes(make_srpm())
+        broken_path = tmp_path / "bar-1-1.src.rpm"
+        broken_path.write_bytes(make_srpm(members=SRPM_MEMBERS[:1]))
+        evaluated = []
+
+        def eval_specfiles(handlers, definitions):
+            handlers = list(handlers)
+            for handler in handlers:
+                evaluated.append(
+                    (
+                        handler.in_specfile_path,
+                        handler.in_specfile.read(),
+                        os.path.basename(handler.out_specfile_path),
+                    )
+                )
+            return [
+                {"sources": {0: "https://example.com/foo-1.tar.gz"}, "patches": {}, "srcdir": None}
+                for handler in handlers
+            ]
+
+        cli_obj = cli.CLI()
+
+        with (
+            mock.patch.object(
+                sys, "argv", ["rpmspectool", "list", "--cache", str(broken_path), str(srpm_path)]
+            ),
+            mock.patch.object(cli, "eval_specfiles", side_effect=eval_specfiles),
+            pytest.raises(SystemExit) as excinfo,
+        ):
+            cli_obj.main()
+
+        stdout, stderr = capsys.readouterr()
+
+        assert excinfo.value.code == 1
+        assert f"{broken_path} doesn’t contain a spec file" in stderr
+        assert evaluated == [(str(srpm_path), SRPM_SPEC, "rpmspectool-foo-1-1.spec")]
+        assert stdout == f"{srpm_path}: Source0: https://example.com/foo-1.tar.gz\n"
+
+    @pytest.mark.parametrize("kind", ("spec", "srpm"))
+    def test_main_remote(self, kind, http_server, capsys, isolated_cache_dir):
+        if kind == "spec":
+            http_server.files["foo.spec"] = SRPM_SPEC
+            url = http_server.url("/files/foo.spec")
+        else:
+            http_server.files["foo-1-1.src.rpm"] = make_srpm()
+            url = http_server.url("/files/foo-1-1.src.rpm")
+        missing_url = http_server.url("/files/missing.spec")
+        evaluated = []
+
+        def eval_specfiles(handlers, definitions):
+            handlers = list(handlers)
+            evaluated.extend(handler.in_specfile.read() for handler in handlers)
+            return [
+                {"sources": {0: "https://example.com/foo-1.tar.gz"}, "patches": {}, "srcdir": None}
+                for handler in handlers
+            ]
+
+        for run in range(2):
+            cli_obj = cli.CLI()
+            with (
+                mock.patch.object(sys, "argv", ["rpmspectool", "list", url, missing_url]),
+                mock.patch.object(cli, "eval_specfiles", side_effect=eval_specfiles),
+                pytest.raises(SystemExit) as excinfo,
+            ):
+                cli_obj.main()
+
+            stdout, stderr = capsys.readouterr()
+
+            assert excinfo.value.code == 1
+            assert f"Couldn't download {missing_url}: 404" in stderr
+            assert stdout == f"{url}: Source0: https://example.com/foo-1.tar.gz\n"
+
+        assert evaluated == [SRPM_SPEC, SRPM_SPEC]
+        # the second run revalidated the spec file fetched in the first one
+        assert [
+            path for _, path, headers in http_server.requests if "If-None-Match" in headers
+        ] == [url.removeprefix(http_server.url(""))]
+        assert list(isolated_cache_dir.glob("specs/*/*.json"))
+
+    def test_main_remote_watch(self, capsys):
+        cli_obj = cli.CLI()
+
+        with (
+            mock.patch.object(
+                sys, "argv", ["rpmspectool", "list", "--watch", "https://example.com/foo.spec"]
+            ),
+            pytest.raises(SystemExit) as excinfo,
+        ):
+            cli_obj.main()
+
+        assert excinfo.value.code == 2
+        assert "--watch can't be used with spec file URLs" in capsys.readouterr().err
+
+    def test_cached_result(self, tmp_path):
+        cli_obj = cli.CLI()
+        cli_obj.cache = None
+        assert cli_obj.cached_result(str(tmp_path / "foo.spec")) is None
+
+        cli_obj.cache = cache.ResultCache()
+        cli_obj.args = mock.Mock(define=[])
+        # missing spec files have no stored result
+        assert cli_obj.cached_result(str(tmp_path / "foo.spec")) is None
+        # neither have damaged source packages
+        (tmp_path / "foo-1-1.src.rpm").write_bytes(b"boo")
+        assert cli_obj.cached_result(str(tmp_path / "foo-1-1.src.rpm")) is None
+
+    @pytest.mark.parametrize(
+        "kind, prefix, comp_line_only, expected",
+        (
+            ("sources", "", False, {"0": "https://example.com/foo-1.tar.gz", "2": "foo.conf"}),
+            ("sources", "2", False, {"2": "foo.conf"}),
+            ("sources", "0,", False, {"0,2": "foo.conf"}),
+            ("sources", "", True, {"0": "https://example.com/foo-1.tar.gz", "2": "foo.conf"}),
+            ("patches", "", False, {"1": "fix.patch"}),
+        ),
+    )
+    def test_index_completer(self, kind, prefix, comp_line_only, expected, tmp_path, monkeypatch):
+        specpath = tmp_path / "foo.spec"
+        specpath.write_text("Name: foo\n")
+        other_specpath = tmp_path / "other.spec"
+        other_specpath.write_text("Name: other\n")
+        cache.ResultCache().put(
+            cache.spec_digest(str(specpath)),
+            {
+                "sources": {0: "https://example.com/foo-1.tar.gz", 2: "foo.conf"},
+                "patches": {1: "fix.patch"},
+                "srcdir": None,
+            },
+        )
+
+        if comp_line_only:
+            parsed_args = argparse.Namespace()
+            monkeypatch.setenv("COMP_LINE", f"rpmspectool get --source  {specpath}")
+        else:
+            # the other spec file has no stored result, a missing one is skipped
+            parsed_args = argparse.Namespace(
+                specfiles=[str(specpath), str(other_specpath), str(tmp_path / "missing.spec")],
+                define=[],
+            )
+            monkeypatch.delenv("COMP_LINE", raising=False)
+
+        completer = cli.IndexCompleter(kind)
+
+        with mock.patch.object(cli, "RPMSpecHandler") as RPMSpecHandler:
+            assert completer(prefix, parsed_args=parsed_args) == expected
+
+        # rpm is never run while completing
+        RPMSpecHandler.assert_not_called()
+
+    def test_index_completer_time_budget(self, tmp_path):
+        specpath = tmp_path / "foo.spec"
+        specpath.write_text("Name: foo\n")
+        cache.ResultCache().put(
+            cache.spec_digest(str(specpath)),
+            {"sources": {0: "foo.tar.gz"}, "patches": {}, "srcdir": None},
+        )
+        completer = cli.IndexCompleter("sources")
+        parsed_args = argparse.Namespace(specfiles=[str(specpath)], define=[])
+
+        with mock.patch.object(cli, "COMPLETION_TIME_BUDGET", new=-1):
+            assert completer("", parsed_args=parsed_args) == {}
+
+    def test_index_completer_skips_srpms(self, tmp_path, monkeypatch):
+        """Reading spec files out of source RPM packages is too slow for completing."""
+        srpm_path = str(tmp_path / "foo-1-1.src.rpm")
+        monkeypatch.setenv("COMP_LINE", f"rpmspectool get --source 0 {srpm_path} bar.spec")
+        parsed_args = argparse.Namespace(specfiles=[srpm_path, "foo.spec"], define=[])
+
+        with mock.patch.object(cli, "spec_digest", side_effect=OSError) as spec_digest:
+            assert cli.IndexCompleter("sources")("", parsed_args=parsed_args) == {}
+
+        assert [call.args[0] for call in spec_digest.call_args_list] == ["foo.spec", "bar.spec"]
+
+    def test_index_completer_registered(self):
+        parser = cli.CLI().get_arg_parser()
+        get_parser = parser._subparsers._group_actions[0].choices["get"]
+
+        for option, kind in (("--source", "sources"), ("--patch", "patches")):
+            completer = get_parser._option_string_actions[option].completer
+            assert isinstance(completer, cli.IndexCompleter)
+            assert completer.kind == kind
+
+    @pytest.mark.parametrize("cmd", ("list", "get", "check"))
+    def test_main_watch(self, cmd, tmp_path, capsys):
+        specpath = tmp_path / "test.spec"
+        specpath.write_text("Name: test\nVersion: 1\n")
+        first_res = {
+            "sources": {0: "https://example.com/test-1.tar.gz"},
+            "patches": {},
+            "srcdir": "/foo/bar",
+        }
+        second_res = {
+            "sources": {0: "https://example.com/test-1.tar.gz", 1: "https://example.com/extra"},
+            "patches": {},
+            "srcdir": "/foo/bar",
+        }
+
+        def change_changelog():
+            with specpath.open("a") as fobj:
+                fobj.write("%changelog\n- Rebuilt\n")
+            return {str(specpath)}
+
+        def spurious_wakeup():
+            return set()
+
+        def change_preamble():
+            specpath.write_text("Name: test\nVersion: 1\nSource1: https://example.com/extra\n")
+            return {str(specpath)}
+
+        def remove():
+            specpath.unlink()
+            return {str(specpath)}
+
+        def interrupt():
+            raise KeyboardInterrupt()
+
+        changes = iter((change_changelog, spurious_wakeup, change_preamble, remove, interrupt))
+
+        cli_obj = cli.CLI()
+
+        with (
+            mock.patch.object(sys, "argv", ["rpmspectool", cmd, "--watch", str(specpath)]),
+            mock.patch.object(cli, "SpecWatcher") as SpecWatcher,
+            mock.patch.object(cli_obj, "eval_specfile") as eval_specfile,
+            mock.patch.object(cli, "download") as download,
+            mock.patch.object(cli, "check_urls", return_value=[]) as check_urls,
+        ):
+            watcher = SpecWatcher.return_value.__enter__.return_value
+            watcher.wait.side_effect = lambda: next(changes)()
+            eval_specfile.side_effect = [first_res, second_res]
+            retval = cli_obj.main()
+
+        stdout, stderr = capsys.readouterr()
+
+        assert not retval
+        SpecWatcher.assert_called_once_with([str(specpath)])
+        assert "Watching for changes" in stderr
+        # only changes to the preamble cause the spec file to be evaluated again
+        assert eval_specfile.call_args_list == 2 * [mock.call(str(specpath))]
+
+        if cmd == "list":
+            assert stdout.splitlines() == [
+                "Source0: https://example.com/test-1.tar.gz",
+                "Source0: https://example.com/test-1.tar.gz",
+                "Source1: https://example.com/extra",
+            ]
+        elif cmd == "get":
+            # only newly referenced files are fetched
+            assert download.call_args_list == [
+                mock.call(url, where=None, dry_run=False, insecure=False, force=False)
+                for url in ("https://example.com/test-1.tar.gz", "https://example.com/extra")
+            ]
+        else:  # cmd == "check"
+            assert check_urls.call_count == 2
+
+    def test_main_watch_error(self, tmp_path, capsys):
+        cli_obj = cli.CLI()
+
+        with (
+            mock.patch.object(sys, "argv", ["rpmspectool", "list", "--watch", str(tmp_path)]),
+            mock.patch.object(cli, "SpecWatcher") as SpecWatcher,
+            pytest.raises(SystemExit) as excinfo,
+        ):
+            SpecWatcher.side_effect = cli.WatchError("Watching isn’t possible")
+            cli_obj.main()
+
+        assert excinfo.value.code == 1
+        assert "Watching isn’t possible" in capsys.readouterr().err
+
+    @pytest.mark.parametrize(
+        "url, expected",
+        (
+            ("https://example.com/foo.tar.gz", "download"),
+            ("file:///mirror/foo.tar.gz", "copy_local"),
+            ("/mirror/foo.tar.gz", "copy_local"),
+            ("foo.patch", None),
+        ),
+    )
+    @pytest.mark.parametrize("extract", (None, "/extracted"), ids=("keep", "extract"))
+    def test_get_item(self, url, expected, extract):
+        cli_obj = cli.CLI()
+        cli_obj.args = mock.Mock(
+            dry_run=False,
+            insecure=False,
+            force=False,
+            sourcedir=False,
+            directory="/foo/bar",
+            extract=extract,
+        )
+        cli_obj.args.format = "text"
+        cli_obj.fetched = None
+        cli_obj.schedule = schedule.DownloadSchedule()
+        cli_obj.breaker = breaker.HostCircuitBreaker()
+        cli_obj.show_progress = False
+        cli_obj.bundles = []
+        cli_obj.export_files = None
+        cli_obj.retval = 0
+        cli_obj.coalescer = download_mod.TransferCoalescer()
+
+        with (
+            mock.patch.object(cli, "download") as download,
+            mock.patch.object(cli, "copy_local") as copy_local,
+            mock.patch.object(cli, "extract_archive") as extract_archive,
+        ):
+            cli_obj.get_item(
+                {
+                    "specfile": "test.spec",
+                    "url": url,
+                    "filename": url.split("/")[-1],
+                    "srcdir": "/src",
+                }
+            )
+
+        if expected == "download":
+            download.assert_called_once_with(
+                url,
+                where="/foo/bar",
+                dry_run=False,
+                insecure=False,
+                force=False,
+                **({"extract_dir": extract} if extract else {}),
+            )
+        else:
+            download.assert_not_called()
+
+        if expected == "copy_local":
+            copy_local.assert_called_once_with(url, where="/foo/bar", dry_run=False, force=False)
+            if extract:
+                extract_archive.assert_called_once_with("/foo/bar/foo.tar.gz", extract)
+        else:
+            copy_local.assert_not_called()
+
+        if expected != "copy_local" or not extract:
+            # download() extracts by itself
+            extract_archive.assert_not_called()
+
+        assert not cli_obj.retval
+
+    @pytest.mark.parametrize("extract", (None, "/extracted"), ids=("keep", "extract"))
+    def test_get_item_bundled(self, extract):
+        cli_obj = cli.CLI()
+        cli_obj.args = mock.Mock(
+            dry_run=False, force=False, sourcedir=False, directory="/foo", extract=extract
+        )
+        cli_obj.args.format = "text"
+        cli_obj.fetched = None
+        cli_obj.schedule = schedule.DownloadSchedule()
+        cli_obj.breaker = breaker.HostCircuitBreaker()
+        cli_obj.show_progress = False
+        cli_obj.export_files = None
+        cli_obj.retval = 0
+        entry = {"filename": "foo-1.tar.gz"}
+        bundles = [mock.Mock(), mock.Mock()]
+        bundles[0].lookup.return_value = None
+        bundles[1].lookup.return_value = entry
+        cli_obj.bundles = bundles
+
+        with (
+            mock.patch.object(cli, "download") as download,
+            mock.patch.object(cli, "extract_archive") as extract_archive,
+            mock.patch.object(cli_obj, "_verify", return_value=None),
+        ):
+            cli_obj.get_item(
+                {
+                    "specfile": "test.spec",
+                    "url": "https://example.com/foo-1.tar.gz",
+                    "filename": "foo-1.tar.gz",
+                    "srcdir": None,
+                    "sha512": "abc",
+                }
+                | ({} if extract else {"sha512": None})
+            )
+
+        download.assert_not_called()
+        bundles[1].lookup.assert_called_once_with(
+            "https://example.com/foo-1.tar.gz", "abc" if extract else None
+        )
+        bundles[1].copy_file.assert_called_once_with(
+            entry, where="/foo", dry_run=False, force=False
+        )
+        if extract:
+            extract_archive.assert_called_once_with("/foo/foo-1.tar.gz", extract)
+        else:
+            extract_archive.assert_not_called()
+        assert not cli_obj.retval
+
+    def test_get_item_extract_error(self, caplog):
+        cli_obj = cli.CLI()
+        cli_obj.args = mock.Mock(
+            dry_run=False, force=False, sourcedir=False, directory="/foo", extract="/x"
+        )
+        cli_obj.args.format = "text"
+        cli_obj.fetched = None
+        cli_obj.schedule = schedule.DownloadSchedule()
+        cli_obj.breaker = breaker.HostCircuitBreaker()
+        cli_obj.show_progress = False
+        cli_obj.bundles = []
+        cli_obj.export_files = None
+        cli_obj.retval = 0
+
+        with (
+            mock.patch.object(cli, "copy_local"),
+            mock.patch.object(cli, "extract_archive") as extract_archive,
+        ):
+            extract_archive.side_effect = cli.ExtractError("Couldn't extract /foo/foo.tar.gz: boo")
+            cli_obj.get_item(
+                {
+                    "specfile": "test.spec",
+                    "url": "/mirror/foo.tar.gz",
+                    "filename": "foo.tar.gz",
+                    "srcdir": None,
+                }
+            )
+
+        assert cli_obj.retval == 1
+        assert "Couldn't extract /foo/foo.tar.gz: boo" in caplog.text
+
     @pytest.mark.parametrize(
         "testcase",
         (
@@ -199,11 +1511,15 @@ class TestCLI:
             "list-eval-error",
             "list-eval-error-debug-verbose",
             "list-file-missing-error",
+            "list-multiple",
+            "list-multiple-eval-error",
             "get",
             "get-debug",
             "get-sourcedir",
             "get-download-error",
             "get-file-exists-error",
+            "get-multiple",
+            "get-multiple-parallel",
             "version",
             "usage",
         ),
@@ -240,6 +1556,12 @@ class TestCLI:
         if "sourcedir" in testcase:
             subcmd_args.extend(("--define", "_sourcedir /foo/bar", "--sourcedir"))
 
+        if "parallel" in testcase:
+            subcmd_args.extend(("--jobs", "2", "--download-jobs", "3"))
+
+        if "multiple" in testcase:
+            subcmd_args.append(TEST_SPEC)
+
         if "list" in testcase or "get" in testcase:
             if "eval-error" in testcase:
                 subcmd_args.append("/dev/null")
@@ -260,6 +1582,7 @@ class TestCLI:
             mock.patch.object(sys, "argv"),
             mock.patch.object(cli, "logging") as logging,
             mock.patch.object(cli, "download") as download,
+            mock.patch.object(download_mod, "copy_local") as copy_local,
             expected_exc_context as excinfo,
         ):
             get_arg_parser.return_value = argparser
@@ -289,12 +1612,21 @@ class TestCLI:
             else:
                 logging.basicConfig.assert_not_called()
 
-            if "error" not in testcase:
+            if "multiple" in testcase:
+                expected_lines = [f"{TEST_SPEC}: {line}" for line in expected.splitlines()]
+                if "eval-error" in testcase:
+                    # the valid spec file is still processed
+                    assert excinfo.value.code == 2
+                    assert stdout.splitlines() == expected_lines
+                else:
+                    assert stdout.splitlines() == 2 * expected_lines
+            elif "error" not in testcase:
                 assert stdout == expected
             else:
                 if "eval-error" in testcase:
                     assert excinfo.value.code == 2
                     assert "Error parsing intermediate spec file" in stderr
+                    assert "for /dev/null." in stderr
                     if "verbose" in testcase:
                         assert "RPM error:" in stderr
                 elif "file-missing" in testcase:
@@ -327,7 +1659,17 @@ class TestCLI:
                 else:
                     expected_patch_calls.append(expected_call)
 
-            assert download.call_args_list == expected_source_calls + expected_patch_calls
+            expected_calls = expected_source_calls + expected_patch_calls
+            if "parallel" in testcase:
+                assert sorted(download.call_args_list) == sorted(expected_calls)
+            else:
+                assert download.call_args_list == expected_calls
+
+            if "multiple" in testcase:
+                # identical URLs are only downloaded once, then linked or copied
+                assert copy_local.call_count == len(expected_calls)
+            else:
+                copy_local.assert_not_called()
 
             if "error" in testcase:
                 assert retval == 1
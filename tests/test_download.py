@@ -1,6 +1,12 @@
+import errno
 import os
+import socket
+import subprocess
+import sys
+import threading
 import time
 from contextlib import nullcontext
+from datetime import datetime, timezone
 from unittest import mock
 
 import pycurl
@@ -8,6 +14,7 @@ import pytest
 
 from rpmspectool import download, version
 
+from .test_extract import make_tar, make_zip
 from .util import changed_directory
 
 
@@ -110,11 +117,14 @@ def test_download(
     curl.perform.assert_called_once_with()
     curl.close.assert_called_once_with()
 
+    # data goes through a writer collecting it, into the temporary file
+    writer = curl.setopt.call_args_list[-2].args[1].__self__
+    assert isinstance(writer, download._DownloadWriter)
+    assert writer.fobj is fobj
+
     setopt_expected_calls = [
         mock.call(curl.URL, test_url),
-        mock.call(curl.WRITEDATA, fobj),
         mock.call(curl.FOLLOWLOCATION, True),
-        mock.call(curl.OPT_FILETIME, True),
         mock.call(curl.USERAGENT, f"rpmspectool/{version.version}"),
     ]
 
@@ -126,6 +136,14 @@ def test_download(
             ]
         )
 
+    setopt_expected_calls.extend(
+        [
+            mock.call(curl.HEADERFUNCTION, writer.header),
+            mock.call(curl.WRITEFUNCTION, writer.write),
+            mock.call(curl.OPT_FILETIME, True),
+        ]
+    )
+
     assert curl.setopt.call_args_list == setopt_expected_calls
 
     if success:
@@ -144,3 +162,693 @@ def test_download(
         os_link.assert_not_called()
         os_utime.assert_not_called()
         os_chmod.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "name, content, streamed, error",
+    (
+        ("foo-1.tar.gz", make_tar("w:gz"), True, None),
+        ("foo-1.zip", make_zip(), False, None),
+        ("foo-1.tar.gz", make_tar("w:gz")[:20] + bytes(1000), True, download.ExtractError),
+        ("foo-1.tar.gz", None, True, download.DownloadError),
+    ),
+    ids=("streamed", "afterwards", "broken", "missing"),
+)
+def test_download_extract(name, content, streamed, error, http_server, tmp_path, capsys):
+    if content is not None:
+        http_server.files[name] = content
+    extract_dir = tmp_path / "extracted"
+
+    with pytest.raises(error) if error else nullcontext():
+        download.download(
+            http_server.url(f"/files/{name}"), where=str(tmp_path), extract_dir=str(extract_dir)
+        )
+
+    stdout = capsys.readouterr().out
+
+    assert ("while downloading" in stdout) == streamed
+    if content is not None:
+        # the archive is kept, even if extracting it failed
+        assert (tmp_path / name).read_bytes() == content
+    if error is None:
+        assert (extract_dir / "foo-1" / "README").read_bytes() == b"Read me!"
+
+
+class TestDownloadWriter:
+    def write(self, writer, data, chunk_size=16 * 1024):
+        for i in range(0, len(data), chunk_size):
+            assert writer.write(data[i : i + chunk_size]) is None
+
+    @pytest.mark.parametrize("announced", (None, "exact", "more"))
+    def test_write(self, announced, tmp_path):
+        data = os.urandom(3 * download.WRITE_BUFFER_SIZE + 12345)
+        tee = bytearray()
+
+        with open(tmp_path / "foo.bin", "wb") as fobj:
+            writer = download._DownloadWriter(fobj, tee=tee.extend)
+            for line in (b"HTTP/1.1 302 Found\r\n", b"Content-Length: 0\r\n"):
+                writer.header(line)
+            writer.header(b"HTTP/1.1 200 OK\r\n")
+            if announced:
+                size = len(data) if announced == "exact" else 2 * len(data)
+                writer.header(f"Content-Length: {size}\r\n".encode("ascii"))
+
+            write_sizes = []
+            fobj_write = fobj.write
+
+            def write(chunk):
+                write_sizes.append(len(chunk))
+                return fobj_write(chunk)
+
+            with (
+                mock.patch.object(fobj, "write", side_effect=write),
+                mock.patch.object(os, "posix_fallocate", wraps=os.posix_fallocate) as fallocate,
+            ):
+                self.write(writer, data)
+                writer.finish()
+
+        if announced:
+            fallocate.assert_called_once_with(mock.ANY, 0, size)
+        else:
+            fallocate.assert_not_called()
+        # data is written in large aligned chunks, space allocated too much is freed
+        assert write_sizes == 3 * [download.WRITE_BUFFER_SIZE] + [12345]
+        assert (tmp_path / "foo.bin").read_bytes() == data
+        assert tee == data
+
+    @pytest.mark.parametrize("errno_", (errno.EOPNOTSUPP, errno.ENOSPC))
+    def test_write_fallocate_error(self, errno_, tmp_path):
+        with open(tmp_path / "foo.bin", "wb") as fobj:
+            writer = download._DownloadWriter(fobj)
+            writer.header(b"Content-Length: 5\r\n")
+
+            with mock.patch.object(
+                os, "posix_fallocate", side_effect=OSError(errno_, os.strerror(errno_))
+            ):
+                result = writer.write(b"hello")
+
+            if errno_ == errno.ENOSPC:
+                # the transfer is aborted
+                assert result == 0
+                assert writer.error.errno == errno.ENOSPC
+            else:
+                assert result is None
+                writer.finish()
+
+        if errno_ != errno.ENOSPC:
+            assert (tmp_path / "foo.bin").read_bytes() == b"hello"
+
+    @pytest.mark.parametrize("where", ("transfer", "finish"))
+    def test_download_write_error(self, where, http_server, tmp_path):
+        http_server.files["foo-1.tar.gz"] = b"x" * 1000
+        url = http_server.url("/files/foo-1.tar.gz")
+        error = OSError(errno.ENOSPC, "No space left on device")
+
+        with (
+            mock.patch.object(
+                download._DownloadWriter,
+                "_start" if where == "transfer" else "finish",
+                side_effect=error,
+            ),
+            pytest.raises(download.DownloadError, match="Couldn't write .*: No space left"),
+        ):
+            download.download(url, where=str(tmp_path))
+
+        assert not (tmp_path / "foo-1.tar.gz").exists()
+
+
+@pytest.mark.parametrize(
+    "kind, error",
+    (
+        ("missing", download.DownloadError),
+        ("unavailable", download.HostDownError),
+        ("refused", download.HostDownError),
+        ("write-error", download.DownloadError),
+    ),
+)
+def test_download_error(kind, error, http_server, tmp_path):
+    if kind == "missing":
+        url = http_server.url("/files/foo-1.tar.gz")
+    elif kind == "unavailable":
+        url = http_server.url("/unavailable/foo-1.tar.gz")
+    else:
+        url = "http://127.0.0.1:1/foo-1.tar.gz"
+
+    if kind == "write-error":
+        Curl = mock.Mock()
+        Curl.return_value.perform.side_effect = pycurl.error(pycurl.E_WRITE_ERROR, "boo")
+        curl_ctx = mock.patch.object(download.pycurl, "Curl", Curl)
+    else:
+        curl_ctx = nullcontext()
+
+    with curl_ctx, pytest.raises(error) as excinfo:
+        download.download(url, where=str(tmp_path))
+
+    # only errors which mean the host is down are reported as such
+    assert (type(excinfo.value) is download.HostDownError) == (error is download.HostDownError)
+    assert str(excinfo.value).startswith(f"Couldn't download {url}: ")
+    assert not (tmp_path / "foo-1.tar.gz").exists()
+
+
+@pytest.mark.parametrize(
+    "inval, retval",
+    (
+        ("file:///boop", True),
+        ("FILE:///FROOP", True),
+        ("/mirror/foo.tar.gz", True),
+        ("https://bar", False),
+        ("boop.patch", False),
+    ),
+)
+def test_is_local(inval, retval):
+    assert download.is_local(inval) == retval
+
+
+@pytest.mark.parametrize(
+    "inval, retval",
+    (
+        ("file:///mirror/foo%20bar.tar.gz", "/mirror/foo bar.tar.gz"),
+        ("file:///mirror/foo.tar.gz#/bar.tar.gz", "/mirror/foo.tar.gz"),
+        ("/mirror/foo.tar.gz", "/mirror/foo.tar.gz"),
+        ("/mirror/foo.tar.gz#/bar.tar.gz", "/mirror/foo.tar.gz"),
+    ),
+)
+def test_local_path(inval, retval):
+    assert download.local_path(inval) == retval
+
+
+def test_copy_local_dry_run(tmp_path, capsys):
+    src = tmp_path / "foo.tar.gz"
+
+    with mock.patch.object(download, "NamedTemporaryFile") as NamedTemporaryFile:
+        download.copy_local(f"file://{src}", where=str(tmp_path / "dest"), dry_run=True)
+
+    NamedTemporaryFile.assert_not_called()
+
+    out, err = capsys.readouterr()
+    assert not err
+    assert out.rstrip() == f"NOT copying '{src}' to '{tmp_path}/dest/foo.tar.gz'"
+
+
+def test_copy_local_missing(tmp_path):
+    with pytest.raises(download.DownloadError, match="Couldn't copy"):
+        download.copy_local(str(tmp_path / "missing.tar.gz"), where=str(tmp_path))
+
+
+def test_copy_local_same_file(tmp_path, capsys):
+    src = tmp_path / "foo.tar.gz"
+    src.write_bytes(b"content")
+
+    download.copy_local(str(src), where=str(tmp_path))
+
+    out, err = capsys.readouterr()
+    assert not out
+
+
+@pytest.mark.parametrize("where", (None, "dest"), ids=("without-where", "with-where"))
+@pytest.mark.parametrize("force", (False, True), ids=("no-force", "force"))
+@pytest.mark.parametrize(
+    "method", ("link", "link-failure", "reflink", "copy_file_range", "copy", "error")
+)
+def test_copy_local(method, force, where, tmp_path):
+    content = b"Some content.\n" * 1000
+    mtime_ns = 10**18
+
+    src = tmp_path / "mirror" / "foo.tar.gz"
+    src.parent.mkdir()
+    src.write_bytes(content)
+    os.utime(src, ns=(mtime_ns, mtime_ns))
+    if method.startswith("link"):
+        src.chmod(0o666 & ~download.umask)
+    else:
+        src.chmod(0o400)
+
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    fpath = dest / "foo.tar.gz"
+    if force:
+        fpath.write_bytes(b"old content")
+
+    if where is None:
+        chdir_ctx = changed_directory(dest)
+    else:
+        where = str(dest)
+        chdir_ctx = nullcontext()
+
+    real_link = os.link
+    real_copy_file_range = os.copy_file_range
+
+    def mock_link(src_path, dst_path):
+        if method == "link-failure" and src_path == str(src):
+            raise PermissionError(1, "Operation not permitted")
+        return real_link(src_path, dst_path)
+
+    def mock_copy_file_range(src_fd, dst_fd, count):
+        if method == "error":
+            raise OSError(errno.EIO, "I/O error")
+        # simulate a cross-file system copy with an old kernel
+        os.write(dst_fd, b"partial")
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    with (
+        mock.patch.object(os, "link", side_effect=mock_link),
+        mock.patch.object(download.fcntl, "ioctl") as ioctl,
+        mock.patch.object(os, "copy_file_range") as copy_file_range,
+        chdir_ctx,
+    ):
+        if method == "reflink":
+            ioctl.side_effect = lambda dst_fd, req, src_fd: os.sendfile(
+                dst_fd, src_fd, 0, len(content)
+            )
+        else:
+            ioctl.side_effect = OSError(errno.EOPNOTSUPP, "Operation not supported")
+        if method == "copy_file_range":
+            copy_file_range.side_effect = real_copy_file_range
+        else:
+            copy_file_range.side_effect = mock_copy_file_range
+
+        if method == "error":
+            with pytest.raises(OSError):
+                download.copy_local(f"file://{src}", where=where, force=force)
+            return
+
+        download.copy_local(f"file://{src}", where=where, force=force)
+
+    assert fpath.read_bytes() == content
+    fpath_stat = fpath.stat()
+    assert fpath_stat.st_mtime_ns == mtime_ns
+    assert fpath_stat.st_mode & 0o7777 == 0o666 & ~download.umask
+    if method == "link":
+        assert os.path.samefile(src, fpath)
+    else:
+        assert not os.path.samefile(src, fpath)
+        assert [p.name for p in dest.iterdir()] == ["foo.tar.gz"]
+
+
+def test_copy_local_exists(tmp_path):
+    src = tmp_path / "foo.tar.gz"
+    src.write_bytes(b"content")
+    src.chmod(0o666 & ~download.umask)
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    (dest / "foo.tar.gz").write_bytes(b"old content")
+
+    with pytest.raises(FileExistsError):
+        download.copy_local(str(src), where=str(dest))
+
+
+@pytest.mark.parametrize("connections", (1, 4))
+@pytest.mark.parametrize("insecure", (False, True), ids=("secure", "insecure"))
+def test_check_urls(insecure, connections, http_server):
+    http_server.files["foo.tar.gz"] = b"x" * 12345
+    http_server.files["bar.patch"] = b"y" * 678
+
+    # a port nobody listens on
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        unused_port = sock.getsockname()[1]
+
+    urls = {
+        "file": http_server.url("/files/foo.tar.gz"),
+        "nohead": http_server.url("/nohead/foo.tar.gz"),
+        "norange": http_server.url("/norange/bar.patch"),
+        "redirect": http_server.url("/redirect/bar.patch"),
+        "missing": http_server.url("/files/missing.tar.gz"),
+        "refused": f"http://127.0.0.1:{unused_port}/foo.tar.gz",
+    }
+
+    results = {
+        result["url"]: result
+        for result in download.check_urls(
+            urls.values(), max_connections=connections, insecure=insecure, timeout=5
+        )
+    }
+
+    assert set(results) == set(urls.values())
+
+    last_modified = datetime.fromtimestamp(http_server.mtime, timezone.utc).isoformat()
+
+    result = results[urls["file"]]
+    assert result["ok"]
+    assert result["status"] == 200
+    assert result["size"] == 12345
+    assert result["last_modified"] == last_modified
+    assert result["redirects"] == 0
+    assert result["method"] == "HEAD"
+    assert result["error"] is None
+    assert result["latency"] > 0
+
+    result = results[urls["nohead"]]
+    assert result["ok"]
+    assert result["status"] == 206
+    assert result["size"] == 12345
+    assert result["method"] == "GET"
+
+    result = results[urls["norange"]]
+    assert result["ok"]
+    assert result["status"] == 200
+    assert result["size"] == 678
+    assert result["method"] == "GET"
+    assert result["error"] is None
+
+    result = results[urls["redirect"]]
+    assert result["ok"]
+    assert result["status"] == 200
+    assert result["size"] == 678
+    assert result["redirects"] == 1
+    assert result["effective_url"] == http_server.url("/files/bar.patch")
+
+    result = results[urls["missing"]]
+    assert not result["ok"]
+    assert result["status"] == 404
+
+    result = results[urls["refused"]]
+    assert not result["ok"]
+    assert result["status"] is None
+    assert result["error"]
+
+
+def test_check_urls_ftp():
+    c = mock.Mock()
+    c.url = c.getinfo.return_value = "ftp://example.com/foo.tar.gz"
+    c.elapsed = 0.0
+    c.total_size = None
+    c.method = "HEAD"
+
+    def mock_getinfo(arg):
+        return {
+            c.TOTAL_TIME: 0.5,
+            c.RESPONSE_CODE: 0,
+            download.CONTENT_LENGTH_INFO: 12345,
+            c.INFO_FILETIME: -1,
+            c.EFFECTIVE_URL: c.url,
+            c.REDIRECT_COUNT: 0,
+        }[arg]
+
+    c.getinfo.side_effect = mock_getinfo
+
+    with (
+        mock.patch.object(download.pycurl, "CurlShare"),
+        mock.patch.object(download.pycurl, "CurlMulti"),
+    ):
+        checker = download._URLChecker()
+
+    result, elapsed = checker._result(c)
+
+    assert result["ok"]
+    assert result["status"] is None
+    assert result["size"] == 12345
+    assert result["last_modified"] is None
+    assert elapsed == 0.5
+
+
+def test_check_urls_aborted(http_server):
+    http_server.files["foo.tar.gz"] = b"x" * 12345
+
+    urls = [http_server.url(f"/files/foo.tar.gz?{i}") for i in range(4)]
+    results = download.check_urls(urls, max_connections=2)
+
+    next(results)
+    # closing the generator while transfers are active cleans them up
+    results.close()
+
+
+class TestTransferCoalescer:
+    @staticmethod
+    def fake_download(url, where=None, dry_run=False, insecure=False, force=False):
+        if dry_run:
+            return
+        if url.endswith("missing.tar.gz"):
+            raise download.DownloadError(f"Couldn't download {url}: 404")
+        fpath = os.path.join(where or os.getcwd(), url.split("/")[-1])
+        with open(fpath, "wb") as fobj:
+            fobj.write(b"content")
+        os.chmod(fpath, 0o666 & ~download.umask)
+
+    @pytest.mark.parametrize("same_dir", (False, True), ids=("different-dirs", "same-dir"))
+    def test_fetch(self, same_dir, tmp_path):
+        url = "https://example.com/foo.tar.gz"
+        coalescer = download.TransferCoalescer()
+
+        in_transfer = threading.Event()
+        finish_transfer = threading.Event()
+
+        def blocking_download(*args, **kwargs):
+            in_transfer.set()
+            finish_transfer.wait()
+            self.fake_download(*args, **kwargs)
+
+        fetch_func = mock.Mock(side_effect=blocking_download)
+
+        dirs = [tmp_path / "a", tmp_path / "a" if same_dir else tmp_path / "b"]
+        for d in dirs:
+            d.mkdir(exist_ok=True)
+
+        first = threading.Thread(
+            target=coalescer.fetch, args=(url, fetch_func), kwargs={"where": str(dirs[0])}
+        )
+        first.start()
+        in_transfer.wait()
+
+        # the second request waits for the transfer in flight
+        second = threading.Thread(
+            target=coalescer.fetch, args=(url, fetch_func), kwargs={"where": str(dirs[1])}
+        )
+        second.start()
+        finish_transfer.set()
+        first.join()
+        second.join()
+
+        fetch_func.assert_called_once_with(url, where=str(dirs[0]), dry_run=False, force=False)
+        assert os.path.samefile(dirs[0] / "foo.tar.gz", dirs[1] / "foo.tar.gz")
+
+        # later requests don't fetch the file again
+        with changed_directory(dirs[1]):
+            coalescer.fetch(url, fetch_func)
+        fetch_func.assert_called_once()
+
+    def test_fetch_relative_where(self, tmp_path):
+        url = "https://example.com/foo.tar.gz"
+        coalescer = download.TransferCoalescer()
+        fetch_func = mock.Mock(side_effect=self.fake_download)
+        (tmp_path / "a").mkdir()
+        (tmp_path / "b").mkdir()
+
+        with changed_directory(tmp_path):
+            coalescer.fetch(url, fetch_func, where="a")
+            coalescer.fetch(url, fetch_func, where="b")
+
+        fetch_func.assert_called_once_with(url, where="a", dry_run=False, force=False)
+        assert os.path.samefile(tmp_path / "a" / "foo.tar.gz", tmp_path / "b" / "foo.tar.gz")
+
+    def test_fetch_failure(self, tmp_path):
+        url = "https://example.com/missing.tar.gz"
+        coalescer = download.TransferCoalescer()
+        fetch_func = mock.Mock(side_effect=self.fake_download)
+
+        for _ in range(2):
+            with pytest.raises(download.DownloadError):
+                coalescer.fetch(url, fetch_func, where=str(tmp_path))
+
+        # failed transfers are attempted again
+        assert fetch_func.call_count == 2
+
+    def test_fetch_dry_run(self, tmp_path):
+        url = "https://example.com/foo.tar.gz"
+        coalescer = download.TransferCoalescer()
+        fetch_func = mock.Mock(side_effect=self.fake_download)
+
+        for _ in range(2):
+            coalescer.fetch(url, fetch_func, where=str(tmp_path), dry_run=True)
+
+        assert fetch_func.call_count == 2
+        assert not list(tmp_path.iterdir())
+
+
+class TestTargetLock:
+    HOLD_LOCK = """
+import fcntl, os, socket, sys
+fd = os.open(sys.argv[1], os.O_RDWR | os.O_CREAT, 0o666)
+fcntl.lockf(fd, fcntl.LOCK_EX)
+os.write(fd, f"{sys.argv[2] or os.getpid()} {socket.gethostname()}\\n".encode())
+print("locked", flush=True)
+sys.stdin.read()
+if sys.argv[3]:
+    with open(sys.argv[3], "w") as fobj:
+        fobj.write("fetched")
+"""
+
+    @staticmethod
+    def hold_lock(lock_path, pid="", fpath=""):
+        """Hold a lock in another process until its stdin is closed."""
+        proc = subprocess.Popen(
+            (sys.executable, "-c", TestTargetLock.HOLD_LOCK, str(lock_path), str(pid), str(fpath)),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        assert proc.stdout.readline() == "locked\n"
+        return proc
+
+    def test_lock(self, tmp_path):
+        fpath = tmp_path / "foo.tar.gz"
+        lock_path = tmp_path / ".foo.tar.gz.rpmspectool-lock"
+
+        with download.TargetLock(str(fpath)) as lock:
+            assert not lock.waited
+            assert lock_path.read_text() == f"{os.getpid()} {socket.gethostname()}\n"
+
+        assert not lock_path.exists()
+
+    def test_lock_file_removed(self, tmp_path):
+        lock_path = tmp_path / ".foo.tar.gz.rpmspectool-lock"
+
+        with download.TargetLock(str(tmp_path / "foo.tar.gz")) as lock:
+            lock_path.unlink()
+            assert not lock._is_current(lock.fd)
+
+        assert lock.fd is None
+
+    def test_stale_lock_replaced(self, tmp_path):
+        lock = download.TargetLock(str(tmp_path / "foo.tar.gz"))
+
+        # the stale lock file was replaced by another process in the meantime
+        with (
+            mock.patch.object(
+                download.fcntl, "lockf", side_effect=(OSError(errno.EAGAIN, "Locked"), None)
+            ),
+            mock.patch.object(lock, "_holder", return_value=(12345, lock.hostname)),
+            mock.patch.object(download, "_process_alive", return_value=False),
+            mock.patch.object(lock, "_is_current", side_effect=(False, True)),
+            mock.patch.object(download.os, "unlink") as unlink,
+        ):
+            with lock:
+                unlink.assert_not_called()
+
+    @pytest.mark.parametrize("fetcher", ("download", "download-extract", "copy_local"))
+    def test_wait_and_reuse(self, fetcher, tmp_path, capsys):
+        fpath = tmp_path / "foo.tar.gz"
+        src = tmp_path / "src" / "foo.tar.gz"
+        src.parent.mkdir()
+        src.write_text("source")
+        proc = self.hold_lock(tmp_path / ".foo.tar.gz.rpmspectool-lock", fpath=fpath)
+
+        def finish():
+            time.sleep(3 * download.LOCK_POLL_INTERVAL)
+            proc.stdin.close()
+
+        finisher = threading.Thread(target=finish)
+        finisher.start()
+
+        with mock.patch.object(download.pycurl, "Curl") as Curl:
+            if fetcher.startswith("download"):
+                download.download(
+                    "https://example.com/foo.tar.gz",
+                    where=str(tmp_path),
+                    extract_dir=str(tmp_path / "extracted") if "extract" in fetcher else None,
+                )
+            else:
+                download.copy_local(str(src), where=str(tmp_path))
+
+        finisher.join()
+        proc.wait()
+
+        # the file fetched by the other process is used
+        Curl.assert_not_called()
+        assert fpath.read_text() == "fetched"
+        stdout = capsys.readouterr().out
+        assert f"Waiting for process {proc.pid} on {socket.gethostname()}" in stdout
+        assert f"Using '{fpath}' fetched by another process" in stdout
+        # the lock file left behind by the other process is cleaned up, the
+        # fetched file isn't an archive and isn't extracted
+        assert sorted(os.listdir(tmp_path)) == ["foo.tar.gz", "src"]
+
+    def test_wait_other_failed(self, tmp_path):
+        fpath = tmp_path / "foo.tar.gz"
+        proc = self.hold_lock(tmp_path / ".foo.tar.gz.rpmspectool-lock")
+        threading.Timer(2 * download.LOCK_POLL_INTERVAL, proc.stdin.close).start()
+
+        with download.TargetLock(str(fpath)) as lock:
+            # the other process didn't produce the file, fetching is up to us
+            assert lock.waited
+            assert not fpath.exists()
+
+        proc.wait()
+
+    def test_stale_lock(self, tmp_path, capsys):
+        fpath = tmp_path / "foo.tar.gz"
+        lock_path = tmp_path / ".foo.tar.gz.rpmspectool-lock"
+        dead = subprocess.Popen(("true",))
+        dead.wait()
+        # e.g. a lock kept on an NFS server for a process which crashed
+        proc = self.hold_lock(lock_path, pid=dead.pid)
+
+        try:
+            with download.TargetLock(str(fpath)) as lock:
+                assert not lock.waited
+                assert lock_path.read_text().startswith(f"{os.getpid()} ")
+        finally:
+            proc.stdin.close()
+            proc.wait()
+
+        assert "Waiting" not in capsys.readouterr().out
+
+    @pytest.mark.parametrize(
+        "pid, kill_error, expected",
+        ((1, PermissionError(), True), (2, ProcessLookupError(), False), (3, None, True)),
+    )
+    def test_process_alive(self, pid, kill_error, expected):
+        with mock.patch.object(download.os, "kill", side_effect=kill_error) as kill:
+            assert download._process_alive(pid) == expected
+        kill.assert_called_once_with(pid, 0)
+
+    def test_unreadable_holder(self, tmp_path):
+        lock_path = tmp_path / ".foo.tar.gz.rpmspectool-lock"
+        lock_path.write_bytes(b"\xff garbage")
+        with open(lock_path, "rb") as fobj:
+            assert download.TargetLock(str(tmp_path / "foo.tar.gz"))._holder(fobj.fileno()) == (
+                None,
+                None,
+            )
+
+    @pytest.mark.parametrize("where", ("os.open", "fcntl.lockf"))
+    def test_lock_unsupported(self, where, tmp_path, caplog):
+        caplog.set_level("DEBUG")
+        module, func = where.split(".")
+        target = download.os if module == "os" else download.fcntl
+
+        with mock.patch.object(target, func, side_effect=OSError(errno.ENOLCK, "No locks")):
+            with download.TargetLock(str(tmp_path / "foo.tar.gz")) as lock:
+                # fetching goes ahead without lock
+                assert lock.fd is None
+
+        assert "Couldn't lock" in caplog.text
+
+    def test_lock_file_replaced(self, tmp_path):
+        lock = download.TargetLock(str(tmp_path / "foo.tar.gz"))
+
+        # another process removed the lock file after it was opened
+        with mock.patch.object(lock, "_is_current", side_effect=(False, True)) as is_current:
+            with lock:
+                assert lock.fd is not None
+
+        assert is_current.call_count == 2
+
+    def test_interrupted(self, tmp_path):
+        proc = self.hold_lock(tmp_path / ".foo.tar.gz.rpmspectool-lock")
+        lock = download.TargetLock(str(tmp_path / "foo.tar.gz"))
+
+        try:
+            with (
+                mock.patch.object(download.time, "sleep", side_effect=KeyboardInterrupt()),
+                pytest.raises(KeyboardInterrupt),
+            ):
+                with lock:
+                    pass
+        finally:
+            proc.stdin.close()
+            proc.wait()
+
+        # other threads can take the lock
+        assert lock._thread_lock.acquire(blocking=False)
+        lock._thread_lock.release()
@@ -0,0 +1,139 @@
+import io
+import os
+import shutil
+import subprocess
+import tarfile
+import zipfile
+from unittest import mock
+
+import pytest
+
+from rpmspectool import extract
+
+
+def make_tar(mode="w:gz", members=(("foo-1/README", b"Read me!"),)):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=mode) as tar:
+        for name, content in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buf.getvalue()
+
+
+def make_zip():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zip:
+        zip.writestr("foo-1/README", b"Read me!")
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize(
+    "fname, expected",
+    (
+        ("foo-1.tar.gz", "gz"),
+        ("FOO-1.TGZ", "gz"),
+        ("foo-1.tar.bz2", "bz2"),
+        ("foo-1.tar.xz", "xz"),
+        ("foo-1.tar", ""),
+        ("foo-1.zip", None),
+        ("fix.patch", None),
+    ),
+)
+def test_stream_compression(fname, expected):
+    assert extract.stream_compression(fname) == expected
+
+
+@pytest.mark.parametrize("kind", ("tar", "zip", "patch"))
+def test_extract_archive(kind, tmp_path, capsys):
+    fpath = tmp_path / "archive"
+    fpath.write_bytes(
+        {"tar": make_tar("w:xz"), "zip": make_zip(), "patch": b"--- a/foo\n+++ b/foo\n"}[kind]
+    )
+    extract_dir = tmp_path / "extracted"
+
+    result = extract.extract_archive(str(fpath), str(extract_dir))
+
+    if kind == "patch":
+        assert not result
+        assert not extract_dir.exists()
+    else:
+        assert result
+        assert (extract_dir / "foo-1" / "README").read_bytes() == b"Read me!"
+        assert f"Extracting '{fpath}'" in capsys.readouterr().out
+
+
+def test_extract_archive_unsafe(tmp_path):
+    fpath = tmp_path / "evil.tar"
+    fpath.write_bytes(make_tar("w", (("../outside", b"boo"),)))
+
+    with pytest.raises(extract.ExtractError, match="Couldn't extract .*evil.tar"):
+        extract.extract_archive(str(fpath), str(tmp_path / "extracted"))
+
+    assert not (tmp_path / "outside").exists()
+
+
+@pytest.mark.skipif(not shutil.which("zstd"), reason="needs the zstd program")
+@pytest.mark.parametrize("damaged", ("no", "archive", "trailing-data"))
+def test_extract_archive_zstd(damaged, tmp_path, capsys):
+    fpath = tmp_path / "foo-1.tar.zst"
+    # archives can have padding following them
+    data = make_tar("w") + bytes(50000) if damaged != "archive" else b"not a tar archive"
+    data = subprocess.run(("zstd", "-cq"), input=data, stdout=subprocess.PIPE, check=True).stdout
+    if damaged == "trailing-data":
+        data += b"boo"
+    fpath.write_bytes(data)
+    extract_dir = tmp_path / "extracted"
+
+    with mock.patch.object(extract, "ZSTD_SUPPORTED", False):
+        if damaged == "no":
+            assert extract.extract_archive(str(fpath), str(extract_dir))
+        else:
+            with pytest.raises(extract.ExtractError, match="Couldn't extract .*foo-1.tar.zst"):
+                extract.extract_archive(str(fpath), str(extract_dir))
+
+    assert f"Extracting '{fpath}'" in capsys.readouterr().out
+    if damaged != "archive":
+        assert (extract_dir / "foo-1" / "README").read_bytes() == b"Read me!"
+
+
+def test_extract_archive_zstd_missing(tmp_path):
+    fpath = tmp_path / "foo-1.tar.zst"
+    fpath.write_bytes(b"")
+
+    with (
+        mock.patch.object(extract, "ZSTD_SUPPORTED", False),
+        mock.patch.object(
+            extract.subprocess,
+            "Popen",
+            side_effect=FileNotFoundError(2, "No such file or directory"),
+        ),
+        pytest.raises(extract.ExtractError, match="zstd isn't available"),
+    ):
+        extract.extract_archive(str(fpath), str(tmp_path / "extracted"))
+
+
+class TestStreamExtractor:
+    def feed(self, data, extract_dir, chunk_size=1000):
+        extractor = extract.StreamExtractor("foo-1.tar.gz", "gz", str(extract_dir))
+        for i in range(0, len(data), chunk_size):
+            extractor.write(data[i : i + chunk_size])
+        extractor.finish()
+
+    def test_extract(self, tmp_path):
+        # large enough to fill the pipe buffer, and followed by padding
+        members = [(f"foo-1/file{i}", os.urandom(100_000)) for i in range(5)]
+        data = make_tar("w:gz", members) + bytes(200_000)
+
+        self.feed(data, tmp_path / "extracted")
+
+        for name, content in members:
+            assert (tmp_path / "extracted" / name).read_bytes() == content
+
+    @pytest.mark.parametrize("chunk_size", (1000, 1 << 20))
+    def test_extract_failure(self, chunk_size, tmp_path):
+        # a valid gzip header followed by garbage
+        data = make_tar("w:gz")[:20] + os.urandom(500_000)
+
+        with pytest.raises(extract.ExtractError, match="Couldn't extract foo-1.tar.gz: "):
+            self.feed(data, tmp_path / "extracted", chunk_size=chunk_size)
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+
+import pytest
+
+from rpmspectool import lockfile
+
+CONTENT = b"content"
+CONTENT_SHA512 = hashlib.sha512(CONTENT).hexdigest()
+
+
+def make_record(specfile="foo.spec", kind="source", index=0, filename="foo-1.tar.gz"):
+    return {
+        "specfile": specfile,
+        "kind": kind,
+        "index": index,
+        "url": f"https://example.com/{filename}",
+        "filename": filename,
+        "srcdir": None,
+    }
+
+
+@pytest.mark.parametrize("present", (None, "first", "second"))
+def test_lock_entry(present, tmp_path):
+    dirs = [tmp_path / "first", tmp_path / "second"]
+    for d in dirs:
+        d.mkdir()
+    if present:
+        path = tmp_path / present / "foo-1.tar.gz"
+        path.write_bytes(CONTENT)
+        os.utime(path, (10**9, 10**9))
+
+    entry = lockfile.lock_entry(make_record(), [None] + [str(d) for d in dirs])
+
+    assert entry == make_record() | (
+        {"size": len(CONTENT), "mtime": 10**9, "sha512": CONTENT_SHA512}
+        if present
+        else {"size": None, "mtime": None, "sha512": None}
+    )
+
+
+def test_write_read_lockfile(tmp_path):
+    path = tmp_path / "sources.lock"
+    entries = [
+        make_record(kind="patch", index=0, filename="fix.patch"),
+        make_record(index=10),
+        make_record(index=2),
+        make_record(specfile="bar.spec"),
+    ]
+
+    lockfile.write_lockfile(str(path), entries)
+
+    with path.open() as fobj:
+        data = json.load(fobj)
+    assert data["version"] == lockfile.LOCKFILE_VERSION
+    assert lockfile.read_lockfile(str(path)) == [entries[3], entries[2], entries[1], entries[0]]
+
+
+@pytest.mark.parametrize(
+    "content, match",
+    (
+        (None, "Can’t read lockfile"),
+        ("{", "Can’t parse lockfile"),
+        ('{"version": 99, "entries": []}', "Unsupported lockfile"),
+        ("[]", "Unsupported lockfile"),
+        ('{"version": 1, "entries": [{"url": "foo"}]}', "Invalid entries"),
+        ('{"version": 1}', "Invalid entries"),
+    ),
+)
+def test_read_lockfile_error(content, match, tmp_path):
+    path = tmp_path / "sources.lock"
+    if content is not None:
+        path.write_text(content)
+
+    with pytest.raises(lockfile.LockfileError, match=match):
+        lockfile.read_lockfile(str(path))
+
+
+@pytest.mark.parametrize(
+    "size, sha512, content, match",
+    (
+        (len(CONTENT), CONTENT_SHA512, CONTENT, None),
+        (None, None, CONTENT, None),
+        (len(CONTENT), CONTENT_SHA512, b"other content", "size 13 doesn’t match lockfile"),
+        (None, CONTENT_SHA512, b"CONTENT", "SHA512 doesn’t match"),
+        (len(CONTENT), CONTENT_SHA512, None, "Can’t verify"),
+    ),
+)
+def test_verify_file(size, sha512, content, match, tmp_path):
+    path = tmp_path / "foo-1.tar.gz"
+    if content is not None:
+        path.write_bytes(content)
+
+    error = lockfile.verify_file({"size": size, "sha512": sha512}, str(path))
+
+    if match is None:
+        assert error is None
+    else:
+        assert match in error
@@ -0,0 +1,107 @@
+import threading
+import time
+
+import pytest
+
+from rpmspectool import pipeline
+
+
+class TestPipeline:
+    @pytest.mark.parametrize(
+        "producers, consumers", ((1, 1), (3, 5)), ids=("sequential", "parallel")
+    )
+    def test_run(self, producers, consumers):
+        consumed = []
+        lock = threading.Lock()
+
+        def produce(input):
+            for i in range(input):
+                yield (input, i)
+
+        def consume(item):
+            with lock:
+                consumed.append(item)
+
+        pipe = pipeline.Pipeline(produce, consume, producers=producers, consumers=consumers)
+        pipe.run(range(10))
+
+        expected = [(input, i) for input in range(10) for i in range(input)]
+        if producers == consumers == 1:
+            assert consumed == expected
+        else:
+            assert sorted(consumed) == expected
+
+    def test_run_overlaps_stages(self):
+        produced_all = threading.Event()
+        overlapped = []
+
+        def produce(input):
+            yield input
+            if input == 1:
+                produced_all.set()
+
+        def consume(item):
+            overlapped.append(not produced_all.is_set())
+            if item == 0:
+                # the first item is consumed while the second input is processed
+                time.sleep(2 * pipeline.POLL_INTERVAL)
+
+        pipe = pipeline.Pipeline(produce, consume, queue_size=1)
+        pipe.run(range(2))
+
+        assert overlapped[0]
+
+    def test_run_priority(self):
+        produced_all = threading.Event()
+        consumed = []
+
+        def produce(input):
+            yield from input
+            produced_all.set()
+
+        def consume(item):
+            produced_all.wait()
+            consumed.append(item)
+
+        pipe = pipeline.Pipeline(produce, consume, priority=lambda item: -item)
+        pipe.run([[3, 1, 4, 1, 5, 9, 2, 6]])
+
+        # apart from the first, which is consumed right away, the largest items come first
+        assert consumed[1:] == sorted(consumed[1:], reverse=True)
+        assert sorted(consumed) == [1, 1, 2, 3, 4, 5, 6, 9]
+
+    @pytest.mark.parametrize("failing_stage", ("produce", "consume"))
+    def test_run_exception(self, failing_stage):
+        consumed = []
+
+        def produce(input):
+            if failing_stage == "produce" and input == 1:
+                raise ValueError("Boo!")
+            yield from range(100)
+
+        def consume(item):
+            if failing_stage == "consume" and item == 1:
+                raise ValueError("Boo!")
+            consumed.append(item)
+            time.sleep(0.001)
+
+        pipe = pipeline.Pipeline(produce, consume, producers=2, consumers=2)
+
+        with pytest.raises(ValueError, match="Boo!"):
+            pipe.run(range(10))
+
+        assert len(consumed) < 1000
+
+    def test_run_multiple_exceptions(self):
+        barrier = threading.Barrier(2)
+
+        def produce(input):
+            barrier.wait()
+            raise ValueError(input)
+
+        pipe = pipeline.Pipeline(produce, lambda item: None, producers=2)
+
+        with pytest.raises(ValueError) as excinfo:
+            pipe.run(range(2))
+
+        assert excinfo.value.args[0] in (0, 1)
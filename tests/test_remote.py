@@ -0,0 +1,182 @@
+import json
+import os
+from unittest import mock
+
+import pycurl
+import pytest
+
+from rpmspectool import remote
+
+SPEC = b"Name: foo\nSource0: https://example.com/foo-1.tar.gz\n"
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    (
+        ("https://example.com/rpms/foo/raw/rawhide/f/foo.spec", "foo.spec"),
+        ("https://example.com/cgit/foo.git/plain/foo%2Dbar.spec?h=f40", "foo-bar.spec"),
+        ("https://example.com/", "remote.spec"),
+    ),
+)
+def test_spec_filename(url, expected):
+    assert remote.spec_filename(url) == expected
+
+
+def entry_files(spec_cache, url):
+    return sorted(os.listdir(spec_cache._entry_path(url)))
+
+
+class TestRemoteSpecCache:
+    def test_fetch(self, http_server, tmp_path):
+        http_server.files["foo.spec"] = SPEC
+        url = http_server.url("/files/foo.spec")
+        spec_cache = remote.RemoteSpecCache(str(tmp_path / "specs"))
+
+        paths, errors = spec_cache.fetch([url, url])
+
+        assert not errors
+        assert list(paths) == [url]
+        assert os.path.basename(paths[url]) == "foo.spec"
+        with open(paths[url], "rb") as fobj:
+            assert fobj.read() == SPEC
+        # the same URL is only fetched once
+        assert len(http_server.requests) == 1
+        assert "If-None-Match" not in http_server.requests[0][2]
+
+        # unchanged spec files are revalidated, not transferred again
+        with mock.patch.object(spec_cache, "_store") as store:
+            assert spec_cache.fetch([url]) == ({url: paths[url]}, {})
+        store.assert_not_called()
+        assert (
+            http_server.requests[-1][2]["If-None-Match"] == spec_cache.cached_path(url)[1]["etag"]
+        )
+        # the response is downloaded into a temporary file, which is removed
+        assert entry_files(spec_cache, url) == ["foo.spec"]
+
+        # changed ones are
+        http_server.files["foo.spec"] = SPEC + b"Patch0: fix.patch\n"
+        new_paths, errors = spec_cache.fetch([url])
+        assert new_paths == paths
+        with open(paths[url], "rb") as fobj:
+            assert fobj.read() == SPEC + b"Patch0: fix.patch\n"
+
+    def test_fetch_last_modified(self, http_server, tmp_path):
+        """Servers which don't send an ETag are asked if the file was modified since."""
+        http_server.files["foo.spec"] = SPEC
+        url = http_server.url("/files/foo.spec")
+        spec_cache = remote.RemoteSpecCache(str(tmp_path / "specs"))
+        spec_cache.fetch([url])
+
+        meta_path = f"{spec_cache._entry_path(url)}.json"
+        with open(meta_path) as fobj:
+            data = json.load(fobj)
+        data["validators"]["etag"] = None
+        with open(meta_path, "w") as fobj:
+            json.dump(data, fobj)
+
+        paths, errors = spec_cache.fetch([url])
+
+        assert not errors
+        headers = http_server.requests[-1][2]
+        assert "If-None-Match" not in headers
+        assert headers["If-Modified-Since"] == data["validators"]["last-modified"]
+        assert http_server.requests[-1][1] == "/files/foo.spec"
+
+    def test_fetch_redirect(self, http_server, tmp_path):
+        http_server.files["foo.spec"] = SPEC
+        url = http_server.url("/redirect/foo.spec")
+        spec_cache = remote.RemoteSpecCache(str(tmp_path / "specs"))
+
+        paths, errors = spec_cache.fetch([url])
+
+        assert not errors
+        # the validators are those of the file redirected to
+        _, validators = spec_cache.cached_path(url)
+        assert validators["etag"] and validators["last-modified"]
+
+    @pytest.mark.parametrize("kind", ("http-status", "connect", "store", "mkdir"))
+    def test_fetch_error(self, kind, http_server, tmp_path):
+        http_server.files["foo.spec"] = SPEC
+        if kind == "http-status":
+            url = http_server.url("/files/missing.spec")
+        elif kind == "connect":
+            url = "http://[::1]:1/foo.spec"
+        else:
+            url = http_server.url("/files/foo.spec")
+        spec_cache = remote.RemoteSpecCache(str(tmp_path / "specs"))
+
+        with (
+            mock.patch.object(
+                remote,
+                "write_json_atomically",
+                side_effect=PermissionError(13, "Permission denied"),
+            ),
+            mock.patch.object(
+                remote.os,
+                "makedirs",
+                side_effect=PermissionError(13, "Permission denied") if kind == "mkdir" else None,
+                wraps=os.makedirs,
+            ),
+        ):
+            paths, errors = spec_cache.fetch([url])
+
+        assert not paths
+        if kind != "mkdir":
+            assert all(name == "foo.spec" for name in entry_files(spec_cache, url))
+        if kind == "http-status":
+            assert errors == {url: f"Couldn't download {url}: 404"}
+        elif kind == "connect":
+            assert errors[url].startswith(f"Couldn't download {url}: ")
+        else:
+            assert errors == {url: f"Couldn't store {url}: Permission denied"}
+            if kind == "mkdir":
+                # nothing is fetched if it can't be stored
+                assert http_server.requests == []
+
+    def test_fetch_interrupted(self, http_server, tmp_path):
+        http_server.files["foo.spec"] = SPEC
+        url = http_server.url("/files/foo.spec")
+        spec_cache = remote.RemoteSpecCache(str(tmp_path / "specs"))
+
+        with (
+            mock.patch.object(pycurl, "CurlMulti") as CurlMulti,
+            pytest.raises(KeyboardInterrupt),
+        ):
+            CurlMulti.return_value.perform.side_effect = KeyboardInterrupt
+            spec_cache.fetch([url])
+
+        CurlMulti.return_value.remove_handle.assert_called_once()
+        CurlMulti.return_value.close.assert_called_once_with()
+        assert entry_files(spec_cache, url) == []
+
+    @pytest.mark.parametrize("damage", ("metadata", "content"))
+    def test_cached_path_damaged(self, damage, http_server, tmp_path):
+        http_server.files["foo.spec"] = SPEC
+        url = http_server.url("/files/foo.spec")
+        spec_cache = remote.RemoteSpecCache(str(tmp_path / "specs"))
+        paths, _ = spec_cache.fetch([url])
+
+        if damage == "metadata":
+            with open(f"{spec_cache._entry_path(url)}.json", "w") as fobj:
+                fobj.write("[]")
+        else:
+            os.unlink(paths[url])
+
+        assert spec_cache.cached_path(url) == (None, {})
+
+        # the spec file is fetched unconditionally
+        assert spec_cache.fetch([url]) == (paths, {})
+        assert "If-None-Match" not in http_server.requests[-1][2]
+
+    def test_fetch_not_http(self, tmp_path):
+        """Other protocols like FTP have no HTTP status, fetching the file is enough."""
+        spec = tmp_path / "foo.spec"
+        spec.write_bytes(SPEC)
+        url = f"file://{spec}"
+        spec_cache = remote.RemoteSpecCache(str(tmp_path / "specs"))
+
+        paths, errors = spec_cache.fetch([url], insecure=True)
+
+        assert not errors
+        with open(paths[url], "rb") as fobj:
+            assert fobj.read() == SPEC
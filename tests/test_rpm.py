@@ -1,3 +1,5 @@
+import os
+import subprocess
 from pathlib import Path
 from unittest import mock
 
@@ -44,12 +46,13 @@ class TestRPMSpecHandler:
         obj.in_specfile.close()
         obj.out_specfile.close()
 
+    @pytest.mark.parametrize("strategy", rpm.EVAL_STRATEGIES)
     @pytest.mark.parametrize(
         "with_definitions", (False, True), ids=("without-definitions", "with-definitions")
     )
     @pytest.mark.parametrize("with_quirk", (False, True), ids=("without-quirk", "with-quirk"))
     @pytest.mark.parametrize("spec, expected", get_test_data())
-    def test_eval_specfile(self, spec, expected, with_quirk, with_definitions, tmp_path):
+    def test_eval_specfile(self, spec, expected, with_quirk, with_definitions, strategy, tmp_path):
         in_specfile = str(spec)
         out_specfile_path = tmp_path / "out.spec"
         out_specfile = str(out_specfile_path)
@@ -59,13 +62,15 @@ class TestRPMSpecHandler:
         else:
             definitions = ()
 
-        handler = rpm.RPMSpecHandler(str(tmp_path), in_specfile, out_specfile)
+        handler = rpm.RPMSpecHandler(str(tmp_path), in_specfile, out_specfile, strategy=strategy)
         with mock.patch.object(
             rpm.RPMSpecHandler, "_get_need_conditionals_quirk"
         ) as _get_need_conditionals_quirk:
             _get_need_conditionals_quirk.return_value = with_quirk
             result = handler.eval_specfile(definitions=definitions)
 
+        assert result["srcdir"]
+
         result_str = ""
 
         for key, kind in (("sources", "Source"), ("patches", "Patch")):
@@ -75,6 +80,52 @@ class TestRPMSpecHandler:
         with expected.open("r") as expected_file:
             assert result_str == expected_file.read()
 
+    @pytest.mark.parametrize("strategy", rpm.EVAL_STRATEGIES)
+    def test_write_preamble(self, strategy, tmp_path):
+        in_spec = tmp_path / "in.spec"
+        in_spec.write_text("Name: foo\nSource: foo.tar.gz\n%prep\n%autosetup\n")
+        out_spec = tmp_path / "out.spec"
+
+        handler = rpm.RPMSpecHandler(str(tmp_path), str(in_spec), str(out_spec), strategy=strategy)
+        with mock.patch.object(rpm.RPMSpecHandler, "_get_need_conditionals_quirk") as quirk:
+            quirk.return_value = False
+            handler.write_preamble()
+
+        content = out_spec.read_bytes()
+        if strategy == "lua":
+            # the preamble is only copied for rpmbuild to parse it
+            assert content.count(b"Source: foo.tar.gz") == 1
+            assert content.endswith(b"%prep\n" + rpm.LUA_EMIT_RECORDS)
+            # Lua gets escapes, it doesn't allow line breaks in strings
+            assert rb'"\t", kind, "\t", num, "\t", url, "\n")' in content
+            for line in content.partition(b"%prep\n")[2].splitlines():
+                assert line.count(b'"') % 2 == 0
+        else:
+            assert content.count(b"Source: foo.tar.gz") == 2
+            assert b"cat << EOF" in content
+
+    def test_parse_lua_output(self, tmp_path):
+        handler = rpm.RPMSpecHandler(
+            str(tmp_path), "/dev/null", str(tmp_path / "out.spec"), strategy="lua"
+        )
+        handler.in_specfile.close()
+        handler.out_specfile.close()
+
+        stdout = (
+            b"+ umask 022\n"
+            b"@rpmspectool@\tsource\t0\thttps://example.com/foo-1.tar.gz#/foo.tar.gz\n"
+            b"@rpmspectool@\tsource\t10\tfoo.conf\n"
+            b"Source1: not a record\n"
+            b"@rpmspectool@\tpatch\t3\tfix\ttabs.patch\n"
+            b"@rpmspectool@\tsrcdir\t\t/home/user/rpmbuild/SOURCES\n"
+        )
+
+        assert handler.parse_output(stdout) == {
+            "sources": {0: "https://example.com/foo-1.tar.gz#/foo.tar.gz", 10: "foo.conf"},
+            "patches": {3: "fix\ttabs.patch"},
+            "srcdir": "/home/user/rpmbuild/SOURCES",
+        }
+
     def test_eval_broken_specfile(self, tmp_path):
         in_specfile = "/dev/null"
         out_specfile_path = tmp_path / "out.spec"
@@ -104,3 +155,201 @@ class TestRPMSpecHandler:
             rpm_pipe.stdout.read.return_value = b"0" if needs_quirk else b"1"
 
             assert handler.need_conditionals_quirk == needs_quirk
+
+
+def make_handler(tmp_path, spec, strategy="heredoc"):
+    out_dir = tmp_path / "out" / spec.name
+    out_dir.mkdir(parents=True)
+    return rpm.RPMSpecHandler(str(tmp_path), str(spec), str(out_dir / "out.spec"), strategy)
+
+
+def test_split_batch_output():
+    stdout = (
+        b"@rpmspectool-spec@ begin 0\nSource0: a\n@rpmspectool-spec@ end 0\n"
+        b"@rpmspectool-spec@ begin 1\nSource0: b\n"
+        b"@rpmspectool-spec@ end 2\n"
+        b"@rpmspectool-spec@ begin 12\n@rpmspectool-spec@ end 12\n"
+    )
+
+    assert rpm.split_batch_output(stdout) == {0: b"\nSource0: a\n", 12: b"\n"}
+
+
+@pytest.mark.parametrize("strategy", rpm.EVAL_STRATEGIES)
+def test_eval_specfiles(strategy, tmp_path):
+    specs = [TEST_DATA / "test1.spec", TEST_DATA / "test2.spec"]
+    expected = [make_handler(tmp_path / "single", spec, strategy).eval_specfile() for spec in specs]
+
+    broken = tmp_path / "broken.spec"
+    broken.write_text("")
+    handlers = [make_handler(tmp_path, spec, strategy) for spec in (specs[0], broken, specs[1])]
+
+    with (
+        mock.patch.object(rpm.RPMSpecHandler, "_get_need_conditionals_quirk", return_value=False),
+        mock.patch.object(
+            rpm.RPMSpecHandler,
+            "rpm_macro_values",
+            autospec=True,
+            side_effect=lambda self: dict.fromkeys(self.rpm_cmd_macros, b"/macro/value"),
+        ) as rpm_macro_values,
+        mock.patch.object(
+            rpm.RPMSpecHandler, "_rpmbuild", autospec=True, side_effect=rpm.RPMSpecHandler._rpmbuild
+        ) as _rpmbuild,
+    ):
+        results = rpm.eval_specfiles(handlers)
+
+    # macro values are only looked up once
+    rpm_macro_values.assert_called_once()
+    # one run for all, the failing spec file alone
+    assert len(_rpmbuild.call_args_list[0].args[1]) == 3
+    assert len(_rpmbuild.call_args_list[1].args[1]) == 1
+    assert _rpmbuild.call_args_list[1].args[1] == [handlers[1].out_specfile_path]
+
+    for result, expected_result in zip((results[0], results[2]), expected):
+        assert result["sources"] == expected_result["sources"]
+        assert result["patches"] == expected_result["patches"]
+    assert isinstance(results[1], rpm.RPMSpecEvalError)
+    assert results[1].args[0] == handlers[1].out_specfile_path
+
+
+def test_eval_specfiles_stop_on_error(tmp_path):
+    """rpmbuild stopping at the failing spec file."""
+    specs = []
+    for name in ("a", "b", "c", "d"):
+        spec = tmp_path / f"{name}.spec"
+        spec.write_text(f"Name: {name}\nSource: {name}.tar.gz\n")
+        specs.append(spec)
+    handlers = [make_handler(tmp_path, spec) for spec in specs]
+    runs = []
+
+    def _rpmbuild(self, specpaths):
+        runs.append([os.path.basename(os.path.dirname(p)) for p in specpaths])
+        stdout = b""
+        for path in specpaths:
+            name = os.path.basename(os.path.dirname(path))
+            if name == "b.spec":
+                return 1, stdout, b"error: b is broken\n"
+            batch_id = [h.out_specfile_path for h in handlers].index(path)
+            stdout += (
+                f"@rpmspectool-spec@ begin {batch_id}\nSource0: {name[0]}.tar.gz\n"
+                + f"SrcDir: /src\n@rpmspectool-spec@ end {batch_id}\n"
+            ).encode("utf-8")
+        return 0, stdout, b""
+
+    with (
+        mock.patch.object(rpm.RPMSpecHandler, "_get_need_conditionals_quirk", return_value=False),
+        mock.patch.object(rpm.RPMSpecHandler, "rpm_macro_values", return_value={}),
+        mock.patch.object(rpm.RPMSpecHandler, "write_rpm_macros"),
+        mock.patch.object(rpm.RPMSpecHandler, "_rpmbuild", new=_rpmbuild),
+    ):
+        results = rpm.eval_specfiles(handlers)
+
+    assert runs == [
+        ["a.spec", "b.spec", "c.spec", "d.spec"],
+        ["b.spec"],
+        ["c.spec", "d.spec"],
+    ]
+    assert results[0] == {"sources": {0: "a.tar.gz"}, "srcdir": "/src"}
+    assert results[1].args[1:] == (1, b"error: b is broken\n")
+    assert results[3] == {"sources": {0: "d.tar.gz"}, "srcdir": "/src"}
+
+
+@pytest.mark.parametrize("outcome", ("ok", "error", "empty"))
+def test_eval_specfiles_single(outcome, tmp_path):
+    handler = mock.Mock()
+    if outcome == "error":
+        handler.eval_specfile.side_effect = rpm.RPMSpecEvalError("out.spec", 1, b"boo")
+
+    results = rpm.eval_specfiles([] if outcome == "empty" else [handler], ["foo bar"])
+
+    if outcome == "empty":
+        assert results == []
+    elif outcome == "ok":
+        assert results == [handler.eval_specfile.return_value]
+        handler.eval_specfile.assert_called_once_with(["foo bar"])
+    else:
+        assert isinstance(results[0], rpm.RPMSpecEvalError)
+
+
+def test_eval_specfiles_last_alone(tmp_path):
+    spec = tmp_path / "a.spec"
+    spec.write_text("Name: a\nSource: a.tar.gz\n")
+    handlers = [make_handler(tmp_path, spec), mock.Mock(in_specfile_path="b.spec")]
+    handlers[1].run_rpmbuild.side_effect = rpm.RPMSpecEvalError("b.spec", 1, b"boo")
+
+    with (
+        mock.patch.object(rpm.RPMSpecHandler, "_get_need_conditionals_quirk", return_value=False),
+        mock.patch.object(rpm.RPMSpecHandler, "rpm_macro_values", return_value={}),
+        mock.patch.object(rpm.RPMSpecHandler, "write_rpm_macros"),
+        mock.patch.object(rpm.RPMSpecHandler, "_rpmbuild", return_value=(1, b"", b"")),
+        mock.patch.object(rpm.RPMSpecHandler, "run_rpmbuild", return_value=b"Source0: a\n"),
+    ):
+        results = rpm.eval_specfiles(handlers)
+
+    assert results[0]["sources"] == {0: "a"}
+    assert isinstance(results[1], rpm.RPMSpecEvalError)
+
+
+@pytest.mark.parametrize("strategy", rpm.EVAL_STRATEGIES)
+def test_write_preamble_batch_markers(strategy, tmp_path):
+    spec = tmp_path / "in.spec"
+    spec.write_text("Name: foo\n")
+    handler = make_handler(tmp_path, spec, strategy)
+    handler.batch_id = 7
+
+    with mock.patch.object(rpm.RPMSpecHandler, "_get_need_conditionals_quirk", return_value=False):
+        handler.write_preamble()
+
+    content = (tmp_path / "out" / "in.spec" / "out.spec").read_bytes()
+    if strategy == "lua":
+        assert b'io.stdout:write("@rpmspectool-spec@ begin 7\\n")' in content
+        assert content.endswith(
+            b'io.stdout:write("@rpmspectool-spec@ end 7\\n") io.stdout:flush()}\n'
+        )
+    else:
+        assert b"%prep\necho '@rpmspectool-spec@ begin 7'\ncat << EOF\n" in content
+        assert content.endswith(b"EOF\necho '@rpmspectool-spec@ end 7'\n")
+
+
+class TestRusagePopen:
+    def test_can_hook_try_wait(self):
+        # fails if a Python release changes the Popen internals RusagePopen relies on
+        assert rpm._can_hook_try_wait()
+
+        with mock.patch.object(rpm.Popen, "_try_wait", new=lambda self, flags, extra: None):
+            assert not rpm._can_hook_try_wait()
+
+        with mock.patch.object(rpm, "Popen", new=object):
+            assert not rpm._can_hook_try_wait()
+
+    def test_rusage_not_hookable(self):
+        with mock.patch.object(rpm, "_TRY_WAIT_HOOKABLE", new=False):
+            with rpm.RusagePopen(("true",)) as proc:
+                pass
+
+        assert proc.returncode == 0
+        assert proc.rusage is None
+
+    def test_rusage(self):
+        with rpm.RusagePopen(("true",)) as proc:
+            pass
+
+        assert proc.returncode == 0
+        assert proc.rusage.ru_maxrss > 0
+
+    def test_rusage_child_process_error(self):
+        with mock.patch.object(rpm.os, "wait4") as wait4:
+            wait4.side_effect = ChildProcessError()
+            with rpm.RusagePopen(("true",)) as proc:
+                pass
+
+        assert proc.returncode == 0
+        assert proc.rusage is None
+
+    def test_rusage_still_running(self):
+        with rpm.RusagePopen(("sleep", "10")) as proc:
+            with pytest.raises(subprocess.TimeoutExpired):
+                proc.wait(timeout=0.01)
+            assert proc.rusage is None
+            proc.kill()
+
+        assert proc.rusage is not None
@@ -0,0 +1,96 @@
+from unittest import mock
+
+import pytest
+
+from rpmspectool import schedule
+
+
+def make_record(name):
+    return {"url": f"https://example.com/{name}", "filename": name}
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    (
+        (0, "0 B"),
+        (1023, "1023 B"),
+        (1536, "1.5 KiB"),
+        (5 << 20, "5.0 MiB"),
+        (3 << 40, "3072.0 GiB"),
+    ),
+)
+def test_format_size(size, expected):
+    assert schedule._format_size(size) == expected
+
+
+def test_priority():
+    sched = schedule.DownloadSchedule(
+        {"https://example.com/big.tar.gz": 3000, "https://example.com/fix.patch": 1000}
+    )
+
+    records = [make_record(name) for name in ("fix.patch", "unknown.tar.gz", "big.tar.gz")]
+
+    # files of unknown size count as average ones
+    assert [r["filename"] for r in sorted(records, key=sched.priority)] == [
+        "big.tar.gz",
+        "unknown.tar.gz",
+        "fix.patch",
+    ]
+    assert sched.expected_size("https://example.com/unknown.tar.gz") == 2000
+    assert schedule.DownloadSchedule().expected_size("https://example.com/foo") == 0
+
+
+def test_probe():
+    sched = schedule.DownloadSchedule({"https://example.com/known.tar.gz": 10})
+    records = [
+        make_record(name) for name in ("known.tar.gz", "new.tar.gz", "missing.tar.gz", "ftp.tar")
+    ] + [{"url": "fix.patch", "filename": "fix.patch"}]
+
+    with mock.patch.object(schedule, "check_urls") as check_urls:
+        check_urls.return_value = [
+            {"url": "https://example.com/new.tar.gz", "ok": True, "size": 20},
+            {"url": "https://example.com/missing.tar.gz", "ok": False, "size": None},
+            {"url": "https://example.com/ftp.tar", "ok": True, "size": None},
+        ]
+        sched.probe(records, insecure=True)
+        # only once
+        sched.probe(records[:2])
+
+    check_urls.assert_called_once_with(
+        dict.fromkeys(
+            f"https://example.com/{name}" for name in ("new.tar.gz", "missing.tar.gz", "ftp.tar")
+        ),
+        insecure=True,
+    )
+    assert sched.sizes == {
+        "https://example.com/known.tar.gz": 10,
+        "https://example.com/new.tar.gz": 20,
+    }
+
+
+def test_progress():
+    sched = schedule.DownloadSchedule({"https://example.com/big.tar.gz": 3 << 20})
+    big, small, failing = (make_record(n) for n in ("big.tar.gz", "small.tar.gz", "fail.tar.gz"))
+    for record in (big, small, small, failing):
+        sched.add(record)
+
+    assert sched.remaining_bytes() == 12 << 20
+    assert sched.progress() == "Fetched 0 of 4 files, 0 B of 12.0 MiB, ETA unknown"
+
+    with mock.patch.object(schedule.time, "monotonic", side_effect=[100.0, 102.0, 103.0]):
+        sched.start()
+        sched.start()
+        sched.done(small, 1 << 20)
+        sched.done(failing)
+        # 1 MiB in 2 s, the small file's actual size is the new average
+        assert sched.remaining_bytes() == 4 << 20
+        assert sched.eta() == pytest.approx(8.0)
+        line = sched.progress()
+
+    assert line.startswith("Fetched 2 of 4 files, 1.0 MiB of 5.0 MiB, ETA ")
+    assert line.endswith(" (in 0:00:12)")
+
+    sched.done(small, 1 << 20)
+    sched.done(big, 3 << 20)
+    assert sched.eta() == 0.0
+    assert sched.progress().startswith("Fetched 4 of 4 files, 5.0 MiB of 5.0 MiB, ETA ")
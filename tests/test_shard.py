@@ -0,0 +1,116 @@
+import argparse
+import json
+
+import pytest
+
+from rpmspectool import shard
+
+SPECFILES = [f"pkg{i}/pkg{i}.spec" for i in range(20)]
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    (
+        ("1/4", (1, 4)),
+        ("4/4", (4, 4)),
+        ("0/4", argparse.ArgumentTypeError),
+        ("5/4", argparse.ArgumentTypeError),
+        ("1", argparse.ArgumentTypeError),
+        ("a/b", argparse.ArgumentTypeError),
+    ),
+)
+def test_shard_spec(value, expected):
+    if isinstance(expected, type):
+        with pytest.raises(expected):
+            shard.shard_spec(value)
+    else:
+        assert shard.shard_spec(value) == expected
+
+
+@pytest.mark.parametrize("weighted", (False, True), ids=("unweighted", "weighted"))
+def test_select_shard(weighted):
+    weights = {s: (i + 1) * 1000 for i, s in enumerate(SPECFILES[:15])} if weighted else None
+
+    shards = [shard.select_shard(SPECFILES, i, 3, weights=weights) for i in (1, 2, 3)]
+
+    # every spec file is in exactly one shard, in its original order
+    assert sorted(sum(shards, [])) == sorted(SPECFILES)
+    for selected in shards:
+        assert selected == [s for s in SPECFILES if s in selected]
+
+    # the assignment is deterministic
+    assert shards[0] == shard.select_shard(SPECFILES, 1, 3, weights=weights)
+
+    if weighted:
+        # unknown spec files count as average ones
+        average = sum(weights.values()) // len(weights)
+        loads = [sum(weights.get(s, average) for s in selected) for selected in shards]
+        assert max(loads) - min(loads) <= max(weights.values())
+    else:
+        # adding spec files doesn't move others between shards
+        more = shard.select_shard(SPECFILES + ["new/new.spec"], 1, 3)
+        assert [s for s in more if s != "new/new.spec"] == shards[0]
+
+
+def test_select_shard_no_known_weights():
+    # weights of other spec files don't help, all count the same
+    shards = [
+        shard.select_shard(SPECFILES[:6], i, 3, weights={"other.spec": 10}) for i in (1, 2, 3)
+    ]
+    assert [len(selected) for selected in shards] == [2, 2, 2]
+
+
+def write_jsonl(path, records):
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+
+
+def record(specfile, index, status="downloaded", size=100):
+    return {
+        "specfile": specfile,
+        "kind": "source",
+        "index": index,
+        "url": f"https://example.com/{specfile}-{index}.tar.gz",
+        "status": status,
+        "size": size,
+    }
+
+
+def test_merge_reports(tmp_path):
+    write_jsonl(tmp_path / "1.jsonl", [record("b.spec", 10), record("b.spec", 2)])
+    write_jsonl(
+        tmp_path / "2.jsonl",
+        [record("a.spec", 0, status="failed", size=None), record("b.spec", 2, size=200)],
+    )
+
+    report = shard.merge_reports([tmp_path / "1.jsonl", tmp_path / "2.jsonl"])
+
+    assert report["records"] == [
+        record("a.spec", 0, status="failed", size=None),
+        record("b.spec", 2, size=200),
+        record("b.spec", 10),
+    ]
+    assert report["summary"] == {
+        "specfiles": 2,
+        "files": 3,
+        "bytes": 300,
+        "status": {"downloaded": 2, "failed": 1},
+    }
+
+    # merged reports can be read back, e.g. to weigh shards
+    (tmp_path / "report.json").write_text(json.dumps(report))
+    records = shard.read_records(tmp_path / "report.json")
+    assert records == report["records"]
+    assert shard.spec_weights(records) == {"b.spec": 300}
+
+
+@pytest.mark.parametrize("problem", ("missing", "garbage"))
+def test_read_records_error(problem, tmp_path):
+    path = tmp_path / "report.jsonl"
+    if problem == "garbage":
+        path.write_text('{"specfile": "a.spec"}\nnot json\n')
+        match = "Can’t parse"
+    else:
+        match = "Can’t read"
+
+    with pytest.raises(shard.ShardError, match=match):
+        shard.read_records(path)
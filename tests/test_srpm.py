@@ -0,0 +1,158 @@
+import shutil
+from unittest import mock
+
+import pytest
+
+from rpmspectool import srpm
+
+from .util import SRPM_MEMBERS, SRPM_SPEC, make_srpm
+
+
+@pytest.mark.parametrize(
+    "path, expected",
+    (("foo-1-1.fc40.src.rpm", True), ("foo.spec", False), ("foo-1-1.x86_64.rpm", False)),
+)
+def test_is_srpm(path, expected):
+    assert srpm.is_srpm(path) == expected
+
+
+@pytest.mark.parametrize("stripped", (False, True), ids=("newc", "stripped"))
+@pytest.mark.parametrize("compressor", ("gzip", "bzip2", "xz", None))
+def test_read_spec(compressor, stripped, tmp_path):
+    path = tmp_path / "foo-1-1.src.rpm"
+    path.write_bytes(make_srpm(compressor=compressor, stripped=stripped))
+
+    assert srpm.read_spec(str(path)) == ("foo.spec", SRPM_SPEC)
+
+
+@pytest.mark.skipif(not shutil.which("zstd"), reason="needs the zstd program")
+def test_read_spec_zstd(tmp_path):
+    path = tmp_path / "foo-1-1.src.rpm"
+    path.write_bytes(make_srpm(compressor="zstd"))
+
+    with mock.patch.dict(srpm.PAYLOAD_OPENERS):
+        srpm.PAYLOAD_OPENERS.pop("zstd", None)
+        assert srpm.read_spec(str(path)) == ("foo.spec", SRPM_SPEC)
+
+
+def test_read_spec_zstd_missing(tmp_path):
+    path = tmp_path / "foo-1-1.src.rpm"
+    path.write_bytes(make_srpm(compressor="zstd"))
+
+    with (
+        mock.patch.dict(srpm.PAYLOAD_OPENERS),
+        mock.patch.object(
+            srpm.subprocess, "Popen", side_effect=FileNotFoundError(2, "No such file or directory")
+        ),
+    ):
+        srpm.PAYLOAD_OPENERS.pop("zstd", None)
+        with pytest.raises(srpm.SRPMError, match="zstd which isn’t available"):
+            srpm.read_spec(str(path))
+
+
+def test_read_spec_stops_at_spec(tmp_path):
+    """Members following the spec file aren't decompressed."""
+    path = tmp_path / "foo-1-1.src.rpm"
+    huge = b"\0" * (srpm.SKIP_CHUNK_SIZE * 3)
+    path.write_bytes(make_srpm(members=SRPM_MEMBERS + (("zzz.tar", huge),), compressor="xz"))
+
+    read_sizes = []
+    orig_open = srpm.PAYLOAD_OPENERS["xz"]
+
+    def open_payload(fobj):
+        payload = orig_open(fobj)
+        orig_read = payload.read
+
+        def read(size):
+            read_sizes.append(size)
+            return orig_read(size)
+
+        payload.read = read
+        return payload
+
+    with mock.patch.dict(srpm.PAYLOAD_OPENERS, {"xz": open_payload}):
+        assert srpm.read_spec(str(path)) == ("foo.spec", SRPM_SPEC)
+
+    assert sum(read_sizes) < len(SRPM_MEMBERS[0][1]) + 1024
+
+
+@pytest.mark.parametrize(
+    "kind, message",
+    (
+        ("missing", "Can’t read .*: No such file"),
+        ("not-rpm", "isn’t an RPM package"),
+        ("binary", "isn’t a source RPM package"),
+        ("truncated", "Can’t read .*: unexpected end of file"),
+        ("truncated-payload", "Can’t read .*: unexpected end of file"),
+        ("bad-header", "Can’t read .*: bad header magic"),
+        ("bad-payload", "Can’t read .*: Not a gzipped file"),
+        ("bad-cpio", "Can’t read .*: bad cpio magic"),
+        ("bad-index", "Can’t read .*: payload references unknown file 2"),
+        ("format", "unsupported payload format 'drpm'"),
+        ("compressor", "Can’t read .*: unsupported payload compressor 'lzip'"),
+        ("no-spec", "doesn’t contain a spec file"),
+    ),
+)
+def test_read_spec_error(kind, message, tmp_path):
+    path = tmp_path / "foo-1-1.src.rpm"
+
+    if kind == "not-rpm":
+        path.write_bytes(b"Name: foo\n" * 20)
+    elif kind == "binary":
+        path.write_bytes(make_srpm(lead_type=0))
+    elif kind == "truncated":
+        path.write_bytes(make_srpm()[:200])
+    elif kind == "truncated-payload":
+        path.write_bytes(make_srpm(mangle_cpio=lambda cpio: cpio[:1000]))
+    elif kind == "bad-header":
+        content = bytearray(make_srpm())
+        content[srpm.LEAD_SIZE] = 0
+        path.write_bytes(content)
+    elif kind == "bad-payload":
+        path.write_bytes(make_srpm(mangle_payload=lambda payload: b"garbage" * 20))
+    elif kind == "bad-cpio":
+        path.write_bytes(make_srpm(mangle_cpio=lambda cpio: b"123456" + cpio[6:]))
+    elif kind == "bad-index":
+        path.write_bytes(
+            make_srpm(
+                stripped=True,
+                mangle_cpio=lambda cpio: cpio.replace(b"07070X00000000", b"07070X00000002"),
+                members=SRPM_MEMBERS[:2],
+            )
+        )
+    elif kind == "format":
+        path.write_bytes(make_srpm(payload_format="drpm"))
+    elif kind == "compressor":
+        path.write_bytes(make_srpm(compressor="lzip"))
+    elif kind == "no-spec":
+        path.write_bytes(make_srpm(members=SRPM_MEMBERS[:1]))
+
+    with pytest.raises(srpm.SRPMError, match=message):
+        srpm.read_spec(str(path))
+
+
+@pytest.mark.parametrize("kind", ("spec", "srpm"))
+def test_open_spec(kind, tmp_path):
+    if kind == "spec":
+        path = tmp_path / "foo.spec"
+        path.write_bytes(SRPM_SPEC)
+    else:
+        path = tmp_path / "foo-1-1.src.rpm"
+        path.write_bytes(make_srpm())
+
+    with srpm.open_spec(str(path)) as fobj:
+        assert fobj.name == str(path)
+        assert fobj.read() == SRPM_SPEC
+
+
+def test_process_payload_close():
+    proc = mock.Mock()
+    payload = srpm._ProcessPayload(proc)
+    proc.stdout.read.return_value = b"data"
+
+    assert payload.read(4) == b"data"
+    payload.close()
+
+    proc.kill.assert_called_once_with()
+    proc.stdout.close.assert_called_once_with()
+    proc.wait.assert_called_once_with()
@@ -0,0 +1,92 @@
+import json
+import resource
+import threading
+from unittest import mock
+
+import pytest
+
+from rpmspectool import trace
+
+
+@pytest.fixture
+def tracer():
+    tracer = trace.start_tracing()
+    yield tracer
+    trace.stop_tracing()
+
+
+class TestTracer:
+    def test_span(self, tracer):
+        with tracer.span("outer", "test", foo="bar") as args:
+            args["baz"] = 5
+            with tracer.span("inner", "test"):
+                pass
+
+        inner, outer = tracer.events
+
+        assert outer["name"] == "outer"
+        assert outer["cat"] == "test"
+        assert outer["ph"] == "X"
+        assert outer["args"] == {"foo": "bar", "baz": 5}
+        assert outer["tid"] == threading.get_native_id()
+        assert outer["ts"] <= inner["ts"]
+        assert outer["ts"] + outer["dur"] >= inner["ts"] + inner["dur"]
+
+    def test_span_exception(self, tracer):
+        with pytest.raises(ValueError):
+            with tracer.span("failing", "test"):
+                raise ValueError()
+
+        assert [event["name"] for event in tracer.events] == ["failing"]
+
+    def test_write(self, tracer, tmp_path):
+        def worker():
+            with tracer.span("in thread", "test"):
+                pass
+
+        thread = threading.Thread(target=worker, name="worker")
+        thread.start()
+        thread.join()
+
+        with tracer.span("in main thread", "test"):
+            pass
+
+        trace_path = tmp_path / "trace.json"
+        tracer.write(trace_path)
+
+        with trace_path.open() as fobj:
+            data = json.load(fobj)
+
+        events = data["traceEvents"]
+        thread_names = {
+            event["tid"]: event["args"]["name"] for event in events if event["ph"] == "M"
+        }
+        spans = {event["name"]: event for event in events if event["ph"] == "X"}
+
+        assert set(spans) == {"in thread", "in main thread"}
+        assert thread_names[spans["in main thread"]["tid"]] == "MainThread"
+        # the worker thread is gone by now
+        assert thread_names[spans["in thread"]["tid"]].startswith("thread-")
+
+
+def test_span_not_tracing():
+    assert trace.stop_tracing() is None
+
+    with trace.span("nothing", "test", foo="bar") as args:
+        args["baz"] = 5
+
+    assert args == {"foo": "bar", "baz": 5}
+
+
+def test_span_tracing(tracer):
+    with trace.span("something", "test", foo="bar") as args:
+        args["baz"] = 5
+
+    assert tracer.events[0]["args"] == {"foo": "bar", "baz": 5}
+
+
+def test_rusage_args():
+    assert trace.rusage_args(None) == {}
+
+    rusage = mock.Mock(ru_utime=1.5, ru_stime=0.5, ru_maxrss=1024, spec=resource.struct_rusage)
+    assert trace.rusage_args(rusage) == {"utime": 1.5, "stime": 0.5, "maxrss_kib": 1024}
@@ -0,0 +1,80 @@
+import subprocess
+
+import pytest
+
+from rpmspectool import tree
+
+SPEC = """Name: {name}
+Version: 1
+Source0: https://example.com/{name}-%{{version}}.tar.gz
+
+%description
+Test.
+
+%changelog
+- Initial package
+"""
+
+
+def git(path, *args):
+    subprocess.run(
+        ("git", "-C", str(path), "-c", "user.name=Test", "-c", "user.email=test@example.com")
+        + args,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+@pytest.fixture
+def repo(tmp_path):
+    for name in ("foo", "bar", "baz"):
+        pkgdir = tmp_path / name
+        pkgdir.mkdir()
+        (pkgdir / f"{name}.spec").write_text(SPEC.format(name=name))
+        (pkgdir / tree.SOURCES_FILE).write_text(f"SHA512 ({name}-1.tar.gz) = 0123\n")
+    git(tmp_path, "init", "-q")
+    git(tmp_path, "add", ".")
+    git(tmp_path, "commit", "-q", "-m", "Initial commit")
+    return tmp_path
+
+
+def test_find_specfiles(tmp_path):
+    (tmp_path / "b").mkdir()
+    (tmp_path / "b" / "b.spec").write_text("")
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a" / "a.spec").write_text("")
+    (tmp_path / "a" / "a.patch").write_text("")
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".git" / "hidden.spec").write_text("")
+
+    assert list(tree.find_specfiles([str(tmp_path), "other.spec"])) == [
+        str(tmp_path / "a" / "a.spec"),
+        str(tmp_path / "b" / "b.spec"),
+        "other.spec",
+    ]
+
+
+def test_changed_specfiles(repo):
+    specfiles = [str(repo / name / f"{name}.spec") for name in ("foo", "bar", "baz", "new")]
+
+    # only the changelog changed
+    with (repo / "foo" / "foo.spec").open("a") as fobj:
+        fobj.write("- Rebuilt\n")
+    # the preamble changed
+    spec = repo / "bar" / "bar.spec"
+    spec.write_text(spec.read_text().replace("Version: 1", "Version: 2"))
+    git(repo, "commit", "-q", "-a", "-m", "Update")
+    # the sources file changed, uncommitted
+    (repo / "baz" / tree.SOURCES_FILE).write_text("SHA512 (baz-1.tar.gz) = 4567\n")
+    # the spec file is new, untracked
+    (repo / "new").mkdir()
+    (repo / "new" / "new.spec").write_text(SPEC.format(name="new"))
+
+    # spec files in the same directory share lookups
+    assert tree.changed_specfiles(specfiles + specfiles[:1], "HEAD~1") == set(specfiles[1:])
+    assert tree.changed_specfiles(specfiles, "HEAD") == set(specfiles[2:])
+
+
+def test_changed_specfiles_unknown_rev(repo):
+    with pytest.raises(tree.TreeError, match=r"^git diff .* failed: "):
+        tree.changed_specfiles([str(repo / "foo" / "foo.spec")], "doesnotexist")
@@ -0,0 +1,77 @@
+import errno
+import os
+from unittest import mock
+
+import pytest
+
+from rpmspectool import watch
+
+
+@pytest.fixture
+def specpath(tmp_path):
+    specpath = tmp_path / "test.spec"
+    specpath.write_text("Name: test\n")
+    return specpath
+
+
+def test_libc_without_inotify():
+    with (
+        mock.patch.object(watch.ctypes, "CDLL", return_value=mock.Mock(spec=[])),
+        pytest.raises(watch.WatchError, match="needs inotify"),
+    ):
+        watch.SpecWatcher([])
+
+
+class TestSpecWatcher:
+    @pytest.mark.parametrize("how", ("write", "rename"))
+    def test_wait(self, how, specpath, tmp_path):
+        other_specpath = tmp_path / "other.spec"
+        other_specpath.write_text("Name: other\n")
+
+        with watch.SpecWatcher([str(specpath), str(other_specpath)]) as watcher:
+            # nothing changed yet
+            assert watcher.wait(timeout=0) == set()
+
+            # changes to other files don't count
+            (tmp_path / "unrelated").write_text("")
+            assert watcher.wait(timeout=0.2) == set()
+
+            if how == "write":
+                specpath.write_text("Name: changed\n")
+            else:  # how == "rename"
+                new_path = tmp_path / "test.spec.new"
+                new_path.write_text("Name: changed\n")
+                new_path.rename(specpath)
+
+            assert watcher.wait(timeout=5) == {str(specpath)}
+
+            # closing twice is fine
+            watcher.close()
+
+        assert watcher.fd == -1
+
+    def test_queue_overflow(self, specpath):
+        with watch.SpecWatcher([str(specpath)]) as watcher:
+            event = watch.EVENT_HEADER.pack(-1, watch.IN_Q_OVERFLOW, 0, 0)
+            with mock.patch.object(watch.os, "read", return_value=event):
+                assert watcher._read_events() == {str(specpath)}
+
+    def test_init_failure(self):
+        libc = mock.Mock()
+        libc.inotify_init1.return_value = -1
+
+        with (
+            mock.patch.object(watch, "_libc", return_value=libc),
+            mock.patch.object(watch.ctypes, "get_errno", return_value=errno.EMFILE),
+            pytest.raises(watch.WatchError, match="Couldn’t initialize inotify: "),
+        ):
+            watch.SpecWatcher([])
+
+    def test_watch_failure(self, tmp_path):
+        with (
+            mock.patch.object(watch.os, "close", wraps=os.close) as close,
+            pytest.raises(watch.WatchError, match="Couldn’t watch '.*/missing'"),
+        ):
+            watch.SpecWatcher([str(tmp_path / "missing" / "test.spec")])
+
+        close.assert_called_once()
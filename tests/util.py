@@ -1,6 +1,13 @@
+import bz2
+import gzip
+import lzma
 import os
+import struct
+import subprocess
 from contextlib import contextmanager
 
+from rpmspectool import srpm
+
 
 @contextmanager
 def changed_directory(location):
@@ -16,3 +23,99 @@ def changed_directory(location):
         pass
 
     os.chdir(previous)
+
+
+SRPM_SPEC = b"Name: foo\nSource0: https://example.com/foo-1.tar.gz\n"
+
+SRPM_MEMBERS = (
+    ("foo-1.tar.gz", b"\x1f\x8b" + bytes(range(256)) * 100),
+    ("foo.spec", SRPM_SPEC),
+    ("zzz.patch", b"--- a/foo\n+++ b/foo\n"),
+)
+
+
+def make_header(tags):
+    """Build a header structure from (tag, type, value) tuples."""
+    index = b""
+    store = b""
+    for tag, type_, value in tags:
+        if type_ == srpm.TYPE_INT32:
+            data = struct.pack(f">{len(value)}I", *value)
+            count = len(value)
+        elif type_ == srpm.TYPE_INT64:
+            store += b"\0" * (-len(store) % 8)
+            data = struct.pack(f">{len(value)}Q", *value)
+            count = len(value)
+        elif type_ == srpm.TYPE_STRING:
+            data = value.encode("utf-8") + b"\0"
+            count = 1
+        else:
+            data = b"".join(v.encode("utf-8") + b"\0" for v in value)
+            count = len(value)
+        index += srpm.HEADER_INDEX_ENTRY.pack(tag, type_, len(store), count)
+        store += data
+    return srpm.HEADER_INTRO.pack(srpm.HEADER_MAGIC, len(index) // 16, len(store)) + index + store
+
+
+def make_cpio(members, stripped=False):
+    data = b""
+    for fileindex, (name, content) in enumerate(members + ((srpm.CPIO_TRAILER, b""),)):
+        if stripped and name != srpm.CPIO_TRAILER:
+            data += srpm.CPIO_STRIPPED_MAGIC + b"%08x" % fileindex + b"\0\0"
+        else:
+            namesize = len(name) + 1
+            data += srpm.CPIO_NEWC_MAGIC + b"%08x" * 13 % (
+                (0, 0o100644, 0, 0, 1, 0, len(content), 0, 0, 0, 0, namesize, 0)
+            )
+            data += name.encode("utf-8") + b"\0"
+            data += b"\0" * (-len(data) % 4)
+        data += content + b"\0" * (-len(content) % 4)
+    return data
+
+
+def make_srpm(
+    members=SRPM_MEMBERS,
+    compressor="gzip",
+    stripped=False,
+    lead_type=srpm.LEAD_TYPE_SOURCE,
+    payload_format="cpio",
+    mangle_cpio=None,
+    mangle_payload=None,
+):
+    lead = srpm.LEAD_MAGIC + struct.pack(">BBH", 3, 0, lead_type)
+    lead += b"\0" * (srpm.LEAD_SIZE - len(lead))
+
+    signature = make_header([(1000, srpm.TYPE_INT32, (12345,))])
+    signature += b"\0" * (-len(signature) % 8)
+
+    tags = [
+        (1000, srpm.TYPE_STRING, "foo"),
+        (srpm.TAG_BASENAMES, srpm.TYPE_STRING_ARRAY, [name for name, _ in members]),
+        (srpm.TAG_PAYLOADFORMAT, srpm.TYPE_STRING, payload_format),
+    ]
+    if stripped:
+        tags.append(
+            (srpm.TAG_LONGFILESIZES, srpm.TYPE_INT64, [len(content) for _, content in members])
+        )
+    else:
+        tags.append((srpm.TAG_FILESIZES, srpm.TYPE_INT32, [len(content) for _, content in members]))
+    if compressor:
+        tags.append((srpm.TAG_PAYLOADCOMPRESSOR, srpm.TYPE_STRING, compressor))
+
+    cpio = make_cpio(members, stripped)
+    if mangle_cpio:
+        cpio = mangle_cpio(cpio)
+    if compressor in (None, "gzip"):
+        payload = gzip.compress(cpio)
+    elif compressor == "bzip2":
+        payload = bz2.compress(cpio)
+    elif compressor == "xz":
+        payload = lzma.compress(cpio)
+    elif compressor == "zstd":
+        payload = subprocess.run(("zstd", "-cq"), input=cpio, stdout=subprocess.PIPE).stdout
+    else:
+        payload = cpio
+    if mangle_payload:
+        payload = mangle_payload(payload)
+
+    return lead + signature + make_header(tags) + payload